@@ -1,15 +1,21 @@
 # -*- coding: utf-8 -*-
-from copy import deepcopy
+from collections import deque
+from copy import copy, deepcopy
+import datetime
+from decimal import Decimal
 from time import time
 from django.conf import settings
 from django.db.models import Q
 from django.db.models.base import ModelBase
 from django.utils import tree
 from django.utils.encoding import force_unicode
-from haystack.constants import DJANGO_CT, VALID_FILTERS, FILTER_SEPARATOR, DEFAULT_ALIAS
+from haystack import instrumentation
+from haystack.constants import DJANGO_CT, VALID_FILTERS, FILTER_SEPARATOR, DEFAULT_ALIAS, QUERY_STRING_CACHE_SIZE, QUERY_LOG_SIZE
 from haystack.exceptions import MoreLikeThisError, FacetingError
+from haystack.metrics import MeteredBackend
 from haystack.models import SearchResult
-from haystack.utils.loading import UnifiedIndex
+from haystack.utils import LRUCache, get_identifier
+from haystack.utils.loading import UnifiedIndex, import_class
 
 
 VALID_GAPS = ['year', 'month', 'day', 'hour', 'minute', 'second']
@@ -17,29 +23,75 @@ VALID_GAPS = ['year', 'month', 'day', 'hour', 'minute', 'second']
 
 def log_query(func):
     """
-    A decorator for pseudo-logging search queries. Used in the ``SearchBackend``
-    to wrap the ``search`` method.
+    A decorator for instrumenting the query methods of a ``SearchBackend``,
+    such as ``search``.
+    
+    The call, its arguments & the time spent in it go into the current
+    ``QueryRecord`` for any instrumentation sinks. When ``DEBUG`` is on, the
+    query is also added to the connection's (bounded) ``queries`` log.
     """
     def wrapper(obj, query_string, *args, **kwargs):
-        start = time()
-        
-        try:
-            return func(obj, query_string, *args, **kwargs)
-        finally:
-            stop = time()
-            
-            if settings.DEBUG:
-                from haystack import connections
-                connections[obj.connection_alias].queries.append({
-                    'query_string': query_string,
-                    'additional_args': args,
-                    'additional_kwargs': kwargs,
-                    'time': "%.3f" % (stop - start),
-                })
+        return run_logged(obj, func.__name__, query_string, args, kwargs, lambda: func(obj, query_string, *args, **kwargs))
+    
+    return wrapper
+
+
+def log_more_like_this(func):
+    """
+    Like ``log_query``, but for a ``SearchBackend``'s ``more_like_this``.
+    
+    The ``additional_query_string`` is recorded as the query, with the
+    identifier of the model instance added to the arguments.
+    """
+    def wrapper(obj, model_instance, additional_query_string=None, *args, **kwargs):
+        logged_kwargs = dict(kwargs, model_instance=get_identifier(model_instance))
+        return run_logged(obj, func.__name__, additional_query_string, args, logged_kwargs, lambda: func(obj, model_instance, additional_query_string, *args, **kwargs))
     
     return wrapper
 
 
+def run_logged(obj, action, query_string, args, kwargs, call):
+    """
+    Runs ``call`` (a backend query method) for ``log_query`` &
+    ``log_more_like_this``.
+    """
+    record = instrumentation.start(obj.connection_alias, action)
+    
+    if record is not None:
+        record.add_backend_call(obj.connection_alias, action, query_string, kwargs)
+        record.enter_phase()
+    
+    start = time()
+    
+    try:
+        results = call()
+        
+        if record is not None:
+            record.add_hits(results)
+        
+        return results
+    except Exception, e:
+        if record is not None and record.error is None:
+            record.error = e
+        
+        raise
+    finally:
+        elapsed = time() - start
+        
+        if record is not None:
+            record.exit_phase('backend', elapsed)
+            instrumentation.stop(record)
+        
+        if settings.DEBUG:
+            from haystack import connections
+            connections[obj.connection_alias].queries.append({
+                'query_string': query_string,
+                'additional_args': args,
+                'additional_kwargs': kwargs,
+                'time': "%.3f" % elapsed,
+            })
+
+
 class EmptyResults(object):
     hits = 0
     docs = []
@@ -57,10 +109,21 @@ class EmptyResults(object):
 class BaseSearchBackend(object):
     """
     Abstract search engine base class.
+    
+    The latency, errors & documents of ``search``, ``more_like_this``,
+    ``update``, ``remove`` & ``clear`` are recorded in
+    ``haystack.metrics.registry`` for every subclass.
     """
+    __metaclass__ = MeteredBackend
+    
     # Backends should include their own reserved words/characters.
     RESERVED_WORDS = []
     RESERVED_CHARACTERS = []
+    # Whether ``search`` accepts a ``cursor`` for paging through deep results.
+    supports_cursors = False
+    # Whether ``search`` saves work by leaving out stored fields that aren't
+    # in its ``fields``, which ``fetch_fields`` then loads on access.
+    supports_deferred_fields = True
     
     def __init__(self, connection_alias, **connection_options):
         self.connection_alias = connection_alias
@@ -102,7 +165,8 @@ class BaseSearchBackend(object):
     def search(self, query_string, sort_by=None, start_offset=0, end_offset=None,
                fields='', highlight=False, facets=None, date_facets=None, query_facets=None,
                narrow_queries=None, spelling_query=None,
-               limit_to_registered_models=None, result_class=None, **kwargs):
+               limit_to_registered_models=None, result_class=None, cursor=None,
+               values=None, include_spelling=None, **kwargs):
         """
         Takes a query to search on and returns dictionary.
         
@@ -113,11 +177,99 @@ class BaseSearchBackend(object):
         objects. The 'hits' should be an integer count of the number of matched
         results the search backend found.
         
+        Backends with ``supports_cursors`` also accept a ``cursor`` (``'*'``
+        for the first page). The results then follow on from the cursor
+        instead of the ``start_offset`` & the dictionary has a 'next_cursor'
+        key, which is ``None`` once there are no more results.
+        
+        If a list of field names is provided as ``values``, backends should
+        fetch only those stored fields & return a dictionary of them for each
+        result, instead of a ``SearchResult``. Backends that don't can return
+        ``SearchResult`` objects as usual; they get converted afterward.
+        
+        Passing ``include_spelling=False`` skips the spelling suggestion for
+        this search, even if the connection has ``INCLUDE_SPELLING`` on.
+        
         This method MUST be implemented by each backend, as it will be highly
         specific to each one.
         """
         raise NotImplementedError
     
+    def fetch_fields(self, identifier, index, fields):
+        """
+        Returns a dictionary of the provided stored ``fields`` (converted
+        by the ``index``) for the document with the given ``identifier``, or
+        ``None`` if it's not in the index.
+        
+        Used to load fields that were deferred on a ``SearchResult``.
+        """
+        raise NotImplementedError
+    
+    def multi_search(self, searches):
+        """
+        Takes a list of ``(query_string, kwargs)`` searches & returns a list
+        of the dictionaries ``search`` returns for each, in the same order.
+        
+        By default, the searches run one after the other. Backends that can
+        do better (such as running them concurrently) should override this.
+        """
+        return [self.search(query_string, **kwargs) for query_string, kwargs in searches]
+    
+    def count(self, query_string, narrow_queries=None,
+              limit_to_registered_models=None, **kwargs):
+        """
+        Takes a query to search on and returns the number of matching results.
+        
+        No documents are needed for this, so backends that can count matches
+        without fetching them should override this. By default, this runs a
+        ``search`` for a single result & returns the hits from it.
+        """
+        results = self.search(query_string, start_offset=0, end_offset=1,
+                              narrow_queries=narrow_queries,
+                              limit_to_registered_models=limit_to_registered_models,
+                              **kwargs)
+        return results.get('hits', 0)
+    
+    def estimate_count(self, query_string, threshold, narrow_queries=None,
+                       limit_to_registered_models=None, **kwargs):
+        """
+        Takes a query to search on & returns a dictionary with the number of
+        matching results ('hits') & whether that number is exact ('exact').
+        
+        Backends only need to count exactly up to ``threshold`` matches.
+        Past that, they may stop counting & estimate the rest instead. By
+        default, this returns the exact ``count``.
+        """
+        hits = self.count(query_string, narrow_queries=narrow_queries,
+                          limit_to_registered_models=limit_to_registered_models,
+                          **kwargs)
+        return {
+            'hits': hits,
+            'exact': True,
+        }
+    
+    def facet_counts(self, query_string, facets=None, date_facets=None, query_facets=None,
+                     narrow_queries=None, limit_to_registered_models=None, **kwargs):
+        """
+        Takes a query to search on & returns a dictionary with the number of
+        matching results ('hits') & the counts for the requested facets
+        ('facets'), in the same form ``search`` provides them.
+        
+        No documents are needed for this, so backends that can facet without
+        fetching them should override this. By default, this runs a
+        ``search`` for a single result & returns the hits & facets from it.
+        """
+        results = self.search(query_string, start_offset=0, end_offset=1,
+                              facets=facets, date_facets=date_facets,
+                              query_facets=query_facets,
+                              narrow_queries=narrow_queries,
+                              limit_to_registered_models=limit_to_registered_models,
+                              **kwargs)
+        return {
+            'hits': results.get('hits', 0),
+            'facets': results.get('facets', {}),
+        }
+    
     def prep_value(self, value):
         """
         Hook to give the backend a chance to prep an attribute value before
@@ -153,12 +305,7 @@ class BaseSearchBackend(object):
         consistent caching.
         """
         from haystack import connections
-        models = []
-        
-        for model in connections[self.connection_alias].get_unified_index().get_indexed_models():
-            models.append(u"%s.%s" % (model._meta.app_label, model._meta.module_name))
-        
-        return models
+        return list(connections[self.connection_alias].get_unified_index().get_models_list())
 
 
 # Alias for easy loading within SearchQuery objects.
@@ -212,6 +359,177 @@ class SearchNode(tree.Node):
         
         return query_string
     
+    def __copy__(self):
+        """
+        Copies the root node only. Anything below it is shared with the copy.
+        
+        Building a query only ever changes the root (``add``, ``negate`` &
+        the ``*_subtree`` methods all swap in new child nodes rather than
+        altering existing ones), so this is all the copying needed for
+        another query to build on the tree safely.
+        """
+        obj = self._new_instance(self.children, self.connector, self.negated)
+        obj.subtree_parents = deepcopy(self.subtree_parents)
+        return obj
+    
+    def cache_key(self):
+        """
+        Returns a hashable version of the tree, for caching what it compiles
+        to, or ``None`` if any of its values can't be safely compared.
+        """
+        children = []
+        
+        for child in self.children:
+            key = clause_key(child)
+            
+            if key is None:
+                return None
+            
+            children.append(key)
+        
+        return (self.connector, self.negated, tuple(children))
+    
+    def normalize(self):
+        """
+        Returns a simplified copy of the tree, or ``None`` if it can never
+        match anything.
+        
+        Groups with the same connector as their parent are merged into it,
+        groups of one are unwrapped, double negatives cancel out & duplicate
+        clauses are dropped. The field lookups in each group are then sorted,
+        so that the same filters applied in a different order make the same
+        query. A clause ANDed with its own negation (or an ``__in`` an empty
+        list) can't match anything, while one ORed with its negation matches
+        everything.
+        
+        Plain search terms (``content``) keep their order, ahead of everything
+        else, as their meaning may depend on it.
+        
+        The tree itself is left untouched.
+        """
+        node = self._normalize()
+        
+        if node is MATCH_NOTHING:
+            return None
+        
+        if node is MATCH_EVERYTHING:
+            return self._new_instance(connector=self.default)
+        
+        if not isinstance(node, SearchNode) or node.negated:
+            return self._new_instance([node], self.default)
+        
+        return node
+    
+    def _normalize(self):
+        # Returns a new node, a single clause or ``MATCH_NOTHING`` /
+        # ``MATCH_EVERYTHING``.
+        if self.connector == self.AND:
+            absorbing, identity = MATCH_NOTHING, MATCH_EVERYTHING
+        else:
+            absorbing, identity = MATCH_EVERYTHING, MATCH_NOTHING
+        
+        children = []
+        
+        for child in self.children:
+            if isinstance(child, SearchNode):
+                child = child._normalize()
+            elif self.matches_nothing(child):
+                child = MATCH_NOTHING
+            
+            if child is absorbing:
+                return self._negate_match(absorbing)
+            
+            if child is identity:
+                continue
+            
+            if isinstance(child, SearchNode) and not child.negated and child.connector == self.connector:
+                children.extend(child.children)
+            else:
+                children.append(child)
+        
+        if not children:
+            if self.children:
+                return self._negate_match(identity)
+            
+            return self._negate_match(MATCH_EVERYTHING)
+        
+        seen = set()
+        unique = []
+        sortable = True
+        
+        for child in children:
+            key = clause_key(child)
+            
+            if key is None:
+                sortable = False
+            elif key in seen:
+                continue
+            else:
+                seen.add(key)
+            
+            unique.append(child)
+        
+        for child in unique:
+            if isinstance(child, SearchNode) and child.negated:
+                key = clause_key(child)
+                
+                if key is None:
+                    continue
+                
+                if len(child.children) == 1:
+                    opposite = key[2][0]
+                else:
+                    opposite = (key[0], False, key[2])
+                
+                if opposite in seen:
+                    return self._negate_match(absorbing)
+        
+        if sortable:
+            unique.sort(key=self._sort_key)
+        
+        if len(unique) == 1:
+            child = unique[0]
+            
+            if not self.negated:
+                return child
+            
+            if isinstance(child, SearchNode) and child.negated:
+                if len(child.children) == 1:
+                    return child.children[0]
+                
+                return self._new_instance(child.children, child.connector)
+        
+        return self._new_instance(unique, self.connector, self.negated)
+    
+    def _sort_key(self, clause):
+        # Plain search terms stay first, in the order they were given, as
+        # their meaning can depend on it (quotes left open by one term may be
+        # closed by a later one). Field lookups follow, then groups.
+        if isinstance(clause, SearchNode):
+            return (2, repr(clause.cache_key()))
+        
+        field, filter_type = self.split_expression(clause[0])
+        
+        if field == 'content':
+            return (0, '')
+        
+        return (1, repr(clause_key(clause)))
+    
+    def _negate_match(self, match):
+        if not self.negated:
+            return match
+        
+        if match is MATCH_NOTHING:
+            return MATCH_EVERYTHING
+        
+        return MATCH_NOTHING
+    
+    def matches_nothing(self, clause):
+        """Indicates if a single clause can never match anything."""
+        expression, value = clause
+        field, filter_type = self.split_expression(expression)
+        return filter_type == 'in' and isinstance(value, (list, tuple)) and not value
+    
     def split_expression(self, expression):
         """Parses an expression and determines the field and filter type."""
         parts = expression.split(FILTER_SEPARATOR)
@@ -225,6 +543,50 @@ class SearchNode(tree.Node):
         return (field, filter_type)
 
 
+def clause_key(clause):
+    """
+    Returns a hashable version of a ``SearchNode`` or one of its
+    ``(expression, value)`` clauses, or ``None`` if it can't be safely compared.
+    """
+    if isinstance(clause, SearchNode):
+        return clause.cache_key()
+    
+    expression, value = clause
+    key = cache_value(value)
+    
+    if key is None:
+        return None
+    
+    return (expression, key)
+
+
+def cache_value(value):
+    """
+    Returns a hashable version of a filter's value for ``SearchNode.cache_key``
+    or ``None`` if it isn't safe to use.
+    
+    The type is kept, as ``1``, ``1.0`` & ``True`` all compare equal but make
+    different queries.
+    """
+    if isinstance(value, (list, tuple)):
+        values = []
+        
+        for item in value:
+            item = cache_value(item)
+            
+            if item is None:
+                return None
+            
+            values.append(item)
+        
+        return (type(value), tuple(values))
+    
+    if isinstance(value, CACHEABLE_VALUE_TYPES):
+        return (type(value), value)
+    
+    return None
+
+
 class SQ(Q, SearchNode):
     """
     Manages an individual condition within a query.
@@ -236,6 +598,30 @@ class SQ(Q, SearchNode):
     pass
 
 
+# Compiled query strings, shared by every query in the process. Identical
+# filters get built over & over again, so there's no need to compile each one
+# more than once.
+QUERY_STRING_CACHE = LRUCache(QUERY_STRING_CACHE_SIZE)
+
+# What ``SearchNode.normalize`` reduces branches that need no query to.
+MATCH_NOTHING = object()
+MATCH_EVERYTHING = object()
+
+# Values simple enough to go into a ``QUERY_STRING_CACHE`` key.
+CACHEABLE_VALUE_TYPES = (
+    basestring, int, long, float, bool, type(None), Decimal, datetime.date,
+    datetime.time,
+)
+
+
+# The parts of a ``BaseSearchQuery`` that get shared with its clones, until
+# either one of them changes it.
+COPY_ON_WRITE_ATTRIBUTES = (
+    'query_filter', 'order_by', 'models', 'boost', 'facets', 'date_facets',
+    'query_facets', 'narrow_queries', 'deferred_fields',
+)
+
+
 class BaseSearchQuery(object):
     """
     A base class for handling the query itself.
@@ -262,7 +648,17 @@ class BaseSearchQuery(object):
         self.boost = {}
         self.start_offset = 0
         self.end_offset = None
+        self.cursor = None
+        self.values = None
+        self.only_fields = None
+        self.deferred_fields = set()
         self.highlight = False
+        # ``None`` leaves spelling suggestions up to the connection's
+        # ``INCLUDE_SPELLING``.
+        self.include_spelling = None
+        # Once this many hits have been counted, backends may estimate the
+        # rest. ``None`` always counts exactly.
+        self.count_threshold = None
         self.facets = set()
         self.date_facets = {}
         self.query_facets = []
@@ -273,13 +669,46 @@ class BaseSearchQuery(object):
         self._mlt_instance = None
         self._results = None
         self._hit_count = None
+        self._hit_count_is_exact = True
         self._facet_counts = None
         self._spelling_suggestion = None
+        self._next_cursor = None
         self.result_class = SearchResult
-        
-        from haystack import connections
+        # Which of the ``COPY_ON_WRITE_ATTRIBUTES`` are currently shared with
+        # another query.
+        self._shared = set()
+        # What ``query_filter`` normalizes & compiles to, once they've been
+        # worked out.
+        self._normalized_filter = None
+        self._matches_nothing = None
+        self._compiled_filter = None
         self._using = using
-        self.backend = connections[self._using].get_backend()
+        self._backend = None
+    
+    def _get_backend(self):
+        # Most clones are thrown away a call later, so only set up the
+        # backend once it's actually needed.
+        if self._backend is None:
+            from haystack import connections
+            self._backend = connections[self._using].get_backend()
+        
+        return self._backend
+    
+    def _set_backend(self, backend):
+        self._backend = backend
+    
+    backend = property(_get_backend, _set_backend)
+    
+    def _writable(self, name):
+        """
+        Returns the named attribute, first copying it if it's still shared
+        with another query, so that it's safe to change in place.
+        """
+        if name in self._shared:
+            setattr(self, name, copy(getattr(self, name)))
+            self._shared.discard(name)
+        
+        return getattr(self, name)
     
     def __str__(self):
         return self.build_query()
@@ -287,14 +716,17 @@ class BaseSearchQuery(object):
     def __getstate__(self):
         """For pickling."""
         obj_dict = self.__dict__.copy()
-        del(obj_dict['backend'])
+        obj_dict['_backend'] = None
+        # Once unpickled, nothing's shared with another query.
+        obj_dict['_shared'] = set()
+        obj_dict['_normalized_filter'] = None
+        obj_dict['_matches_nothing'] = None
+        obj_dict['_compiled_filter'] = None
         return obj_dict
     
     def __setstate__(self, obj_dict):
         """For unpickling."""
-        from haystack import connections
         self.__dict__.update(obj_dict)
-        self.backend = connections[self._using].get_backend()
     
     def has_run(self):
         """Indicates if any query has been been run."""
@@ -325,30 +757,162 @@ class BaseSearchQuery(object):
             kwargs['query_facets'] = self.query_facets
         
         if self.narrow_queries:
-            kwargs['narrow_queries'] = self.narrow_queries
+            # Backends may add to this, so hand over a copy.
+            kwargs['narrow_queries'] = set(self.narrow_queries)
         
         if spelling_query:
             kwargs['spelling_query'] = spelling_query
         
+        if self.include_spelling is not None:
+            kwargs['include_spelling'] = self.include_spelling
+        
         if self.boost:
             kwargs['boost'] = self.boost
         
         if self.result_class:
             kwargs['result_class'] = self.result_class
         
+        if self.cursor is not None:
+            kwargs['cursor'] = self.cursor
+        
+        if self.values is not None:
+            kwargs['values'] = self.values
+        
+        loaded_fields = self.get_loaded_fields()
+        
+        if loaded_fields is not None:
+            kwargs['fields'] = loaded_fields
+        
         return kwargs
     
-    def run(self, spelling_query=None):
-        """Builds and executes the query. Returns a list of search results."""
+    @instrumentation.timed('build')
+    def build_search(self, spelling_query=None):
+        """
+        Returns the ``(query_string, kwargs)`` that ``run`` sends to the
+        backend's ``search``.
+        """
         final_query = self.build_query()
         kwargs = self.build_params(spelling_query=spelling_query)
+        return final_query, kwargs
+    
+    @instrumentation.traced
+    def run(self, spelling_query=None):
+        """Builds and executes the query. Returns a list of search results."""
+        if self.matches_nothing():
+            self.set_search_results({})
+            return
         
-        results = self.backend.search(final_query, **kwargs)
+        final_query, kwargs = self.build_search(spelling_query=spelling_query)
+        self.set_search_results(self.run_search(final_query, **kwargs))
+    
+    def set_search_results(self, results):
+        """
+        Stores the dictionary returned by the backend's ``search`` as the
+        results of the query.
+        """
         self._results = results.get('results', [])
         self._hit_count = results.get('hits', 0)
+        self._hit_count_is_exact = True
         self._facet_counts = self.post_process_facets(results)
         self._spelling_suggestion = results.get('spelling_suggestion', None)
+        self._next_cursor = results.get('next_cursor', None)
+    
+    def run_search(self, query_string, **kwargs):
+        """
+        Sends a search to the backend & returns what it found.
+        
+        If the connection has a ``QUERY_CACHE``, identical searches are
+        answered from the cache until they expire or one of the models they
+        could return gets updated.
+        """
+        return self._cached_backend_call('search', query_string, kwargs)
+    
+    def _cached_backend_call(self, action, query_string, kwargs):
+        from haystack import connections
+        backend_method = getattr(self.backend, action)
+        query_cache = connections[self._using].get_query_cache()
+        
+        if query_cache is None:
+            return backend_method(query_string, **kwargs)
+        
+        return query_cache.fetch(action, query_string, kwargs, self.get_cache_models(), lambda: backend_method(query_string, **kwargs))
+    
+    def get_cache_models(self):
+        """
+        Returns the models whose updates should invalidate cached results for
+        this query.
+        """
+        from haystack import connections
+        return self.models or connections[self._using].get_unified_index().get_indexed_models()
     
+    @instrumentation.traced
+    def run_count(self):
+        """
+        Builds and executes a count-only query. Stores the number of hits
+        without fetching any results.
+        
+        With a ``count_threshold``, the backend may estimate the number of
+        hits past the threshold rather than counting them all.
+        """
+        self._hit_count_is_exact = True
+        
+        if self.matches_nothing():
+            self._hit_count = 0
+            return
+        
+        final_query = self.build_query()
+        kwargs = {}
+        
+        if self.narrow_queries:
+            kwargs['narrow_queries'] = set(self.narrow_queries)
+        
+        if self.count_threshold is None:
+            self._hit_count = self._cached_backend_call('count', final_query, kwargs)
+            return
+        
+        kwargs['threshold'] = self.count_threshold
+        results = self._cached_backend_call('estimate_count', final_query, kwargs)
+        self._hit_count = results.get('hits', 0)
+        self._hit_count_is_exact = results.get('exact', True)
+    
+    @instrumentation.traced
+    def run_facets(self):
+        """
+        Builds and executes a facet-only query. Stores the facet counts (and
+        number of hits) without fetching any results.
+        """
+        if not (self.facets or self.date_facets or self.query_facets):
+            # Nothing to count.
+            self._facet_counts = {}
+            return
+        
+        if self.matches_nothing():
+            self._facet_counts = {}
+            self._hit_count = 0
+            return
+        
+        final_query = self.build_query()
+        kwargs = {}
+        
+        if self.facets:
+            kwargs['facets'] = list(self.facets)
+        
+        if self.date_facets:
+            kwargs['date_facets'] = self.date_facets
+        
+        if self.query_facets:
+            kwargs['query_facets'] = self.query_facets
+        
+        if self.narrow_queries:
+            kwargs['narrow_queries'] = set(self.narrow_queries)
+        
+        results = self._cached_backend_call('facet_counts', final_query, kwargs)
+        self._facet_counts = self.post_process_facets(results)
+        
+        if self._hit_count is None:
+            self._hit_count = results.get('hits', 0)
+    
+    @instrumentation.traced
     def run_mlt(self):
         """
         Executes the More Like This. Returns a list of search results similar
@@ -366,6 +930,7 @@ class BaseSearchQuery(object):
         self._results = results.get('results', [])
         self._hit_count = results.get('hits', 0)
     
+    @instrumentation.traced
     def run_raw(self):
         """Executes a raw query. Returns a list of search results."""
         kwargs = self.build_params()
@@ -381,26 +946,35 @@ class BaseSearchQuery(object):
         """
         Returns the number of results the backend found for the query.
         
-        If the query has not been run, this will execute the query and store
-        the results.
+        If the query has not been run, this will ask the backend for just the
+        count, without fetching any results.
         """
         if self._hit_count is None:
-            # Limit the slice to 10 so we get a count without consuming
-            # everything.
-            if not self.end_offset:
-                self.end_offset = 10
-            
-            if self._more_like_this:
-                # Special case for MLT.
-                self.run_mlt()
-            elif self._raw_query:
-                # Special case for raw queries.
-                self.run_raw()
+            if self._more_like_this or self._raw_query:
+                # Limit the slice to 10 so we get a count without consuming
+                # everything.
+                if not self.end_offset:
+                    self.end_offset = 10
+                
+                if self._more_like_this:
+                    # Special case for MLT.
+                    self.run_mlt()
+                else:
+                    # Special case for raw queries.
+                    self.run_raw()
             else:
-                self.run()
+                self.run_count()
         
         return self._hit_count
     
+    def count_is_exact(self):
+        """
+        Indicates if the number of results ``get_count`` returns is exact,
+        rather than an estimate.
+        """
+        self.get_count()
+        return self._hit_count_is_exact
+    
     def get_results(self):
         """
         Returns the results received from the backend.
@@ -424,11 +998,14 @@ class BaseSearchQuery(object):
         """
         Returns the facet counts received from the backend.
         
-        If the query has not been run, this will execute the query and store
-        the results.
+        If the query has not been run, this will ask the backend for just the
+        facet counts, without fetching any results.
         """
         if self._facet_counts is None:
-            self.run()
+            if self._more_like_this or self._raw_query:
+                self.get_results()
+            else:
+                self.run_facets()
         
         return self._facet_counts
     
@@ -452,12 +1029,13 @@ class BaseSearchQuery(object):
         """Generates the query that matches all documents."""
         return '*'
     
+    @instrumentation.timed('build')
     def build_query(self):
         """
         Interprets the collected query metadata and builds the final query to
         be sent to the backend.
         """
-        query = self.query_filter.as_query_string(self.build_query_fragment)
+        query = self.compile_query_filter()
         
         if not query:
             # Match all.
@@ -484,6 +1062,59 @@ class BaseSearchQuery(object):
         
         return final_query
     
+    def get_normalized_filter(self):
+        """
+        Returns the simplified version of the ``query_filter`` tree that gets
+        compiled into the query (see ``SearchNode.normalize``). If the filters
+        can never match anything, the tree is returned as-is.
+        """
+        if self._matches_nothing is None:
+            self._normalized_filter = self.query_filter.normalize()
+            self._matches_nothing = self._normalized_filter is None
+        
+        if self._matches_nothing:
+            return self.query_filter
+        
+        return self._normalized_filter
+    
+    def matches_nothing(self):
+        """
+        Indicates if the filters contradict each other, in which case there's
+        no need to ask the backend for results.
+        """
+        self.get_normalized_filter()
+        return self._matches_nothing
+    
+    def compile_query_filter(self):
+        """
+        Returns the query string for the normalized ``query_filter`` tree.
+        
+        Walking the tree (& building each fragment) is the bulk of the work in
+        ``build_query``, so the result is kept until the filters change. With
+        ``HAYSTACK_QUERY_STRING_CACHE_SIZE`` set, it's also shared with every
+        other query in the process built from the same filters.
+        """
+        if self._compiled_filter is not None:
+            return self._compiled_filter
+        
+        query_filter = self.get_normalized_filter()
+        key = None
+        
+        if QUERY_STRING_CACHE.size > 0:
+            key = query_filter.cache_key()
+            
+            if key is not None:
+                key = (self.__class__, self._using, key)
+                self._compiled_filter = QUERY_STRING_CACHE.get(key)
+        
+        if self._compiled_filter is None:
+            self._compiled_filter = query_filter.as_query_string(self.build_query_fragment)
+            
+            if key is not None:
+                QUERY_STRING_CACHE.set(key, self._compiled_filter)
+        
+        return self._compiled_filter
+    
     def combine(self, rhs, connector=SQ.AND):
         if connector == SQ.AND:
             self.add_filter(rhs.query_filter)
@@ -534,6 +1165,11 @@ class BaseSearchQuery(object):
         else:
             connector = SQ.AND
         
+        self._writable('query_filter')
+        self._normalized_filter = None
+        self._matches_nothing = None
+        self._compiled_filter = None
+        
         if self.query_filter and query_filter.connector != SQ.AND and len(query_filter) > 1:
             self.query_filter.start_subtree(connector)
             subtree = True
@@ -559,7 +1195,7 @@ class BaseSearchQuery(object):
     
     def add_order_by(self, field):
         """Orders the search result by a field."""
-        self.order_by.append(field)
+        self._writable('order_by').append(field)
     
     def clear_order_by(self):
         """
@@ -567,6 +1203,7 @@ class BaseSearchQuery(object):
         query to relevancy.
         """
         self.order_by = []
+        self._shared.discard('order_by')
     
     def add_model(self, model):
         """
@@ -578,7 +1215,7 @@ class BaseSearchQuery(object):
         if not isinstance(model, ModelBase):
             raise AttributeError('The model being added to the query must derive from Model.')
         
-        self.models.add(model)
+        self._writable('models').add(model)
     
     def set_limits(self, low=None, high=None):
         """Restricts the query by altering either the start, end or both offsets."""
@@ -592,9 +1229,90 @@ class BaseSearchQuery(object):
         """Clears any existing limits."""
         self.start_offset, self.end_offset = 0, None
     
+    def set_cursor(self, cursor):
+        """
+        Fetches results following the backend's ``cursor`` (``'*'`` for the
+        first page), rather than from the ``start_offset``.
+        """
+        self.cursor = cursor
+    
+    def set_count_threshold(self, threshold):
+        """
+        Lets the backend estimate the number of hits once it has counted
+        ``threshold`` of them. ``None`` goes back to exact counts.
+        """
+        if threshold is not None:
+            threshold = int(threshold)
+            
+            if threshold < 1:
+                raise ValueError("The count threshold must be at least 1.")
+        
+        self.count_threshold = threshold
+    
+    def set_values(self, fields):
+        """
+        Fetches only the provided stored ``fields`` for each result, as a
+        dictionary, rather than a full ``SearchResult``.
+        """
+        self.values = list(fields)
+    
+    def add_only_fields(self, fields):
+        """
+        Fetches only the provided stored ``fields`` (replacing any previous
+        list), leaving the rest to be loaded on access.
+        """
+        self.only_fields = set(fields)
+    
+    def add_deferred_fields(self, fields):
+        """
+        Leaves the provided stored ``fields`` out of what's fetched, to be
+        loaded on access. ``None`` clears any deferred fields.
+        """
+        if fields is None:
+            self.deferred_fields = set()
+            self._shared.discard('deferred_fields')
+            return
+        
+        self._writable('deferred_fields').update(fields)
+    
+    def get_loaded_fields(self):
+        """
+        Returns a sorted list of the stored fields to fetch, based on
+        ``only_fields`` & ``deferred_fields``, or ``None`` for all of them.
+        
+        Backends without ``supports_deferred_fields`` always get all of them,
+        since leaving some out would only mean fetching them again later.
+        """
+        from haystack import connections
+        
+        if not self.backend.supports_deferred_fields:
+            return None
+        
+        if self.only_fields is not None:
+            return sorted(self.only_fields - self.deferred_fields)
+        
+        if not self.deferred_fields:
+            return None
+        
+        all_fields = connections[self._using].get_unified_index().all_searchfields()
+        return sorted([field_name for field_name, field in all_fields.items() if field.stored and not field_name in self.deferred_fields])
+    
+    def get_next_cursor(self):
+        """
+        Returns the backend's cursor for the page after the current results,
+        or ``None`` if there aren't any more.
+        
+        If the query has not been run, this will execute the query and store
+        the results.
+        """
+        if self._results is None:
+            self.get_results()
+        
+        return self._next_cursor
+    
     def add_boost(self, term, boost_value):
         """Adds a boosted term and the amount to boost it to the query."""
-        self.boost[term] = boost_value
+        self._writable('boost')[term] = boost_value
     
     def raw_search(self, query_string, **kwargs):
         """
@@ -624,7 +1342,7 @@ class BaseSearchQuery(object):
     def add_field_facet(self, field):
         """Adds a regular facet on a field."""
         from haystack import connections
-        self.facets.add(connections[self._using].get_unified_index().get_facet_fieldname(field))
+        self._writable('facets').add(connections[self._using].get_unified_index().get_facet_fieldname(field))
     
     def add_date_facet(self, field, start_date, end_date, gap_by, gap_amount=1):
         """Adds a date-based facet on a field."""
@@ -638,12 +1356,12 @@ class BaseSearchQuery(object):
             'gap_by': gap_by,
             'gap_amount': gap_amount,
         }
-        self.date_facets[connections[self._using].get_unified_index().get_facet_fieldname(field)] = details
+        self._writable('date_facets')[connections[self._using].get_unified_index().get_facet_fieldname(field)] = details
     
     def add_query_facet(self, field, query):
         """Adds a query facet on a field."""
         from haystack import connections
-        self.query_facets.append((connections[self._using].get_unified_index().get_facet_fieldname(field), query))
+        self._writable('query_facets').append((connections[self._using].get_unified_index().get_facet_fieldname(field), query))
     
     def add_narrow_query(self, query):
         """
@@ -651,7 +1369,7 @@ class BaseSearchQuery(object):
         
         Generally used in conjunction with faceting.
         """
-        self.narrow_queries.add(query)
+        self._writable('narrow_queries').add(query)
     
     def set_result_class(self, klass):
         """
@@ -701,8 +1419,10 @@ class BaseSearchQuery(object):
         """
         self._results = None
         self._hit_count = None
+        self._hit_count_is_exact = True
         self._facet_counts = None
         self._spelling_suggestion = None
+        self._next_cursor = None
     
     def _clone(self, klass=None, using=None):
         if using is None:
@@ -715,17 +1435,29 @@ class BaseSearchQuery(object):
             klass = self.__class__
         
         clone = klass(using=using)
-        clone.query_filter = deepcopy(self.query_filter)
-        clone.order_by = self.order_by[:]
-        clone.models = self.models.copy()
-        clone.boost = self.boost.copy()
+        
+        # Rather than copying everything up front, both queries share the
+        # same structures & copy them on their first change.
+        for name in COPY_ON_WRITE_ATTRIBUTES:
+            setattr(clone, name, getattr(self, name))
+        
+        clone._shared = set(COPY_ON_WRITE_ATTRIBUTES)
+        self._shared = set(COPY_ON_WRITE_ATTRIBUTES)
+        clone._normalized_filter = self._normalized_filter
+        clone._matches_nothing = self._matches_nothing
+        
+        if klass is self.__class__ and using == self._using:
+            # Anything else may compile the filters differently.
+            clone._compiled_filter = self._compiled_filter
+        
         clone.highlight = self.highlight
-        clone.facets = self.facets.copy()
-        clone.date_facets = self.date_facets.copy()
-        clone.query_facets = self.query_facets[:]
-        clone.narrow_queries = self.narrow_queries.copy()
+        clone.include_spelling = self.include_spelling
+        clone.count_threshold = self.count_threshold
         clone.start_offset = self.start_offset
         clone.end_offset = self.end_offset
+        clone.cursor = self.cursor
+        clone.values = self.values
+        clone.only_fields = self.only_fields
         clone.result_class = self.result_class
         clone._raw_query = self._raw_query
         clone._raw_query_params = self._raw_query_params
@@ -743,17 +1475,29 @@ class BaseEngine(object):
         
         self.using = using
         self.options = settings.HAYSTACK_CONNECTIONS.get(self.using, {})
-        self.queries = []
+        self.queries = deque(maxlen=QUERY_LOG_SIZE)
         self._index = None
+        self._query_cache = None
     
     def get_backend(self):
         return self.backend(self.using, **self.options)
     
+    def get_query_cache(self):
+        """
+        Returns the cache for query results, as set by the ``QUERY_CACHE``
+        option, or ``None`` if the connection doesn't cache results.
+        """
+        if self._query_cache is None and self.options.get('QUERY_CACHE'):
+            query_cache_class = import_class(self.options['QUERY_CACHE'])
+            self._query_cache = query_cache_class(self.using, timeout=self.options.get('QUERY_CACHE_TIMEOUT', 300))
+        
+        return self._query_cache
+    
     def get_query(self):
         return self.query(using=self.using)
     
     def reset_queries(self):
-        self.queries = []
+        self.queries = deque(maxlen=QUERY_LOG_SIZE)
     
     def get_unified_index(self):
         if self._index is None:
@@ -4,7 +4,7 @@ A very basic, ORM-based backend for simple search during tests.
 from django.conf import settings
 from django.db.models import Q
 from haystack import connections
-from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, SearchNode, log_query
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, SearchNode, log_query, log_more_like_this
 from haystack.models import SearchResult
 
 
@@ -88,6 +88,7 @@ class SimpleSearchBackend(BaseSearchBackend):
     def prep_value(self, db_field, value):
         return value
     
+    @log_more_like_this
     def more_like_this(self, model_instance, additional_query_string=None,
                        start_offset=0, end_offset=None,
                        limit_to_registered_models=None, result_class=None, **kwargs):
@@ -1,24 +1,105 @@
+import httplib
 import logging
 import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.db.models.loading import get_model
-from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query, EmptyResults
-from haystack.constants import ID, DJANGO_CT, DJANGO_ID
+from haystack import instrumentation
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query, log_more_like_this, EmptyResults
+from haystack.constants import ID, DJANGO_CT, DJANGO_ID, MULTI_SEARCH_THREADS
 from haystack.exceptions import MissingDependency, MoreLikeThisError
+from haystack.metrics import add_payload_bytes, mark_error
 from haystack.models import SearchResult
 from haystack.utils import get_identifier
+from haystack.utils.http_pool import get_connection_pool
 try:
     from django.db.models.sql.query import get_proxied_model
 except ImportError:
     # Likely on Django 1.0
     get_proxied_model = None
 try:
-    from pysolr import Solr, SolrError
+    from pysolr import Results, Solr, SolrError
 except ImportError:
     raise MissingDependency("The 'solr' backend requires the installation of 'pysolr'. Please refer to the documentation.")
 
 
+# Shared by every ``SolrSearchBackend`` for sending the searches of a
+# ``multi_search`` at once. Only started when first needed.
+_multi_search_pool = None
+_multi_search_pool_lock = threading.Lock()
+
+
+def get_multi_search_pool():
+    """
+    Returns the thread pool used to send several searches at once, creating
+    it (with ``HAYSTACK_MULTI_SEARCH_THREADS`` threads) if needed.
+    """
+    global _multi_search_pool
+    
+    if _multi_search_pool is None:
+        _multi_search_pool_lock.acquire()
+        
+        try:
+            if _multi_search_pool is None:
+                _multi_search_pool = ThreadPool(MULTI_SEARCH_THREADS)
+        finally:
+            _multi_search_pool_lock.release()
+    
+    return _multi_search_pool
+
+
+class PooledSolr(Solr):
+    """
+    A ``pysolr.Solr`` that sends its requests over the keep-alive connections
+    of a ``haystack.utils.http_pool.HTTPConnectionPool``, rather than opening
+    a new connection for each request.
+    
+    Without a ``pool``, requests are sent the way ``pysolr`` does.
+    """
+    def __init__(self, url, decoder=None, timeout=60, pool=None):
+        super(PooledSolr, self).__init__(url, decoder=decoder, timeout=timeout)
+        self.pool = pool
+    
+    def _send_request(self, method, path, body=None, headers=None):
+        if self.pool is None:
+            return super(PooledSolr, self)._send_request(method, path, body=body, headers=headers)
+        
+        start_time = time.time()
+        self.log.debug("Starting request to '%s%s' (%s) with body '%s'..." % (self.base_url, path, method, str(body)[:10]))
+        
+        try:
+            status, response_headers, response = self.pool.request(method, path, body=body, headers=headers)
+        except httplib.HTTPException, e:
+            # Not an ``IOError``, so it'd get past the backend's handling of
+            # failed requests otherwise.
+            error_message = "Invalid response from Solr for '%s%s' (%s): %r" % (self.base_url, path, method, e)
+            self.log.error(error_message)
+            raise SolrError(error_message)
+        
+        self.log.info("Finished '%s%s' (%s) with body '%s' in %0.3f seconds." % (self.base_url, path, method, str(body)[:10], time.time() - start_time))
+        
+        if status != 200:
+            error_message = self._extract_error(response_headers, response)
+            self.log.error(error_message)
+            raise SolrError(error_message)
+        
+        return response
+
+
+class MeteredSolr(PooledSolr):
+    """
+    A ``PooledSolr`` that adds the bytes of each request & response to the
+    backend's metrics.
+    """
+    def _send_request(self, method, path, body=None, headers=None):
+        response = super(MeteredSolr, self)._send_request(method, path, body=body, headers=headers)
+        add_payload_bytes(len(path) + len(body or '') + len(response or ''))
+        return response
+
+
 class SolrSearchBackend(BaseSearchBackend):
     # Word reserved by Solr for special use.
     RESERVED_WORDS = (
@@ -35,14 +116,25 @@ class SolrSearchBackend(BaseSearchBackend):
         '[', ']', '^', '"', '~', '*', '?', ':',
     )
     
+    # Deep pages can be fetched with ``cursorMark`` (requires Solr 4.7+).
+    supports_cursors = True
+    
     def __init__(self, connection_alias, **connection_options):
         super(SolrSearchBackend, self).__init__(connection_alias, **connection_options)
         
         if not 'URL' in connection_options:
             raise ImproperlyConfigured("You must specify a 'URL' in your settings for connection '%s'." % connection_alias)
         
-        self.conn = Solr(connection_options['URL'], timeout=self.timeout)
+        self.conn = MeteredSolr(connection_options['URL'], timeout=self.timeout)
         self.log = logging.getLogger('haystack')
+        
+        if connection_options.get('POOL_SIZE', 10) is not None:
+            # Every backend for the connection shares the pool, so the
+            # connections outlive the backend (which only lasts a query).
+            self.conn.pool = get_connection_pool(connection_alias, self.conn.scheme, self.conn.host, self.conn.port,
+                                                 size=connection_options.get('POOL_SIZE', 10),
+                                                 timeout=self.timeout,
+                                                 idle_timeout=connection_options.get('POOL_IDLE_TIMEOUT', 30))
     
     def update(self, index, iterable, commit=True):
         docs = []
@@ -57,6 +149,7 @@ class SolrSearchBackend(BaseSearchBackend):
             try:
                 self.conn.add(docs, commit=commit, boost=index.get_field_weights())
             except (IOError, SolrError), e:
+                mark_error()
                 self.log.error("Failed to add documents to Solr: %s", e)
     
     def remove(self, obj_or_string, commit=True):
@@ -69,6 +162,7 @@ class SolrSearchBackend(BaseSearchBackend):
             }
             self.conn.delete(**kwargs)
         except (IOError, SolrError), e:
+            mark_error()
             self.log.error("Failed to remove document '%s' from Solr: %s", solr_id, e)
     
     def clear(self, models=[], commit=True):
@@ -87,6 +181,7 @@ class SolrSearchBackend(BaseSearchBackend):
             # Run an optimize post-clear. http://wiki.apache.org/solr/FAQ#head-9aafb5d8dff5308e8ea4fcf4b71f19f029c4bb99
             self.conn.optimize()
         except (IOError, SolrError), e:
+            mark_error()
             if len(models):
                 self.log.error("Failed to clear Solr index of models '%s': %s", ','.join(models_to_delete), e)
             else:
@@ -96,7 +191,8 @@ class SolrSearchBackend(BaseSearchBackend):
     def search(self, query_string, sort_by=None, start_offset=0, end_offset=None,
                fields='', highlight=False, facets=None, date_facets=None, query_facets=None,
                narrow_queries=None, spelling_query=None,
-               limit_to_registered_models=None, result_class=None, **kwargs):
+               limit_to_registered_models=None, result_class=None, cursor=None,
+               values=None, include_spelling=None, **kwargs):
         if len(query_string) == 0:
             return {
                 'results': [],
@@ -107,9 +203,18 @@ class SolrSearchBackend(BaseSearchBackend):
             'fl': '* score',
         }
         
-        if fields:
+        if isinstance(fields, (list, tuple)):
+            # Only fetch the requested stored fields, along with what's needed
+            # to build the results.
+            kwargs['fl'] = ','.join(list(fields) + [ID, DJANGO_CT, DJANGO_ID, 'score'])
+        elif fields:
             kwargs['fl'] = fields
         
+        if values is not None:
+            # Only fetch what was asked for (plus what's needed to check the
+            # model is still handled).
+            kwargs['fl'] = ','.join(list(values) + [DJANGO_CT])
+        
         if sort_by is not None:
             kwargs['sort'] = sort_by
         
@@ -119,11 +224,26 @@ class SolrSearchBackend(BaseSearchBackend):
         if end_offset is not None:
             kwargs['rows'] = end_offset - start_offset
         
+        if cursor is not None:
+            # Cursors take the place of ``start`` & need a sort that ends on
+            # the unique key, so that every document has a fixed place.
+            kwargs.pop('start', None)
+            kwargs['cursorMark'] = cursor
+            sort_fields = [bit.split()[0] for bit in kwargs.get('sort', '').split(',') if bit.strip()]
+            
+            if not sort_fields:
+                kwargs['sort'] = 'score desc, %s asc' % ID
+            elif sort_fields[-1] != ID:
+                kwargs['sort'] = '%s, %s asc' % (kwargs['sort'], ID)
+        
         if highlight is True:
             kwargs['hl'] = 'true'
             kwargs['hl.fragsize'] = '200'
         
-        if self.include_spelling is True:
+        if include_spelling is None:
+            include_spelling = self.include_spelling
+        
+        if include_spelling is True:
             kwargs['spellcheck'] = 'true'
             kwargs['spellcheck.collate'] = 'true'
             kwargs['spellcheck.count'] = 1
@@ -131,6 +251,53 @@ class SolrSearchBackend(BaseSearchBackend):
             if spelling_query:
                 kwargs['spellcheck.q'] = spelling_query
         
+        kwargs.update(self.build_facet_params(facets, date_facets, query_facets))
+        
+        if limit_to_registered_models is None:
+            limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
+        
+        if limit_to_registered_models:
+            # Using narrow queries, limit the results to only models handled
+            # with the current routers.
+            if narrow_queries is None:
+                narrow_queries = set()
+            
+            models_filter = self.build_models_filter()
+            
+            if models_filter is not None:
+                narrow_queries.add(models_filter)
+        
+        if narrow_queries is not None:
+            kwargs['fq'] = list(narrow_queries)
+        
+        next_cursor = None
+        
+        try:
+            if cursor is not None:
+                raw_results, next_cursor = self._cursor_search(query_string, **kwargs)
+            else:
+                raw_results = self.conn.search(query_string, **kwargs)
+        except (IOError, SolrError), e:
+            mark_error()
+            self.log.error("Failed to query Solr using '%s': %s", query_string, e)
+            raw_results = EmptyResults()
+        
+        results = self._process_results(raw_results, highlight=highlight, result_class=result_class, values=values)
+        
+        if cursor is not None:
+            # Solr hands back the same cursor once there's nothing left. A
+            # short page means the same thing, without another request.
+            if next_cursor == cursor or len(raw_results.docs) < kwargs.get('rows', 10):
+                next_cursor = None
+            
+            results['next_cursor'] = next_cursor
+        
+        return results
+    
+    def build_facet_params(self, facets=None, date_facets=None, query_facets=None):
+        """Generates the Solr params for the requested facets."""
+        kwargs = {}
+        
         if facets is not None:
             kwargs['facet'] = 'on'
             kwargs['facet.field'] = facets
@@ -155,6 +322,94 @@ class SolrSearchBackend(BaseSearchBackend):
             kwargs['facet'] = 'on'
             kwargs['facet.query'] = ["%s:%s" % (field, value) for field, value in query_facets]
         
+        return kwargs
+    
+    def _cursor_search(self, query_string, **kwargs):
+        # ``pysolr`` doesn't pass along the ``nextCursorMark``, so the request
+        # is made here instead.
+        params = {'q': query_string}
+        params.update(kwargs)
+        result = self.conn.decoder.decode(self.conn._select(params))
+        result_kwargs = {}
+        
+        if result.get('highlighting'):
+            result_kwargs['highlighting'] = result['highlighting']
+        
+        if result.get('facet_counts'):
+            result_kwargs['facets'] = result['facet_counts']
+        
+        if result.get('spellcheck'):
+            result_kwargs['spellcheck'] = result['spellcheck']
+        
+        raw_results = Results(result['response']['docs'], result['response']['numFound'], **result_kwargs)
+        return raw_results, result.get('nextCursorMark')
+    
+    def multi_search(self, searches):
+        """
+        Sends the searches to Solr at the same time (up to
+        ``HAYSTACK_MULTI_SEARCH_THREADS`` of them), on a shared thread pool,
+        so the batch takes about as long as the slowest search.
+        """
+        if len(searches) <= 1 or MULTI_SEARCH_THREADS <= 1:
+            return super(SolrSearchBackend, self).multi_search(searches)
+        
+        return get_multi_search_pool().map(lambda search: self.search(search[0], **search[1]), searches)
+    
+    @log_query
+    def count(self, query_string, narrow_queries=None,
+              limit_to_registered_models=None, **kwargs):
+        if len(query_string) == 0:
+            return 0
+        
+        raw_results = self._search_without_rows(query_string, {}, narrow_queries, limit_to_registered_models)
+        return raw_results.hits
+    
+    @log_query
+    def facet_counts(self, query_string, facets=None, date_facets=None, query_facets=None,
+                     narrow_queries=None, limit_to_registered_models=None, **kwargs):
+        if len(query_string) == 0:
+            return {
+                'hits': 0,
+                'facets': {},
+            }
+        
+        params = self.build_facet_params(facets, date_facets, query_facets)
+        raw_results = self._search_without_rows(query_string, params, narrow_queries, limit_to_registered_models)
+        return {
+            'hits': raw_results.hits,
+            'facets': self._process_facets(raw_results),
+        }
+    
+    @log_query
+    def fetch_fields(self, identifier, index, fields):
+        try:
+            raw_results = self.conn.search('%s:"%s"' % (ID, identifier), fl=','.join(fields))
+        except (IOError, SolrError), e:
+            mark_error()
+            self.log.error("Failed to fetch fields for '%s' from Solr: %s", identifier, e)
+            return None
+        
+        for raw_result in raw_results.docs:
+            values = {}
+            
+            for field_name in fields:
+                if field_name in raw_result:
+                    values[field_name] = self._convert_field(index, str(field_name), raw_result[field_name])
+            
+            return values
+        
+        return None
+    
+    def _search_without_rows(self, query_string, params, narrow_queries=None,
+                             limit_to_registered_models=None):
+        # No rows means Solr only has to count the matches (& facets), not
+        # fetch any documents.
+        kwargs = {
+            'fl': ID,
+            'rows': 0,
+        }
+        kwargs.update(params)
+        
         if limit_to_registered_models is None:
             limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
         
@@ -164,22 +419,22 @@ class SolrSearchBackend(BaseSearchBackend):
             if narrow_queries is None:
                 narrow_queries = set()
             
-            registered_models = self.build_models_list()
+            models_filter = self.build_models_filter()
             
-            if len(registered_models) > 0:
-                narrow_queries.add('%s:(%s)' % (DJANGO_CT, ' OR '.join(registered_models)))
+            if models_filter is not None:
+                narrow_queries.add(models_filter)
         
         if narrow_queries is not None:
             kwargs['fq'] = list(narrow_queries)
         
         try:
-            raw_results = self.conn.search(query_string, **kwargs)
+            return self.conn.search(query_string, **kwargs)
         except (IOError, SolrError), e:
-            self.log.error("Failed to query Solr using '%s': %s", query_string, e)
-            raw_results = EmptyResults()
-        
-        return self._process_results(raw_results, highlight=highlight, result_class=result_class)
+            mark_error()
+            self.log.error("Failed to count results in Solr using '%s': %s", query_string, e)
+            return EmptyResults()
     
+    @log_more_like_this
     def more_like_this(self, model_instance, additional_query_string=None,
                        start_offset=0, end_offset=None,
                        limit_to_registered_models=None, result_class=None, **kwargs):
@@ -214,10 +469,10 @@ class SolrSearchBackend(BaseSearchBackend):
             if narrow_queries is None:
                 narrow_queries = set()
             
-            registered_models = self.build_models_list()
+            models_filter = self.build_models_filter()
             
-            if len(registered_models) > 0:
-                narrow_queries.add('%s:(%s)' % (DJANGO_CT, ' OR '.join(registered_models)))
+            if models_filter is not None:
+                narrow_queries.add(models_filter)
         
         if additional_query_string:
             narrow_queries.add(additional_query_string)
@@ -230,20 +485,14 @@ class SolrSearchBackend(BaseSearchBackend):
         try:
             raw_results = self.conn.more_like_this(query, field_name, **params)
         except (IOError, SolrError), e:
+            mark_error()
             self.log.error("Failed to fetch More Like This from Solr for document '%s': %s", query, e)
             raw_results = EmptyResults()
         
         return self._process_results(raw_results, result_class=result_class)
     
-    def _process_results(self, raw_results, highlight=False, result_class=None):
-        from haystack import connections
-        results = []
-        hits = raw_results.hits
+    def _process_facets(self, raw_results):
         facets = {}
-        spelling_suggestion = None
-        
-        if result_class is None:
-            result_class = SearchResult
         
         if hasattr(raw_results, 'facets'):
             facets = {
@@ -258,6 +507,19 @@ class SolrSearchBackend(BaseSearchBackend):
                     # pairs.
                     facets[key][facet_field] = zip(facets[key][facet_field][::2], facets[key][facet_field][1::2])
         
+        return facets
+    
+    @instrumentation.timed('decode')
+    def _process_results(self, raw_results, highlight=False, result_class=None, values=None):
+        from haystack import connections
+        results = []
+        hits = raw_results.hits
+        facets = self._process_facets(raw_results)
+        spelling_suggestion = None
+        
+        if result_class is None:
+            result_class = SearchResult
+        
         if self.include_spelling is True:
             if hasattr(raw_results, 'spellcheck'):
                 if len(raw_results.spellcheck.get('suggestions', [])):
@@ -274,14 +536,25 @@ class SolrSearchBackend(BaseSearchBackend):
             model = get_model(app_label, model_name)
             
             if model and model in indexed_models:
+                index = unified_index.get_index(model)
+                
+                if values is not None:
+                    # Only convert the requested fields & skip building a
+                    # ``SearchResult``.
+                    result = {}
+                    
+                    for field_name in values:
+                        if field_name in raw_result:
+                            result[field_name] = self._convert_field(index, str(field_name), raw_result[field_name])
+                        else:
+                            result[field_name] = None
+                    
+                    results.append(result)
+                    continue
+                
                 for key, value in raw_result.items():
-                    index = unified_index.get_index(model)
                     string_key = str(key)
-                    
-                    if string_key in index.fields and hasattr(index.fields[string_key], 'convert'):
-                        additional_fields[string_key] = index.fields[string_key].convert(value)
-                    else:
-                        additional_fields[string_key] = self.conn._to_python(value)
+                    additional_fields[string_key] = self._convert_field(index, string_key, value)
                 
                 del(additional_fields[DJANGO_CT])
                 del(additional_fields[DJANGO_ID])
@@ -302,6 +575,12 @@ class SolrSearchBackend(BaseSearchBackend):
             'spelling_suggestion': spelling_suggestion,
         }
     
+    def _convert_field(self, index, field_name, value):
+        if field_name in index.fields and hasattr(index.fields[field_name], 'convert'):
+            return index.fields[field_name].convert(value)
+        
+        return self.conn._to_python(value)
+    
     def build_schema(self, fields):
         content_field_name = ''
         schema_fields = []
@@ -358,6 +637,28 @@ class SolrSearchBackend(BaseSearchBackend):
             schema_fields.append(field_data)
         
         return (content_field_name, schema_fields)
+    
+    def build_models_filter(self):
+        """
+        Returns the ``fq`` that limits the results to the registered models
+        (or ``None`` if there aren't any).
+        
+        It's built once per build of the ``UnifiedIndex`` & reused by every
+        search after that.
+        """
+        from haystack import connections
+        unified_index = connections[self.connection_alias].get_unified_index()
+        
+        if 'solr' not in unified_index.models_filter_cache:
+            registered_models = unified_index.get_models_list()
+            models_filter = None
+            
+            if len(registered_models) > 0:
+                models_filter = '%s:(%s)' % (DJANGO_CT, ' OR '.join(registered_models))
+            
+            unified_index.models_filter_cache['solr'] = models_filter
+        
+        return unified_index.models_filter_cache['solr']
 
 
 class SolrSearchQuery(BaseSearchQuery):
@@ -412,9 +713,8 @@ class SolrSearchQuery(BaseSearchQuery):
         
         return result
     
-    def run(self, spelling_query=None):
-        """Builds and executes the query. Returns a list of search results."""
-        final_query = self.build_query()
+    def build_params(self, spelling_query=None):
+        """Generates a list of params to use when searching."""
         kwargs = {
             'start_offset': self.start_offset,
             'result_class': self.result_class,
@@ -447,17 +747,29 @@ class SolrSearchQuery(BaseSearchQuery):
             kwargs['query_facets'] = self.query_facets
         
         if self.narrow_queries:
-            kwargs['narrow_queries'] = self.narrow_queries
+            # Backends may add to this, so hand over a copy.
+            kwargs['narrow_queries'] = set(self.narrow_queries)
         
         if spelling_query:
             kwargs['spelling_query'] = spelling_query
         
-        results = self.backend.search(final_query, **kwargs)
-        self._results = results.get('results', [])
-        self._hit_count = results.get('hits', 0)
-        self._facet_counts = self.post_process_facets(results)
-        self._spelling_suggestion = results.get('spelling_suggestion', None)
+        if self.include_spelling is not None:
+            kwargs['include_spelling'] = self.include_spelling
+        
+        if self.cursor is not None:
+            kwargs['cursor'] = self.cursor
+        
+        if self.values is not None:
+            kwargs['values'] = self.values
+        
+        loaded_fields = self.get_loaded_fields()
+        
+        if loaded_fields is not None:
+            kwargs['fields'] = loaded_fields
+        
+        return kwargs
     
+    @instrumentation.traced
     def run_mlt(self):
         """Builds and executes the query. Returns a list of search results."""
         if self._more_like_this is False or self._mlt_instance is None:
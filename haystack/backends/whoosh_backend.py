@@ -8,7 +8,8 @@ from django.core.exceptions import ImproperlyConfigured
 from django.db.models.loading import get_model
 from django.utils.datetime_safe import datetime
 from django.utils.encoding import force_unicode
-from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
+from haystack import instrumentation
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query, log_more_like_this
 from haystack.constants import ID, DJANGO_CT, DJANGO_ID
 from haystack.exceptions import MissingDependency, SearchBackendError
 from haystack.models import SearchResult
@@ -32,9 +33,11 @@ from whoosh.fields import Schema, IDLIST, STORED, TEXT, KEYWORD, NUMERIC, BOOLEA
 from whoosh.fields import ID as WHOOSH_ID
 from whoosh import index
 from whoosh.qparser import QueryParser
+from whoosh.query import And, Or, Term
 from whoosh.filedb.filestore import FileStorage, RamStorage
 from whoosh.searching import ResultsPage
 from whoosh.spelling import SpellChecker
+from whoosh.support.bitvector import BitSet
 from whoosh.writing import AsyncWriter
 
 # Handle minimum requirement.
@@ -63,10 +66,18 @@ class WhooshSearchBackend(BaseSearchBackend):
         '[', ']', '^', '"', '~', '*', '?', ':', '.',
     )
     
+    # Pages can be walked in index order with a cursor.
+    supports_cursors = True
+    # Whoosh reads every stored field of a hit regardless, so they're all
+    # kept rather than opening another searcher per result to get them back.
+    supports_deferred_fields = False
+    
     def __init__(self, connection_alias, **connection_options):
         super(WhooshSearchBackend, self).__init__(connection_alias, **connection_options)
         self.setup_complete = False
         self.use_file_storage = True
+        # Set while ``multi_search`` runs, so every search shares a searcher.
+        self._multi_searcher = None
         self.post_limit = getattr(connection_options, 'POST_LIMIT', 128 * 1024 * 1024)
         self.path = connection_options.get('PATH')
         
@@ -215,6 +226,10 @@ class WhooshSearchBackend(BaseSearchBackend):
         elif not self.use_file_storage:
             self.storage.clean()
         
+        # The documents for the registered models are about to be renumbered.
+        from haystack import connections
+        connections[self.connection_alias].get_unified_index().models_filter_cache.pop('whoosh_docs', None)
+        
         # Recreate everything.
         self.setup()
         
@@ -229,7 +244,8 @@ class WhooshSearchBackend(BaseSearchBackend):
     def search(self, query_string, sort_by=None, start_offset=0, end_offset=None,
                fields='', highlight=False, facets=None, date_facets=None, query_facets=None,
                narrow_queries=None, spelling_query=None,
-               limit_to_registered_models=None, result_class=None, **kwargs):
+               limit_to_registered_models=None, result_class=None, cursor=None,
+               values=None, include_spelling=None, **kwargs):
         if not self.setup_complete:
             self.setup()
         
@@ -290,27 +306,16 @@ class WhooshSearchBackend(BaseSearchBackend):
             warnings.warn("Whoosh does not handle query faceting.", Warning, stacklevel=2)
         
         narrowed_results = None
-        self.index = self.index.refresh()
+        self._refresh_index()
         
         if limit_to_registered_models is None:
             limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
         
-        if limit_to_registered_models:
-            # Using narrow queries, limit the results to only models handled
-            # with the current routers.
-            if narrow_queries is None:
-                narrow_queries = set()
-            
-            registered_models = self.build_models_list()
-            
-            if len(registered_models) > 0:
-                narrow_queries.add(' OR '.join(['%s:%s' % (DJANGO_CT, rm) for rm in registered_models]))
-        
         narrow_searcher = None
         
         if narrow_queries is not None:
             # Potentially expensive? I don't see another way to do it in Whoosh...
-            narrow_searcher = self.index.searcher()
+            narrow_searcher = self._get_searcher()
             
             for nq in narrow_queries:
                 recent_narrowed_results = narrow_searcher.search(self.parser.parse(force_unicode(nq)))
@@ -320,10 +325,10 @@ class WhooshSearchBackend(BaseSearchBackend):
                 else:
                    narrowed_results = recent_narrowed_results
         
-        self.index = self.index.refresh()
+        self._refresh_index()
         
         if self.index.doc_count():
-            searcher = self.index.searcher()
+            searcher = self._get_searcher()
             parsed_query = self.parser.parse(query_string)
             
             # In the event of an invalid/stopworded query, recover gracefully.
@@ -333,12 +338,53 @@ class WhooshSearchBackend(BaseSearchBackend):
                     'hits': 0,
                 }
             
+            models_docs = None
+            
+            if limit_to_registered_models:
+                # Limit the results to only models handled with the current
+                # routers.
+                models_docs = self._get_models_docs(searcher)
+                
+                if models_docs is not None and not len(models_docs):
+                    self._close_searcher(searcher)
+                    self._close_searcher(narrow_searcher)
+                    return {
+                        'results': [],
+                        'hits': 0,
+                        'spelling_suggestion': None,
+                    }
+            
+            if cursor is not None:
+                if sort_by is not None:
+                    raise SearchBackendError("Whoosh can only page through results with a cursor in index order, not ordered by '%s'." % sort_by)
+                
+                narrowed_docs = models_docs
+                
+                if narrowed_results is not None:
+                    narrowed_docs = narrowed_results.docs()
+                    
+                    if models_docs is not None:
+                        narrowed_docs = set([docnum for docnum in narrowed_docs if docnum in models_docs])
+                
+                if end_offset is None:
+                    page_length = 1000000
+                else:
+                    page_length = end_offset - (start_offset or 0)
+                
+                raw_page, next_cursor = self._search_after(searcher, parsed_query, cursor, page_length, narrowed_docs)
+                results = self._process_results(raw_page, highlight=highlight, query_string=query_string, spelling_query=spelling_query, result_class=result_class, values=values, include_spelling=include_spelling)
+                results['next_cursor'] = next_cursor
+                self._close_searcher(searcher)
+                self._close_searcher(narrow_searcher)
+                
+                return results
+            
             # Prevent against Whoosh throwing an error. Requires an end_offset
             # greater than 0.
             if not end_offset is None and end_offset <= 0:
                 end_offset = 1
             
-            raw_results = searcher.search(parsed_query, limit=end_offset, sortedby=sort_by, reverse=reverse)
+            raw_results = searcher.search(parsed_query, limit=end_offset, sortedby=sort_by, reverse=reverse, filter=models_docs)
             
             # Handle the case where the results have been narrowed.
             if narrowed_results:
@@ -370,15 +416,16 @@ class WhooshSearchBackend(BaseSearchBackend):
                     'spelling_suggestion': None,
                 }
             
-            results = self._process_results(raw_page, highlight=highlight, query_string=query_string, spelling_query=spelling_query, result_class=result_class)
-            searcher.close()
-            
-            if hasattr(narrow_searcher, 'close'):
-                narrow_searcher.close()
+            results = self._process_results(raw_page, highlight=highlight, query_string=query_string, spelling_query=spelling_query, result_class=result_class, values=values, include_spelling=include_spelling)
+            self._close_searcher(searcher)
+            self._close_searcher(narrow_searcher)
             
             return results
         else:
-            if self.include_spelling:
+            if include_spelling is None:
+                include_spelling = self.include_spelling
+            
+            if include_spelling:
                 if spelling_query:
                     spelling_suggestion = self.create_spelling_suggestion(spelling_query)
                 else:
@@ -392,6 +439,261 @@ class WhooshSearchBackend(BaseSearchBackend):
                 'spelling_suggestion': spelling_suggestion,
             }
     
+    def multi_search(self, searches):
+        """
+        Runs all the searches against a single searcher, rather than opening
+        (& closing) a couple per search.
+        """
+        if not self.setup_complete:
+            self.setup()
+        
+        self.index = self.index.refresh()
+        self._multi_searcher = self.index.searcher()
+        
+        try:
+            return super(WhooshSearchBackend, self).multi_search(searches)
+        finally:
+            searcher, self._multi_searcher = self._multi_searcher, None
+            searcher.close()
+    
+    def _refresh_index(self):
+        # The shared searcher pins what's visible for the whole batch.
+        if self._multi_searcher is None:
+            self.index = self.index.refresh()
+    
+    def _get_searcher(self):
+        if self._multi_searcher is not None:
+            return self._multi_searcher
+        
+        return self.index.searcher()
+    
+    def _close_searcher(self, searcher):
+        if searcher is not None and searcher is not self._multi_searcher:
+            searcher.close()
+    
+    def _search_after(self, searcher, parsed_query, cursor, page_length, narrowed_docs=None):
+        """
+        Collects the next ``page_length`` matches after the ``cursor``, walking
+        the matches in index order. Returns the page & the cursor for the
+        page after it (or ``None`` if this was the last page).
+        
+        Rather than scoring & sorting every match to find an offset, the
+        matcher skips straight past the last document seen, so every page
+        costs about the same no matter how deep it is.
+        """
+        reader = searcher.reader()
+        last_docnum = -1
+        last_id = None
+        
+        if cursor != '*':
+            try:
+                last_docnum, hits, last_id = cursor.split(':', 2)
+                last_docnum, hits = int(last_docnum), int(hits)
+            except ValueError:
+                raise SearchBackendError("'%s' is not a valid Whoosh cursor." % cursor)
+            
+            # Document numbers can shift as segments get merged. Find where
+            # the last document seen has moved to, if it's still around.
+            moved_to = searcher.document_number(**{ID: force_unicode(last_id)})
+            
+            if moved_to is not None:
+                last_docnum = moved_to
+        else:
+            # The total is counted once, on the first page, & carried along.
+            hits = len([docnum for docnum in parsed_query.docs(searcher) if narrowed_docs is None or docnum in narrowed_docs])
+        
+        matches = []
+        matcher = parsed_query.matcher(searcher)
+        
+        if matcher.is_active() and last_docnum >= 0:
+            matcher.skip_to(last_docnum + 1)
+        
+        while matcher.is_active() and len(matches) < page_length:
+            docnum = matcher.id()
+            
+            if docnum > last_docnum and (narrowed_docs is None or docnum in narrowed_docs):
+                matches.append((docnum, matcher.score()))
+            
+            matcher.next()
+        
+        next_cursor = None
+        
+        if matches and matcher.is_active():
+            last_docnum = matches[-1][0]
+            next_cursor = "%d:%d:%s" % (last_docnum, hits, reader.stored_fields(last_docnum)[ID])
+        
+        return WhooshCursorPage(reader, matches, hits), next_cursor
+    
+    @log_query
+    def count(self, query_string, narrow_queries=None,
+              limit_to_registered_models=None, **kwargs):
+        queries = self._parse_for_count(query_string, narrow_queries, limit_to_registered_models)
+        
+        if queries is None:
+            return 0
+        
+        parsed_query, parsed_narrows = queries[0], queries[1:]
+        searcher = self.index.searcher()
+        
+        try:
+            # Only collect the matching document numbers. Nothing gets scored,
+            # sorted or loaded.
+            matches = set(parsed_query.docs(searcher))
+            
+            for parsed_narrow in parsed_narrows:
+                if not matches:
+                    break
+                
+                matches.intersection_update(parsed_narrow.docs(searcher))
+        finally:
+            searcher.close()
+        
+        return len(matches)
+    
+    @log_query
+    def estimate_count(self, query_string, threshold, narrow_queries=None,
+                       limit_to_registered_models=None, **kwargs):
+        queries = self._parse_for_count(query_string, narrow_queries, limit_to_registered_models)
+        
+        if queries is None:
+            return {
+                'hits': 0,
+                'exact': True,
+            }
+        
+        searcher = self.index.searcher()
+        
+        try:
+            # Walk the matches (narrowed as we go) in document order & stop
+            # once ``threshold`` of them have been seen.
+            matcher = And(queries).matcher(searcher)
+            hits = 0
+            last_docnum = None
+            
+            while matcher.is_active() and hits < threshold:
+                hits += 1
+                last_docnum = matcher.id()
+                matcher.next()
+            
+            if not matcher.is_active():
+                return {
+                    'hits': hits,
+                    'exact': True,
+                }
+            
+            # Assume the rest of the index matches at the same rate as the
+            # part that was walked, without going past what the postings
+            # allow for.
+            estimate = int(hits * float(searcher.doc_count_all()) / (last_docnum + 1))
+            estimate = min(estimate, And(queries).estimate_size(searcher.reader()))
+        finally:
+            searcher.close()
+        
+        return {
+            'hits': max(estimate, hits + 1),
+            'exact': False,
+        }
+    
+    def _parse_for_count(self, query_string, narrow_queries=None,
+                         limit_to_registered_models=None):
+        """
+        Returns the parsed query followed by the parsed narrow queries, or
+        ``None`` if nothing can match.
+        """
+        if not self.setup_complete:
+            self.setup()
+        
+        query_string = force_unicode(query_string)
+        
+        # Same as ``search``, empty & one-character (non-wildcard) queries
+        # don't match anything.
+        if len(query_string) == 0 or (len(query_string) <= 1 and query_string != u'*'):
+            return None
+        
+        if limit_to_registered_models is None:
+            limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
+        
+        self.index = self.index.refresh()
+        
+        if not self.index.doc_count():
+            return None
+        
+        parsed_query = self.parser.parse(query_string)
+        
+        if parsed_query is None:
+            return None
+        
+        queries = [parsed_query]
+        
+        for nq in narrow_queries or []:
+            parsed_narrow = self.parser.parse(force_unicode(nq))
+            
+            if parsed_narrow is not None:
+                queries.append(parsed_narrow)
+        
+        if limit_to_registered_models:
+            # Limit the results to only models handled with the current
+            # routers.
+            models_query = self._get_models_query()
+            
+            if models_query is not None:
+                queries.append(models_query)
+        
+        return queries
+    
+    def _get_models_query(self):
+        """
+        Returns a query matching the registered models (or ``None`` if there
+        aren't any), built once per build of the ``UnifiedIndex``.
+        """
+        from haystack import connections
+        unified_index = connections[self.connection_alias].get_unified_index()
+        
+        if 'whoosh_query' not in unified_index.models_filter_cache:
+            registered_models = unified_index.get_models_list()
+            models_query = None
+            
+            if len(registered_models) > 0:
+                models_query = Or([Term(DJANGO_CT, registered_model) for registered_model in registered_models])
+            
+            unified_index.models_filter_cache['whoosh_query'] = models_query
+        
+        return unified_index.models_filter_cache['whoosh_query']
+    
+    def _get_models_docs(self, searcher):
+        """
+        Returns a ``BitSet`` of the documents (in ``searcher``) of the
+        registered models, or ``None`` if there aren't any models.
+        
+        Rather than running the query for them on every search, the set is
+        kept until the index's segments change (or the ``UnifiedIndex`` is
+        rebuilt).
+        """
+        from haystack import connections
+        models_query = self._get_models_query()
+        
+        if models_query is None:
+            return None
+        
+        reader = searcher.reader()
+        
+        if reader.is_atomic():
+            leaf_readers = [(reader, 0)]
+        else:
+            leaf_readers = reader.leaf_readers()
+        
+        segments = tuple([(leaf_reader.generation(), leaf_reader.doc_count_all()) for leaf_reader, offset in leaf_readers])
+        cache = connections[self.connection_alias].get_unified_index().models_filter_cache
+        cached = cache.get('whoosh_docs')
+        
+        if cached is not None and cached[0] == segments:
+            return cached[1]
+        
+        models_docs = BitSet(searcher.doc_count_all(), source=searcher.docs_for_query(models_query))
+        cache['whoosh_docs'] = (segments, models_docs)
+        return models_docs
+    
+    @log_more_like_this
     def more_like_this(self, model_instance, additional_query_string=None,
                        start_offset=0, end_offset=None,
                        limit_to_registered_models=None, result_class=None, **kwargs):
@@ -401,7 +703,8 @@ class WhooshSearchBackend(BaseSearchBackend):
             'hits': 0,
         }
     
-    def _process_results(self, raw_page, highlight=False, query_string='', spelling_query=None, result_class=None):
+    @instrumentation.timed('decode')
+    def _process_results(self, raw_page, highlight=False, query_string='', spelling_query=None, result_class=None, values=None, include_spelling=None):
         from haystack import connections
         results = []
         
@@ -424,21 +727,27 @@ class WhooshSearchBackend(BaseSearchBackend):
             model = get_model(app_label, model_name)
             
             if model and model in indexed_models:
-                for key, value in raw_result.items():
-                    index = unified_index.get_index(model)
-                    string_key = str(key)
+                index = unified_index.get_index(model)
+                
+                if values is not None:
+                    # Only convert the requested fields & skip building a
+                    # ``SearchResult``.
+                    result = {}
                     
-                    if string_key in index.fields and hasattr(index.fields[string_key], 'convert'):
-                        # Special-cased due to the nature of KEYWORD fields.
-                        if index.fields[string_key].is_multivalued:
-                            if value is None or len(value) is 0:
-                                additional_fields[string_key] = []
-                            else:
-                                additional_fields[string_key] = value.split(',')
+                    for field_name in values:
+                        if field_name == 'score':
+                            result[field_name] = score
+                        elif raw_result.get(field_name) is not None:
+                            result[field_name] = self._convert_field(index, str(field_name), raw_result[field_name])
                         else:
-                            additional_fields[string_key] = index.fields[string_key].convert(value)
-                    else:
-                        additional_fields[string_key] = self._to_python(value)
+                            result[field_name] = None
+                    
+                    results.append(result)
+                    continue
+                
+                for key, value in raw_result.items():
+                    string_key = str(key)
+                    additional_fields[string_key] = self._convert_field(index, string_key, value)
                 
                 del(additional_fields[DJANGO_CT])
                 del(additional_fields[DJANGO_ID])
@@ -458,7 +767,10 @@ class WhooshSearchBackend(BaseSearchBackend):
             else:
                 hits -= 1
         
-        if self.include_spelling:
+        if include_spelling is None:
+            include_spelling = self.include_spelling
+        
+        if include_spelling:
             if spelling_query:
                 spelling_suggestion = self.create_spelling_suggestion(spelling_query)
             else:
@@ -471,6 +783,42 @@ class WhooshSearchBackend(BaseSearchBackend):
             'spelling_suggestion': spelling_suggestion,
         }
     
+    def fetch_fields(self, identifier, index, fields):
+        if not self.setup_complete:
+            self.setup()
+        
+        self.index = self.index.refresh()
+        searcher = self.index.searcher()
+        
+        try:
+            stored = searcher.document(**{ID: force_unicode(identifier)})
+        finally:
+            searcher.close()
+        
+        if stored is None:
+            return None
+        
+        values = {}
+        
+        for field_name in fields:
+            if stored.get(field_name) is not None:
+                values[field_name] = self._convert_field(index, str(field_name), stored[field_name])
+        
+        return values
+    
+    def _convert_field(self, index, field_name, value):
+        if field_name in index.fields and hasattr(index.fields[field_name], 'convert'):
+            # Special-cased due to the nature of KEYWORD fields.
+            if index.fields[field_name].is_multivalued:
+                if value is None or len(value) is 0:
+                    return []
+                
+                return value.split(',')
+            
+            return index.fields[field_name].convert(value)
+        
+        return self._to_python(value)
+    
     def create_spelling_suggestion(self, query_string):
         spelling_suggestion = None
         sp = SpellChecker(self.storage)
@@ -559,6 +907,27 @@ class WhooshSearchBackend(BaseSearchBackend):
         return value
 
 
+class WhooshCursorPage(object):
+    """
+    A page of matches found by following a cursor, shaped like the
+    ``ResultsPage`` that ``_process_results`` expects.
+    """
+    def __init__(self, reader, matches, hits):
+        self.reader = reader
+        self.matches = matches
+        self.hits = hits
+    
+    def __len__(self):
+        return self.hits
+    
+    def __iter__(self):
+        for docnum, score in self.matches:
+            yield self.reader.stored_fields(docnum)
+    
+    def score(self, n):
+        return self.matches[n][1]
+
+
 class WhooshSearchQuery(BaseSearchQuery):
     def _convert_datetime(self, date):
         if hasattr(date, 'hour'):
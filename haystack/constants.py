@@ -20,6 +20,30 @@ REPR_OUTPUT_SIZE = 20
 # Number of SearchResults to load at a time.
 ITERATOR_LOAD_PER_QUERY = getattr(settings, 'HAYSTACK_ITERATOR_LOAD_PER_QUERY', 10)
 
+# When iterating, each page is this many times larger than the last, up to
+# the maximum.
+ITERATOR_LOAD_GROWTH = getattr(settings, 'HAYSTACK_ITERATOR_LOAD_GROWTH', 2)
+ITERATOR_MAX_LOAD_PER_QUERY = getattr(settings, 'HAYSTACK_ITERATOR_MAX_LOAD_PER_QUERY', 1000)
+
+# How many threads ``load_all`` may use to load several models' objects at
+# once. Values of 1 or less load them one model at a time.
+LOAD_ALL_THREADS = getattr(settings, 'HAYSTACK_LOAD_ALL_THREADS', 1)
+
+# How many threads are shared by the ``a*`` methods of ``SearchQuerySet``.
+ASYNC_THREADS = getattr(settings, 'HAYSTACK_ASYNC_THREADS', 4)
+
+# How many threads are shared by the backends' ``multi_search`` for sending
+# searches at the same time.
+MULTI_SEARCH_THREADS = getattr(settings, 'HAYSTACK_MULTI_SEARCH_THREADS', 4)
+
+# How many compiled query strings are shared between all queries in the
+# process. Zero turns the shared cache off.
+QUERY_STRING_CACHE_SIZE = getattr(settings, 'HAYSTACK_QUERY_STRING_CACHE_SIZE', 0)
+
+# How many queries each connection keeps in its ``queries`` log when
+# ``DEBUG`` is on. The oldest are dropped first.
+QUERY_LOG_SIZE = getattr(settings, 'HAYSTACK_QUERY_LOG_SIZE', 1000)
+
 # A marker class in the hierarchy to indicate that it handles search data.
 class Indexable(object):
     pass
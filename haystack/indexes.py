@@ -5,6 +5,7 @@ from django.utils.encoding import force_unicode
 from haystack import connections, connection_router
 from haystack.constants import ID, DJANGO_CT, DJANGO_ID, Indexable, DEFAULT_ALIAS
 from haystack.fields import *
+from haystack.query_cache import invalidate_query_caches
 from haystack.utils import get_identifier, get_facet_field_name
 
 
@@ -201,6 +202,9 @@ class SearchIndex(Indexable):
         
         return connections[using].get_backend()
     
+    def _invalidate_query_cache(self):
+        invalidate_query_caches([self.get_model()])
+    
     def update(self, using=None):
         """
         Updates the entire index.
@@ -210,6 +214,7 @@ class SearchIndex(Indexable):
         be used.
         """
         self._get_backend(using).update(self, self.index_queryset())
+        self._invalidate_query_cache()
     
     def update_object(self, instance, using=None, **kwargs):
         """
@@ -223,6 +228,7 @@ class SearchIndex(Indexable):
         # Check to make sure we want to index this first.
         if self.should_update(instance, **kwargs):
             self._get_backend(using).update(self, [instance])
+            self._invalidate_query_cache()
     
     def remove_object(self, instance, using=None, **kwargs):
         """
@@ -234,6 +240,7 @@ class SearchIndex(Indexable):
         be used.
         """
         self._get_backend(using).remove(instance)
+        self._invalidate_query_cache()
     
     def clear(self, using=None):
         """
@@ -244,6 +251,7 @@ class SearchIndex(Indexable):
         be used.
         """
         self._get_backend(using).clear(models=[self.get_model()])
+        self._invalidate_query_cache()
     
     def reindex(self, using=None):
         """
@@ -0,0 +1,419 @@
+import datetime
+import logging
+import os
+import random
+import threading
+from time import time
+from django.conf import settings
+from django.utils.encoding import force_unicode
+from django.utils.functional import wraps
+from haystack.utils.loading import import_class
+
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        from django.utils import simplejson as json
+
+
+log = logging.getLogger('haystack')
+
+# What a search goes through, in order. Each phase's time excludes any other
+# phases that ran within it.
+PHASES = ('build', 'backend', 'decode', 'hydrate', 'load_all')
+
+# The sinks records are sent to. Loaded from the
+# ``HAYSTACK_INSTRUMENTATION_SINKS`` setting on first use & replaced (never
+# changed in place) when sinks are added or removed.
+_sinks = None
+_local = threading.local()
+
+
+class QueryRecord(object):
+    """
+    What happened during one operation against a search backend, from
+    building the query to loading the objects for the results.
+    
+    The query string & arguments are those of the first backend call made
+    during the operation. ``phases`` holds the seconds spent in each of the
+    ``PHASES`` the operation went through.
+    """
+    def __init__(self, connection_alias=None, action=None):
+        self.connection_alias = connection_alias
+        self.action = action
+        self.query_string = None
+        self.kwargs = {}
+        self.phases = {}
+        self.hits = None
+        self.error = None
+        self.backend_calls = 0
+        self.started = time()
+        self.duration = None
+        self._depth = 0
+        # The time spent in phases nested within each phase that's running.
+        self._nested = []
+    
+    def __repr__(self):
+        return "<QueryRecord: %s on '%s' (%s)>" % (self.action, self.connection_alias, self.query_string)
+    
+    def enter_phase(self):
+        self._nested.append(0.0)
+    
+    def exit_phase(self, phase, elapsed):
+        nested = self._nested.pop()
+        self.phases[phase] = self.phases.get(phase, 0.0) + max(elapsed - nested, 0.0)
+        
+        if self._nested:
+            self._nested[-1] += elapsed
+    
+    def add_backend_call(self, connection_alias, action, query_string, kwargs):
+        if not self.backend_calls:
+            self.connection_alias = connection_alias
+            self.action = action
+            self.query_string = query_string
+            self.kwargs = dict(kwargs)
+        
+        self.backend_calls += 1
+    
+    def add_hits(self, results):
+        if self.hits is not None:
+            return
+        
+        if isinstance(results, dict):
+            self.hits = results.get('hits')
+        elif isinstance(results, (int, long)):
+            self.hits = results
+    
+    def as_dict(self):
+        return {
+            'connection_alias': self.connection_alias,
+            'action': self.action,
+            'query_string': self.query_string,
+            'kwargs': self.kwargs,
+            'phases': dict(self.phases),
+            'hits': self.hits,
+            'error': self.error and repr(self.error),
+            'backend_calls': self.backend_calls,
+            'started': self.started,
+            'duration': self.duration,
+        }
+
+
+class BaseSink(object):
+    """
+    Base class for the places ``QueryRecord``s get sent to.
+    
+    Subclasses need to provide ``emit``, which gets called (on the thread
+    that ran the operation) with each finished record.
+    """
+    def emit(self, record):
+        raise NotImplementedError
+
+
+class MemorySink(BaseSink):
+    """
+    Keeps the last ``size`` records in memory.
+    """
+    def __init__(self, size=100):
+        self.size = size
+        self.records = []
+        self._lock = threading.Lock()
+    
+    def emit(self, record):
+        self._lock.acquire()
+        
+        try:
+            self.records.append(record)
+            
+            if len(self.records) > self.size:
+                del self.records[:len(self.records) - self.size]
+        finally:
+            self._lock.release()
+    
+    def clear(self):
+        self._lock.acquire()
+        
+        try:
+            self.records = []
+        finally:
+            self._lock.release()
+
+
+class LoggingSink(BaseSink):
+    """
+    Logs a line for each record to the ``haystack.instrumentation`` logger.
+    """
+    def __init__(self, logger='haystack.instrumentation', level=logging.DEBUG):
+        self.log = logging.getLogger(logger)
+        self.level = level
+    
+    def emit(self, record):
+        if not self.log.isEnabledFor(self.level):
+            return
+        
+        phases = ' '.join(["%s=%.3fs" % (phase, record.phases[phase]) for phase in PHASES if phase in record.phases])
+        self.log.log(self.level, "%s on '%s' took %.3fs (%s), %s hit(s): %s", record.action, record.connection_alias, record.duration, phases, record.hits, record.query_string)
+
+
+class SlowQuerySink(BaseSink):
+    """
+    Logs the searches & More Like This queries on a connection that take
+    ``threshold`` seconds or more, from building the query to loading the
+    objects, to the ``haystack.slow_queries`` logger (as a warning).
+    
+    If there's a ``path``, a ``sample_rate`` fraction of them are also
+    written to that file, one JSON object per line. Once the file would go
+    over ``max_bytes``, it's moved to ``path + '.1'`` (replacing any older
+    one) & a new file is started.
+    
+    One of these is set up for each connection with a
+    ``SLOW_QUERY_THRESHOLD``.
+    """
+    actions = ('search', 'more_like_this')
+    
+    def __init__(self, connection_alias, threshold, path=None, max_bytes=10 * 1024 * 1024, sample_rate=1.0):
+        self.connection_alias = connection_alias
+        self.threshold = threshold
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sample_rate = sample_rate
+        self.log = logging.getLogger('haystack.slow_queries')
+        self._lock = threading.Lock()
+    
+    def emit(self, record):
+        if record.connection_alias != self.connection_alias or record.action not in self.actions:
+            return
+        
+        if record.duration < self.threshold:
+            return
+        
+        line = json.dumps(self.describe(record), default=jsonable, sort_keys=True)
+        self.log.warning("Slow %s on '%s' took %.3fs: %s", record.action, record.connection_alias, record.duration, line)
+        
+        if self.path and random.random() < self.sample_rate:
+            try:
+                self.write(line)
+            except (IOError, OSError), e:
+                log.error("Failed to write the slow query log '%s': %s", self.path, e)
+    
+    def describe(self, record):
+        """
+        Returns what gets logged about a record, as a dictionary.
+        """
+        details = {
+            'time': datetime.datetime.fromtimestamp(record.started).isoformat(),
+            'connection_alias': record.connection_alias,
+            'action': record.action,
+            'duration': record.duration,
+            'query_string': record.query_string,
+            'phases': dict(record.phases),
+            'hits': record.hits,
+            'backend_calls': record.backend_calls,
+            'error': record.error and repr(record.error),
+        }
+        
+        for key, value in record.kwargs.items():
+            # Everything the backend was given (narrow queries, sort, offsets,
+            # facets, etc.) that was actually used.
+            if value is not None and value != '' and key not in details:
+                details[key] = value
+        
+        return details
+    
+    def write(self, line):
+        line = line.encode('utf-8') + '\n'
+        self._lock.acquire()
+        
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                backup_path = '%s.1' % self.path
+                
+                if os.path.exists(backup_path):
+                    os.remove(backup_path)
+                
+                os.rename(self.path, backup_path)
+            
+            slow_log = open(self.path, 'a')
+            
+            try:
+                slow_log.write(line)
+            finally:
+                slow_log.close()
+        finally:
+            self._lock.release()
+
+
+def jsonable(value):
+    """
+    Converts what ``json`` can't handle (such as the sets of narrow queries)
+    for a ``SlowQuerySink``.
+    """
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    
+    return force_unicode(value)
+
+
+def get_slow_query_sinks():
+    """
+    Returns a ``SlowQuerySink`` for each connection with a
+    ``SLOW_QUERY_THRESHOLD``.
+    """
+    sinks = []
+    
+    for connection_alias, options in sorted(getattr(settings, 'HAYSTACK_CONNECTIONS', {}).items()):
+        if options.get('SLOW_QUERY_THRESHOLD') is None:
+            continue
+        
+        sinks.append(SlowQuerySink(connection_alias, options['SLOW_QUERY_THRESHOLD'],
+                                   path=options.get('SLOW_QUERY_LOG'),
+                                   max_bytes=options.get('SLOW_QUERY_LOG_SIZE', 10 * 1024 * 1024),
+                                   sample_rate=options.get('SLOW_QUERY_SAMPLE_RATE', 1.0)))
+    
+    return sinks
+
+
+def get_sinks():
+    """
+    Returns the sinks that records are sent to.
+    """
+    global _sinks
+    
+    if _sinks is None:
+        _sinks = [import_class(path)() for path in getattr(settings, 'HAYSTACK_INSTRUMENTATION_SINKS', [])]
+        _sinks.extend(get_slow_query_sinks())
+    
+    return _sinks
+
+
+def add_sink(sink):
+    """Starts sending records to ``sink``."""
+    global _sinks
+    _sinks = get_sinks() + [sink]
+
+
+def remove_sink(sink):
+    """Stops sending records to ``sink``."""
+    global _sinks
+    _sinks = [existing for existing in get_sinks() if existing is not sink]
+
+
+def current():
+    """
+    Returns the ``QueryRecord`` being gathered on this thread, if any.
+    """
+    return getattr(_local, 'record', None)
+
+
+def start(connection_alias=None, action=None):
+    """
+    Starts gathering a ``QueryRecord`` for an operation on this thread, or
+    joins the one that's already being gathered.
+    
+    Returns ``None`` (& does nothing else) when there are no sinks. Every
+    call that returns a record needs a matching call to ``stop``.
+    """
+    if not get_sinks():
+        return None
+    
+    record = current()
+    
+    if record is None:
+        record = QueryRecord(connection_alias, action)
+        _local.record = record
+    
+    record._depth += 1
+    return record
+
+
+def stop(record):
+    """
+    Finishes with a record from ``start``. Once the outermost operation is
+    done, the record is sent to every sink.
+    """
+    if record is None:
+        return
+    
+    record._depth -= 1
+    
+    if record._depth > 0:
+        return
+    
+    _local.record = None
+    record.duration = time() - record.started
+    
+    for sink in get_sinks():
+        try:
+            sink.emit(record)
+        except Exception:
+            # A broken sink shouldn't break searching.
+            log.exception("Instrumentation sink %r failed to handle %r.", sink, record)
+
+
+def traced(func):
+    """
+    A decorator for methods that make up an operation against a backend.
+    
+    Everything done within the method (& any other traced methods it calls)
+    is gathered into a single ``QueryRecord``.
+    """
+    def wrapper(obj, *args, **kwargs):
+        record = start(get_connection_alias(obj), func.__name__)
+        
+        if record is None:
+            return func(obj, *args, **kwargs)
+        
+        try:
+            return func(obj, *args, **kwargs)
+        except Exception, e:
+            if record.error is None:
+                record.error = e
+            
+            raise
+        finally:
+            stop(record)
+    
+    return wraps(func)(wrapper)
+
+
+def timed(phase):
+    """
+    A decorator that adds the time spent in the method to the ``phase`` of
+    the current ``QueryRecord``.
+    """
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            record = current()
+            
+            if record is None:
+                return func(*args, **kwargs)
+            
+            record.enter_phase()
+            start = time()
+            
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record.exit_phase(phase, time() - start)
+        
+        return wraps(func)(wrapper)
+    
+    return decorator
+
+
+def get_connection_alias(obj):
+    """
+    Works out which connection a backend, ``SearchQuery`` or
+    ``SearchQuerySet`` is using.
+    """
+    if hasattr(obj, 'connection_alias'):
+        return obj.connection_alias
+    
+    query = getattr(obj, 'query', None)
+    
+    if query is not None:
+        return getattr(query, '_using', None)
+    
+    return getattr(obj, '_using', None)
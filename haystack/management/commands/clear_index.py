@@ -2,6 +2,7 @@ from optparse import make_option
 import sys
 from django.core.management.base import BaseCommand
 from haystack.constants import DEFAULT_ALIAS
+from haystack.query_cache import invalidate_query_caches
 
 
 class Command(BaseCommand):
@@ -39,6 +40,7 @@ class Command(BaseCommand):
         
         backend = connections[self.using].get_backend()
         backend.clear()
+        invalidate_query_caches(connections[self.using].get_unified_index().get_indexed_models())
         
         if self.verbosity >= 1:
             print "All documents removed."
@@ -8,6 +8,7 @@ from django.utils.encoding import smart_str
 from haystack import connections, connection_router
 from haystack.constants import DEFAULT_ALIAS
 from haystack.query import SearchQuerySet
+from haystack.query_cache import invalidate_query_caches
 
 
 DEFAULT_BATCH_SIZE = None
@@ -140,20 +141,21 @@ class Command(AppCommand):
                     for pk in qs:
                         pks_seen.add(smart_str(pk))
                 
-                for start in range(0, total, self.backend.batch_size):
-                    upper_bound = start + self.backend.batch_size
-                    
-                    # Fetch a list of results.
-                    # Can't do pk range, because id's are strings (thanks comments
-                    # & UUIDs!).
-                    stuff_in_the_index = SearchQuerySet().models(model)[start:upper_bound]
-                    
-                    # Iterate over those results.
-                    for result in stuff_in_the_index:
-                        # Be careful not to hit the DB.
-                        if not smart_str(result.pk) in pks_seen:
-                            # The id is NOT in the small_cache_qs, issue a delete.
-                            if self.verbosity >= 2:
-                                print "  removing %s." % result.pk
-                            
-                            self.backend.remove(".".join([result.app_label, result.model_name, str(result.pk)]))
+                # Walk the results a batch at a time, fetching the next batch
+                # in the background while this one is checked.
+                # Can't do pk range, because id's are strings (thanks comments
+                # & UUIDs!).
+                stuff_in_the_index = SearchQuerySet().using(self.using).models(model).read_ahead()
+                
+                for result in stuff_in_the_index.iterator(chunk_size=self.backend.batch_size):
+                    # Be careful not to hit the DB.
+                    if not smart_str(result.pk) in pks_seen:
+                        # The id is NOT in the small_cache_qs, issue a delete.
+                        if self.verbosity >= 2:
+                            print "  removing %s." % result.pk
+                        
+                        self.backend.remove(".".join([result.app_label, result.model_name, str(result.pk)]))
+            
+            # The backend was used directly, so cached results need to be
+            # thrown out here.
+            invalidate_query_caches([model])
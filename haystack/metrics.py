@@ -0,0 +1,408 @@
+import logging
+import os
+import tempfile
+import threading
+from bisect import bisect_left
+from time import time
+from django.conf import settings
+from django.utils.functional import wraps
+from haystack.utils.http_pool import get_connection_pools
+
+
+# The backend methods that get metered on every ``SearchBackend``.
+METERED_ACTIONS = ('search', 'count', 'estimate_count', 'facet_counts', 'fetch_fields', 'more_like_this', 'update', 'remove', 'clear')
+
+# The upper bounds (in seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger('haystack')
+_local = threading.local()
+
+
+class Histogram(object):
+    """
+    Counts observations into buckets with fixed upper ``bounds`` (plus one
+    for anything larger), in the style of a Prometheus histogram.
+    """
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+    
+    def quantile(self, q):
+        """
+        Estimates the ``q`` quantile (between 0 & 1) of what's been observed,
+        by interpolating within the bucket it falls in. Returns ``None`` if
+        nothing's been observed.
+        """
+        if not self.count:
+            return None
+        
+        rank = q * self.count
+        seen = 0
+        
+        for position, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if position == len(self.bounds):
+                    # Nothing's known about how large these are.
+                    return self.bounds[-1]
+                
+                lower = 0.0
+                
+                if position > 0:
+                    lower = self.bounds[position - 1]
+                
+                return lower + (self.bounds[position] - lower) * (rank - seen) / count
+            
+            seen += count
+        
+        return self.bounds[-1]
+    
+    def cumulative_counts(self):
+        """
+        Returns ``(bound, count)`` pairs of how many observations were at or
+        below each bound, ending with ``(None, count)`` for all of them.
+        """
+        pairs = []
+        total = 0
+        
+        for bound, count in zip(self.bounds + (None,), self.counts):
+            total += count
+            pairs.append((bound, total))
+        
+        return pairs
+
+
+class OperationMetrics(object):
+    """
+    The metrics for one kind of operation (``search``, ``update``, etc.) on
+    one connection.
+    """
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.documents = 0
+        self.payload_bytes = 0
+    
+    def as_dict(self):
+        return {
+            'count': self.latency.count,
+            'errors': self.errors,
+            'documents': self.documents,
+            'payload_bytes': self.payload_bytes,
+            'seconds': self.latency.sum,
+            'p50': self.latency.quantile(0.5),
+            'p99': self.latency.quantile(0.99),
+        }
+
+
+class MetricsRegistry(object):
+    """
+    Keeps the metrics for every backend operation in the process, by
+    connection alias & operation.
+    
+    Everything is kept in memory, with a fixed amount of space for each
+    alias & operation, so it can be left on all the time.
+    """
+    def __init__(self, enabled=True, export_path=None, export_interval=15):
+        self.enabled = enabled
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_export = 0
+    
+    def observe(self, connection_alias, action, duration, documents=0, payload_bytes=0, error=False):
+        """
+        Records an operation that took ``duration`` seconds.
+        """
+        self._lock.acquire()
+        
+        try:
+            key = (connection_alias, action)
+            
+            if key not in self._metrics:
+                self._metrics[key] = OperationMetrics()
+            
+            metrics = self._metrics[key]
+            metrics.latency.observe(duration)
+            metrics.documents += documents
+            metrics.payload_bytes += payload_bytes
+            
+            if error:
+                metrics.errors += 1
+        finally:
+            self._lock.release()
+        
+        if self.export_path and time() - self._last_export >= self.export_interval:
+            self._last_export = time()
+            
+            try:
+                self.write_prometheus(self.export_path)
+            except (IOError, OSError), e:
+                # Metrics shouldn't get in the way of searching.
+                log.error("Failed to write the search metrics to '%s': %s", self.export_path, e)
+    
+    def quantile(self, connection_alias, action, q):
+        """
+        Estimates the ``q`` quantile of the latency (in seconds) of an
+        operation on a connection, or ``None`` if it hasn't run yet.
+        """
+        self._lock.acquire()
+        
+        try:
+            metrics = self._metrics.get((connection_alias, action))
+            
+            if metrics is None:
+                return None
+            
+            return metrics.latency.quantile(q)
+        finally:
+            self._lock.release()
+    
+    def summary(self):
+        """
+        Returns a dictionary of the metrics for each connection alias, by
+        operation.
+        """
+        summary = {}
+        self._lock.acquire()
+        
+        try:
+            for (connection_alias, action), metrics in self._metrics.items():
+                summary.setdefault(connection_alias, {})[action] = metrics.as_dict()
+        finally:
+            self._lock.release()
+        
+        return summary
+    
+    def reset(self):
+        self._lock.acquire()
+        
+        try:
+            self._metrics = {}
+        finally:
+            self._lock.release()
+    
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        self._lock.acquire()
+        
+        try:
+            items = sorted(self._metrics.items())
+            lines = [
+                '# HELP haystack_backend_duration_seconds Time spent in search backend operations.',
+                '# TYPE haystack_backend_duration_seconds histogram',
+            ]
+            
+            for (connection_alias, action), metrics in items:
+                labels = 'connection="%s",action="%s"' % (escape_label(connection_alias), escape_label(action))
+                
+                for bound, count in metrics.latency.cumulative_counts():
+                    if bound is None:
+                        le = '+Inf'
+                    else:
+                        le = repr(bound)
+                    
+                    lines.append('haystack_backend_duration_seconds_bucket{%s,le="%s"} %d' % (labels, le, count))
+                
+                lines.append('haystack_backend_duration_seconds_sum{%s} %r' % (labels, metrics.latency.sum))
+                lines.append('haystack_backend_duration_seconds_count{%s} %d' % (labels, metrics.latency.count))
+            
+            for name, attribute, description in (('errors', 'errors', 'Search backend operations that failed.'),
+                                                 ('documents', 'documents', 'Documents returned, sent or removed by search backend operations.'),
+                                                 ('payload_bytes', 'payload_bytes', 'Bytes sent to & received from the search engine.')):
+                lines.append('# HELP haystack_backend_%s_total %s' % (name, description))
+                lines.append('# TYPE haystack_backend_%s_total counter' % name)
+                
+                for (connection_alias, action), metrics in items:
+                    labels = 'connection="%s",action="%s"' % (escape_label(connection_alias), escape_label(action))
+                    lines.append('haystack_backend_%s_total{%s} %d' % (name, labels, getattr(metrics, attribute)))
+        finally:
+            self._lock.release()
+        
+        lines.extend(self.http_pool_lines())
+        return '\n'.join(lines) + '\n'
+    
+    def http_pool_lines(self):
+        """
+        Returns the Prometheus lines for the reuse of the HTTP connection
+        pools (if any have been created).
+        """
+        pools = []
+        
+        for connection_alias, connection_pools in sorted(get_connection_pools().items()):
+            for pool in connection_pools:
+                labels = 'connection="%s",host="%s"' % (escape_label(connection_alias), escape_label('%s:%s' % (pool.host, pool.port or '')))
+                pools.append((labels, pool.stats()))
+        
+        if not pools:
+            return []
+        
+        lines = []
+        
+        for stat, description in (('requests', 'Requests sent over pooled HTTP connections.'),
+                                  ('created', 'HTTP connections opened.'),
+                                  ('reused', 'Requests sent over an idle HTTP connection.'),
+                                  ('retried', 'Requests sent again after an idle HTTP connection failed.'),
+                                  ('discarded', 'HTTP connections closed.')):
+            lines.append('# HELP haystack_http_pool_%s_total %s' % (stat, description))
+            lines.append('# TYPE haystack_http_pool_%s_total counter' % stat)
+            
+            for labels, stats in pools:
+                lines.append('haystack_http_pool_%s_total{%s} %d' % (stat, labels, stats[stat]))
+        
+        lines.append('# HELP haystack_http_pool_idle_connections Idle HTTP connections kept for reuse.')
+        lines.append('# TYPE haystack_http_pool_idle_connections gauge')
+        
+        for labels, stats in pools:
+            lines.append('haystack_http_pool_idle_connections{%s} %d' % (labels, stats['idle']))
+        
+        return lines
+    
+    def write_prometheus(self, path):
+        """
+        Writes the metrics in the Prometheus text exposition format to
+        ``path``, replacing the file in one go so that readers (such as the
+        node exporter's textfile collector) never see half of it.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.haystack-metrics')
+        
+        try:
+            os.write(fd, self.to_prometheus().encode('utf-8'))
+        finally:
+            os.close(fd)
+        
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+
+
+class Operation(object):
+    """
+    A backend operation that's running on this thread.
+    """
+    def __init__(self, backend, action):
+        self.backend = backend
+        self.action = action
+        self.documents = 0
+        self.payload_bytes = 0
+        self.error = False
+
+
+def escape_label(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def get_operations():
+    if not hasattr(_local, 'operations'):
+        _local.operations = []
+    
+    return _local.operations
+
+
+def add_payload_bytes(count):
+    """
+    Adds ``count`` bytes sent to or received from the search engine to the
+    backend operation running on this thread, if any.
+    """
+    operations = get_operations()
+    
+    if operations:
+        operations[-1].payload_bytes += count
+
+
+def mark_error():
+    """
+    Counts the backend operation running on this thread, if any, as an error
+    even though no exception escapes it (for backends that log failures &
+    return empty results instead).
+    """
+    operations = get_operations()
+    
+    if operations:
+        operations[-1].error = True
+
+
+def count_documents(iterable, operation):
+    for item in iterable:
+        operation.documents += 1
+        yield item
+
+
+def metered(action):
+    """
+    A decorator that records the latency, errors & documents of a backend
+    method in the ``registry``.
+    
+    Applied automatically to the ``METERED_ACTIONS`` of every
+    ``SearchBackend``. Calls a backend makes to its own metered methods while
+    one is running (such as through ``super``, or a ``count`` that runs a
+    ``search``) are part of that operation, so they count once.
+    """
+    def decorator(func):
+        def wrapper(obj, *args, **kwargs):
+            operations = get_operations()
+            
+            if not registry.enabled or (operations and operations[-1].backend is obj):
+                return func(obj, *args, **kwargs)
+            
+            operation = Operation(obj, action)
+            args = list(args)
+            
+            if action == 'update' and len(args) > 1:
+                if hasattr(args[1], '__len__'):
+                    operation.documents = len(args[1])
+                else:
+                    args[1] = count_documents(args[1], operation)
+            elif action == 'remove':
+                operation.documents = 1
+            
+            operations.append(operation)
+            error = False
+            start = time()
+            
+            try:
+                results = func(obj, *args, **kwargs)
+                
+                if action in ('search', 'more_like_this') and isinstance(results, dict):
+                    operation.documents = len(results.get('results', []))
+                
+                return results
+            except Exception:
+                error = True
+                raise
+            finally:
+                duration = time() - start
+                operations.pop()
+                registry.observe(obj.connection_alias, action, duration, documents=operation.documents, payload_bytes=operation.payload_bytes, error=error or operation.error)
+        
+        return wraps(func)(wrapper)
+    
+    return decorator
+
+
+class MeteredBackend(type):
+    """
+    Metaclass for ``SearchBackend``s that meters the ``METERED_ACTIONS``
+    defined by each class.
+    """
+    def __new__(cls, name, bases, attrs):
+        for action in METERED_ACTIONS:
+            if action in attrs:
+                attrs[action] = metered(action)(attrs[action])
+        
+        return super(MeteredBackend, cls).__new__(cls, name, bases, attrs)
+
+
+registry = MetricsRegistry(enabled=getattr(settings, 'HAYSTACK_METRICS', True),
+                           export_path=getattr(settings, 'HAYSTACK_METRICS_FILE', None),
+                           export_interval=getattr(settings, 'HAYSTACK_METRICS_FILE_INTERVAL', 15))
@@ -26,6 +26,8 @@ class SearchResult(object):
         self._model = None
         self._verbose_name = None
         self._additional_fields = []
+        self._loaded_fields = None
+        self._using = None
         self.stored_fields = None
         self.log = self._get_log()
         
@@ -47,7 +49,47 @@ class SearchResult(object):
         if attr == '__getnewargs__':
             raise AttributeError
         
+        if self.__dict__.get('_loaded_fields') is not None and not attr.startswith('_'):
+            self._load_deferred_fields(attr)
+        
         return self.__dict__.get(attr, None)
+    
+    def defer_fields(self, loaded_fields, using):
+        """
+        Notes that only the ``loaded_fields`` were fetched from connection
+        ``using``, so the rest of the stored fields get fetched on access.
+        """
+        self._loaded_fields = loaded_fields
+        self._using = using
+    
+    def _load_deferred_fields(self, attr):
+        from haystack import connections
+        
+        try:
+            index = connections[self._using].get_unified_index().get_index(self.model)
+        except NotHandled:
+            return
+        
+        deferred = [field_name for field_name, field in index.fields.items() if field.stored and not field_name in self._loaded_fields]
+        
+        if not attr in deferred:
+            return
+        
+        # Fetch them all at once, rather than one trip per field.
+        identifier = u'%s.%s.%s' % (self.app_label, self.model_name, self.pk)
+        
+        try:
+            values = connections[self._using].get_backend().fetch_fields(identifier, index, deferred)
+        except NotImplementedError:
+            self.log.warning("The backend for '%s' can't fetch deferred fields." % self._using)
+            values = None
+        
+        self._loaded_fields = None
+        
+        for field_name in deferred:
+            if not field_name in self.__dict__:
+                self.__dict__[field_name] = (values or {}).get(field_name)
+                self._additional_fields.append(field_name)
 
     def _get_searchindex(self):
         from haystack import connections
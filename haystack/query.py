@@ -1,9 +1,354 @@
+import base64
+import itertools
+import logging
+import math
 import operator
+import sys
+import threading
 import warnings
-from haystack import connections, connection_router
+from bisect import bisect_left, bisect_right
+from copy import copy
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Full
+from time import time
+from django.db import connections as db_connections, transaction
+from haystack import connections, connection_router, instrumentation
 from haystack.backends import SQ
-from haystack.constants import REPR_OUTPUT_SIZE, ITERATOR_LOAD_PER_QUERY, DEFAULT_OPERATOR, DEFAULT_ALIAS
+from haystack.constants import REPR_OUTPUT_SIZE, ITERATOR_LOAD_PER_QUERY, ITERATOR_LOAD_GROWTH, ITERATOR_MAX_LOAD_PER_QUERY, LOAD_ALL_THREADS, ASYNC_THREADS, DEFAULT_OPERATOR, DEFAULT_ALIAS
 from haystack.exceptions import NotHandled
+from haystack.models import SearchResult
+
+
+log = logging.getLogger('haystack')
+
+
+class ResultCache(object):
+    """
+    A sparse cache of search results, keyed by their offset within the full
+    set of results.
+    
+    Results are stored in fixed-size chunks, which are only allocated once a
+    result that falls within them has been fetched. Memory use therefore
+    follows what has actually been loaded, not the total number of hits.
+    
+    The filled offsets are tracked as sorted, non-overlapping ``[start, end)``
+    ranges (kept as two parallel lists so they can be bisected). Checking an
+    offset or range costs ``O(log n)`` in the number of ranges, while the
+    number of filled results and the first unfilled offset are ``O(1)``.
+    """
+    chunk_size = 100
+    
+    def __init__(self):
+        # The number of hits the backend reported, once known.
+        self.size = None
+        self._chunks = {}
+        self._starts = []
+        self._ends = []
+        self._filled_count = 0
+    
+    def __len__(self):
+        return self._filled_count
+    
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            for result in self._get_range(start, end):
+                yield result
+    
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            start = k.start or 0
+            stop = k.stop
+            results = []
+            
+            # Skip straight to the first range that could hold ``start``.
+            offset = max(bisect_right(self._starts, start) - 1, 0)
+            
+            for range_start, range_end in zip(self._starts[offset:], self._ends[offset:]):
+                if stop is not None and range_start >= stop:
+                    break
+                
+                if stop is not None:
+                    range_end = min(stop, range_end)
+                
+                results.extend(self._get_range(max(start, range_start), range_end))
+            
+            return results
+        
+        if self._find_range(k, k + 1) is not None:
+            return self._get(k)
+        
+        if self.size is not None and k < self.size:
+            # A hole (likely a result dropped by the backend or ``load_all``).
+            return None
+        
+        raise IndexError("Result %s is not in the cache." % k)
+    
+    def _get(self, position):
+        chunk_number, index = divmod(position, self.chunk_size)
+        return self._chunks[chunk_number][index]
+    
+    def _get_range(self, start, end):
+        results = []
+        
+        while start < end:
+            chunk_number, index = divmod(start, self.chunk_size)
+            count = min(self.chunk_size - index, end - start)
+            results.extend(self._chunks[chunk_number][index:index + count])
+            start += count
+        
+        return results
+    
+    def _find_range(self, start, end):
+        """
+        Returns the index of the filled range containing all of ``start`` up
+        to ``end``, or ``None`` if there isn't one.
+        """
+        offset = bisect_right(self._starts, start) - 1
+        
+        if offset >= 0 and end <= self._ends[offset]:
+            return offset
+        
+        return None
+    
+    def fill(self, start, results):
+        """Stores the ``results`` at consecutive offsets beginning at ``start``."""
+        position = start
+        offset = 0
+        
+        while offset < len(results):
+            chunk_number, index = divmod(position, self.chunk_size)
+            chunk = self._chunks.get(chunk_number)
+            
+            if chunk is None:
+                chunk = self._chunks[chunk_number] = [None] * self.chunk_size
+            
+            count = min(self.chunk_size - index, len(results) - offset)
+            chunk[index:index + count] = results[offset:offset + count]
+            offset += count
+            position += count
+        
+        if results:
+            self._mark_filled(start, start + len(results))
+    
+    def _mark_filled(self, start, end):
+        # Find the run of ranges that overlap or touch the new one & merge
+        # them all into a single range.
+        low = bisect_left(self._ends, start)
+        high = bisect_right(self._starts, end)
+        
+        if low < high:
+            start = min(start, self._starts[low])
+            end = max(end, self._ends[high - 1])
+        
+        for offset in xrange(low, high):
+            self._filled_count -= self._ends[offset] - self._starts[offset]
+        
+        self._starts[low:high] = [start]
+        self._ends[low:high] = [end]
+        self._filled_count += end - start
+    
+    def first_unfilled(self):
+        """Returns the lowest offset that has not been filled."""
+        if self._starts and self._starts[0] == 0:
+            return self._ends[0]
+        
+        return 0
+    
+    def is_filled(self, start=None, end=None):
+        """
+        Checks if every offset from ``start`` up to (but not including)
+        ``end`` has been filled. Offsets past the number of hits are ignored.
+        """
+        if self.size is None:
+            return False
+        
+        if start is None:
+            start = 0
+        
+        if end is None or end > self.size:
+            end = self.size
+        
+        if start >= end:
+            return True
+        
+        return self._find_range(start, end) is not None
+    
+    def is_full(self):
+        """Checks if every one of the hits has been filled."""
+        return bool(self.size) and self.first_unfilled() >= self.size
+
+
+def threaded_read_ahead(iterable, depth=1):
+    """
+    Consumes ``iterable`` in a background thread, staying up to ``depth``
+    items ahead of whatever is iterating over the returned generator.
+    
+    Exceptions raised while fetching are re-raised in the consuming thread.
+    If the consumer stops early, the background thread is told to stop too.
+    """
+    buffered = Queue(maxsize=depth)
+    finished = threading.Event()
+    
+    def put(item):
+        # Don't block forever if the consumer has gone away.
+        while not finished.isSet():
+            try:
+                buffered.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        
+        return False
+    
+    def fetch():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception:
+            put((None, sys.exc_info()))
+        else:
+            put((None, None))
+    
+    worker = threading.Thread(target=fetch, name='haystack-read-ahead')
+    worker.setDaemon(True)
+    worker.start()
+    
+    try:
+        while True:
+            item, exc_info = buffered.get()
+            
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            
+            if item is None:
+                break
+            
+            yield item
+    finally:
+        finished.set()
+
+
+# Shared by every ``SearchQuerySet`` for loading objects in parallel. Only
+# started when first needed.
+_load_all_pool = None
+_load_all_pool_lock = threading.Lock()
+
+
+def get_load_all_pool():
+    """
+    Returns the thread pool used to load objects for several models at once,
+    creating it (with ``HAYSTACK_LOAD_ALL_THREADS`` threads) if needed.
+    """
+    global _load_all_pool
+    
+    if _load_all_pool is None:
+        _load_all_pool_lock.acquire()
+        
+        try:
+            if _load_all_pool is None:
+                _load_all_pool = ThreadPool(LOAD_ALL_THREADS)
+        finally:
+            _load_all_pool_lock.release()
+    
+    return _load_all_pool
+
+
+# Shared by every ``SearchQuerySet`` for running searches in the background.
+# Only started when first needed.
+_async_pool = None
+_async_pool_lock = threading.Lock()
+
+
+def get_async_pool():
+    """
+    Returns the thread pool used by the ``a*`` methods of ``SearchQuerySet``,
+    creating it (with ``HAYSTACK_ASYNC_THREADS`` threads) if needed.
+    """
+    global _async_pool
+    
+    if _async_pool is None:
+        _async_pool_lock.acquire()
+        
+        try:
+            if _async_pool is None:
+                _async_pool = ThreadPool(ASYNC_THREADS)
+        finally:
+            _async_pool_lock.release()
+    
+    return _async_pool
+
+
+def pooled_read_ahead(iterable, pool):
+    """
+    Consumes ``iterable`` on the threads of ``pool``, fetching the next item
+    while the current one is being used.
+    
+    Unlike ``threaded_read_ahead``, this doesn't need a thread of its own, so
+    any number of these can share the same few threads. Exceptions raised
+    while fetching are re-raised in the consuming thread.
+    """
+    iterator = iter(iterable)
+    pending = pool.apply_async(iterator.next)
+    
+    while True:
+        try:
+            item = pending.get()
+        except StopIteration:
+            return
+        
+        pending = pool.apply_async(iterator.next)
+        yield item
+
+
+def encode_cursor(kind, value):
+    """
+    Wraps a backend cursor (``kind`` of ``'c'``) or an offset (``kind`` of
+    ``'o'``) into an opaque, URL-safe token.
+    """
+    return base64.urlsafe_b64encode('%s:%s' % (kind, value))
+
+
+def decode_cursor(token):
+    """
+    Unwraps a token from ``encode_cursor``, returning the ``(kind, value)``.
+    """
+    try:
+        kind, value = base64.urlsafe_b64decode(str(token)).split(':', 1)
+    except (TypeError, ValueError):
+        raise ValueError("'%s' is not a valid cursor." % token)
+    
+    if not kind in ('c', 'o'):
+        raise ValueError("'%s' is not a valid cursor." % token)
+    
+    return kind, value
+
+
+class CursorPage(object):
+    """
+    A page of results fetched by ``SearchQuerySet.cursor_page``.
+    
+    ``next_cursor`` is the token for the page after this one, or ``None`` if
+    this is the last page.
+    """
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+    
+    def __repr__(self):
+        return '<CursorPage of %d result(s)>' % len(self)
+    
+    def __len__(self):
+        return len(self.object_list)
+    
+    def __iter__(self):
+        return iter(self.object_list)
+    
+    def __getitem__(self, k):
+        return self.object_list[k]
+    
+    def has_next(self):
+        return self.next_cursor is not None
 
 
 class SearchQuerySet(object):
@@ -17,18 +362,35 @@ class SearchQuerySet(object):
         # been forced with the ``.using`` method.
         self._using = using
         self.query = None
-        self._determine_backend()
         
         # If ``query`` is present, it should override even what the routers
-        # think.
+        # think, so don't bother asking them (this is the path every clone
+        # takes).
         if query is not None:
             self.query = query
+        else:
+            self._determine_backend()
         
-        self._result_cache = []
+        self._result_cache = ResultCache()
         self._result_count = None
+        # ``False`` while ``_result_count`` is only an estimate.
+        self._count_is_exact = True
         self._cache_full = False
         self._load_all = False
         self._ignored_result_count = 0
+        self._load_per_query = ITERATOR_LOAD_PER_QUERY
+        self._max_load_per_query = ITERATOR_MAX_LOAD_PER_QUERY
+        self._load_growth = ITERATOR_LOAD_GROWTH
+        self._read_ahead = 0
+        # The number of times results have been fetched from the backend.
+        self.round_trips = 0
+        # The time (in seconds) spent loading objects for ``load_all``, by
+        # model.
+        self.load_timings = {}
+        # Set by ``compact``, along with the ``(start, end)`` of the results
+        # to keep when pickled.
+        self._compact = False
+        self._compact_range = None
     
     def _determine_backend(self):
         # A backend has been manually selected. Use it instead.
@@ -54,11 +416,51 @@ class SearchQuerySet(object):
     def __getstate__(self):
         """
         For pickling.
+        
+        Nothing gets run to do so. Whatever results have been fetched so far
+        come along, unless this came from ``compact``.
         """
-        len(self)
         obj_dict = self.__dict__.copy()
         obj_dict['_iter'] = None
+        
+        if self._compact:
+            obj_dict.update(self._compact_state())
+        
         return obj_dict
+    
+    def _compact_state(self):
+        """
+        Returns the attributes to pickle in place of the current ones when
+        only the query (& perhaps a page of results) should be kept.
+        """
+        state = {
+            'query': self.query._clone(),
+            '_result_cache': ResultCache(),
+            '_result_count': None,
+            '_count_is_exact': True,
+            '_ignored_result_count': 0,
+            '_cache_full': False,
+            'round_trips': 0,
+            'load_timings': {},
+        }
+        
+        if self._compact_range is not None:
+            start, end = self._compact_range
+            state['_result_count'] = self._result_count
+            state['_count_is_exact'] = self._count_is_exact
+            state['_ignored_result_count'] = self._ignored_result_count
+            state['_result_cache'].size = self._result_cache.size
+            state['_result_cache'].fill(start, [self._trim_result(result) for result in self._result_cache[start:end]])
+        
+        return state
+    
+    def _trim_result(self, result):
+        # Any object loaded for the result can be fetched again when needed.
+        if isinstance(result, SearchResult) and result._object is not None:
+            result = copy(result)
+            result._object = None
+        
+        return result
 
     def __setstate__(self, data_dict):
         """
@@ -77,6 +479,7 @@ class SearchQuerySet(object):
     def __len__(self):
         if not self._result_count:
             self._result_count = self.query.get_count()
+            self._count_is_exact = self.query.count_is_exact()
             
             # Some backends give weird, false-y values here. Convert to zero.
             if not self._result_count:
@@ -113,64 +516,225 @@ class SearchQuerySet(object):
         if len(self) <= 0:
             return True
         
-        try:
-            self._result_cache.index(None)
-            return False
-        except ValueError:
-            # No ``None``s found in the results. Check the length of the cache.
-            return len(self._result_cache) > 0
+        return self._result_cache.is_full()
     
     def _manual_iter(self):
         # If we're here, our cache isn't fully populated.
         # For efficiency, fill the cache as we go if we run out of results.
         # Also, this can't be part of the __iter__ method due to Python's rules
         # about generator functions.
+        if self._read_ahead:
+            for result in self._read_ahead_iter():
+                yield result
+            
+            raise StopIteration
+        
         current_position = 0
         current_cache_max = 0
+        page_sizes = self._page_sizes()
+        initial_round_trips = self.round_trips
         
         while True:
-            if len(self._result_cache) > 0:
-                try:
-                    current_cache_max = self._result_cache.index(None)
-                except ValueError:
-                    current_cache_max = len(self._result_cache)
+            current_cache_max = self._result_cache.first_unfilled()
             
-            while current_position < current_cache_max:
-                yield self._result_cache[current_position]
-                current_position += 1
+            if current_position < current_cache_max:
+                for result in self._result_cache[current_position:current_cache_max]:
+                    yield result
+                
+                current_position = current_cache_max
             
             if self._cache_is_full():
+                self._log_iteration(current_position, self.round_trips - initial_round_trips)
                 raise StopIteration
             
             # We've run out of results and haven't hit our limit.
             # Fill more of the cache.
-            if not self._fill_cache(current_position, current_position + ITERATOR_LOAD_PER_QUERY):
+            if not self._fill_cache(current_position, current_position + page_sizes.next()):
+                self._log_iteration(current_position, self.round_trips - initial_round_trips)
                 raise StopIteration
     
+    def _read_ahead_iter(self):
+        # Hand out whatever's already cached up front, then pull the rest in
+        # a background thread, a page or more ahead of what's been consumed.
+        current_position = self._result_cache.first_unfilled()
+        
+        for result in self._result_cache[0:current_position]:
+            yield result
+        
+        if self._result_cache.is_full():
+            raise StopIteration
+        
+        pages = self._fetch_pages(self.query._clone(), self._page_sizes(), start=current_position)
+        round_trips = 0
+        
+        for start, end, results, hits in threaded_read_ahead(pages, self._read_ahead):
+            self.round_trips += 1
+            round_trips += 1
+            
+            if not results:
+                break
+            
+            for result in self._cache_results(start, results, hits):
+                current_position += 1
+                yield result
+        
+        self._log_iteration(current_position, round_trips)
+    
+    def _fetch_pages(self, query, page_sizes, start=0):
+        """
+        Fetches successive pages of results using the provided ``query``.
+        
+        Yields a ``(start, end, results, hits)`` tuple for each trip to the
+        backend, the last of which may have no results.
+        """
+        while True:
+            page_size = page_sizes.next()
+            query._reset()
+            query.set_limits(start, start + page_size)
+            results = query.get_results()
+            hits = query.get_count()
+            yield start, start + page_size, results, hits
+            
+            if not results:
+                return
+            
+            # Advance by the requested page size, not the number of results
+            # received, as the backend may drop results for unhandled models.
+            start += page_size
+            
+            if start >= hits:
+                return
+    
+    def _page_sizes(self):
+        """
+        Yields how many results to fetch for each successive page when
+        iterating.
+        
+        Starts small, so the first results come back quickly, then grows
+        geometrically (by ``_load_growth``) up to ``_max_load_per_query``.
+        Any growth above 1 adds at least one result per page, so small pages
+        still grow with fractional factors.
+        """
+        size = self._load_per_query
+        maximum = max(self._max_load_per_query, self._load_per_query)
+        
+        while True:
+            yield size
+            
+            if self._load_growth > 1:
+                size = min(max(int(math.ceil(size * self._load_growth)), size + 1), maximum)
+    
+    def _log_iteration(self, result_count, round_trips):
+        log.debug("Iterated over %d results using %d round trip(s) to the backend.", result_count, round_trips)
+    
     def _fill_cache(self, start, end):
         # Tell the query where to start from and how many we'd like.
         self.query._reset()
         self.query.set_limits(start, end)
+        self.round_trips += 1
+        return self._cache_query_results(start, end)
+    
+    @instrumentation.traced
+    def _cache_query_results(self, start, end):
+        """
+        Caches the results of ``self.query``, which was limited to ``start``
+        & ``end``, running it first if needed.
+        """
         results = self.query.get_results()
         
         if results == None or len(results) == 0:
             return False
         
-        # Setup the full cache now that we know how many results there are.
-        # We need the ``None``s as placeholders to know what parts of the
-        # cache we have/haven't filled.
-        # Using ``None`` like this takes up very little memory. In testing,
-        # an array of 100,000 ``None``s consumed less than .5 Mb, which ought
-        # to be an acceptable loss for consistent and more efficient caching.
-        if len(self._result_cache) == 0:
-            self._result_cache = [None for i in xrange(self.query.get_count())]
-        
         if start is None:
             start = 0
         
         if end is None:
             end = self.query.get_count()
         
+        self._cache_results(start, results, self.query.get_count())
+        return True
+    
+    def _cache_results(self, start, results, hits):
+        """
+        Post-processes a page of ``results`` fetched from offset ``start`` &
+        stores them in the cache. Returns the results that were kept.
+        """
+        if self._result_count is None or not self._count_is_exact:
+            # Searches always count exactly, so this replaces any estimate.
+            self._result_count = hits
+            self._count_is_exact = True
+        
+        if self._result_cache.size is None:
+            self._result_cache.size = hits
+        
+        to_cache = self.post_process_results(results)
+        self._ignored_result_count += len(results) - len(to_cache)
+        self._result_cache.fill(start, to_cache)
+        return to_cache
+    
+    @instrumentation.timed('load_all')
+    def _load_objects(self, querysets, models_pks):
+        """
+        Fetches the objects for each model's primary keys using the matching
+        queryset. Returns a dictionary of ``in_bulk`` results by model.
+        
+        When several models are involved & the databases allow it, the
+        queries run at the same time in a thread pool. Otherwise, they run one
+        after the other.
+        """
+        def load(model):
+            start = time()
+            objects = querysets[model].in_bulk(models_pks[model])
+            elapsed = time() - start
+            log.debug("Loaded %d of %d '%s.%s' object(s) in %.3fs.", len(objects), len(models_pks[model]), model._meta.app_label, model._meta.module_name, elapsed)
+            return model, objects, elapsed
+        
+        def load_in_pool(model):
+            try:
+                return load(model)
+            finally:
+                # The pool's threads never see ``request_finished``, so
+                # nothing else would end the transaction (& its snapshot).
+                db_connections[querysets[model].db].close()
+        
+        if self._can_load_in_parallel(querysets):
+            loaded = get_load_all_pool().map(load_in_pool, querysets.keys())
+        else:
+            loaded = [load(model) for model in querysets]
+        
+        loaded_objects = {}
+        
+        for model, objects, elapsed in loaded:
+            loaded_objects[model] = objects
+            self.load_timings[model] = self.load_timings.get(model, 0) + elapsed
+        
+        return loaded_objects
+    
+    def _can_load_in_parallel(self, querysets):
+        if LOAD_ALL_THREADS <= 1 or len(querysets) <= 1:
+            return False
+        
+        for queryset in querysets.values():
+            # SQLite connections can't be shared with other threads, & other
+            # threads can't see anything uncommitted in a managed transaction.
+            if db_connections[queryset.db].settings_dict['ENGINE'].endswith('sqlite3'):
+                return False
+            
+            if transaction.is_managed(using=queryset.db):
+                return False
+        
+        return True
+    
+    @instrumentation.traced
+    @instrumentation.timed('hydrate')
+    def post_process_results(self, results):
+        """
+        Prepares a page of raw results from the backend for consumption.
+        
+        If ``load_all`` is in effect, the database objects for the page are
+        fetched (one query per model) & attached, dropping any results whose
+        object no longer exists.
+        """
         # Check if we wish to load all objects.
         if self._load_all:
             original_results = []
@@ -182,21 +746,26 @@ class SearchQuerySet(object):
                 original_results.append(result)
                 models_pks.setdefault(result.model, []).append(result.pk)
             
-            # Load the objects for each model in turn.
+            ui = connections[self.query._using].get_unified_index()
+            querysets = {}
+            
             for model in models_pks:
                 try:
-                    ui = connections[self.query._using].get_unified_index()
-                    index = ui.get_index(model)
-                    objects = index.read_queryset()
-                    loaded_objects[model] = objects.in_bulk(models_pks[model])
+                    querysets[model] = ui.get_index(model).read_queryset()
                 except NotHandled:
-                    self.log.warning("Model '%s.%s' not handled by the routers." % (self.app_label, self.model_name))
+                    log.warning("Model '%s.%s' not handled by the routers." % (model._meta.app_label, model._meta.module_name))
                     # Revert to old behaviour
-                    loaded_objects[model] = model._default_manager.in_bulk(models_pks[model])
-
-        to_cache = []
+                    querysets[model] = model._default_manager.all()
+            
+            loaded_objects = self._load_objects(querysets, models_pks)
+        
+        processed = []
+        loaded_fields = self.query.get_loaded_fields()
         
         for result in results:
+            if loaded_fields is not None and hasattr(result, 'defer_fields'):
+                result.defer_fields(loaded_fields, self.query._using)
+            
             if self._load_all:
                 # We have to deal with integer keys being cast from strings
                 model_objects = loaded_objects.get(result.model, {})
@@ -210,14 +779,11 @@ class SearchQuerySet(object):
                 except KeyError:
                     # The object was either deleted since we indexed or should
                     # be ignored; fail silently.
-                    self._ignored_result_count += 1
                     continue
             
-            to_cache.append(result)
+            processed.append(result)
         
-        # Assign by slice.
-        self._result_cache[start:start + len(to_cache)] = to_cache
-        return True
+        return processed
     
     
     def __getitem__(self, k):
@@ -247,7 +813,7 @@ class SearchQuerySet(object):
             bound = k + 1
         
         # We need check to see if we need to populate more of the cache.
-        if len(self._result_cache) <= 0 or (None in self._result_cache[start:bound] and not self._cache_is_full()):
+        if len(self._result_cache) <= 0 or (not self._result_cache.is_filled(start, bound) and not self._cache_is_full()):
             try:
                 self._fill_cache(start, bound)
             except StopIteration:
@@ -370,12 +936,126 @@ class SearchQuerySet(object):
         clone.query.raw_search(query_string, **kwargs)
         return clone
     
+    def values(self, *fields):
+        """
+        Returns a ``SearchQuerySet`` that fetches only the provided stored
+        ``fields`` from the backend, giving a dictionary of them for each
+        result instead of a ``SearchResult``.
+        """
+        if not fields:
+            raise TypeError("values() requires at least one field name.")
+        
+        clone = self._clone(klass=ValuesSearchQuerySet)
+        clone._fields = fields
+        clone.query.set_values(fields)
+        return clone
+    
+    def values_list(self, *fields, **kwargs):
+        """
+        Like ``values``, but gives a tuple of the ``fields`` for each result.
+        With ``flat=True`` & a single field, gives just that field's value.
+        """
+        flat = kwargs.pop('flat', False)
+        
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments to values_list: %s" % kwargs.keys())
+        
+        if not fields:
+            raise TypeError("values_list() requires at least one field name.")
+        
+        if flat and len(fields) > 1:
+            raise TypeError("'flat' is not valid when values_list is called with more than one field.")
+        
+        clone = self._clone(klass=ValuesListSearchQuerySet)
+        clone._fields = fields
+        clone._flat = flat
+        clone.query.set_values(fields)
+        return clone
+    
+    def only(self, *fields):
+        """
+        Fetches only the provided stored ``fields`` from the backend. Any
+        other stored field is fetched (for that result) when first accessed.
+        """
+        clone = self._clone()
+        clone.query.add_only_fields(fields)
+        return clone
+    
+    def defer(self, *fields):
+        """
+        Leaves the provided stored ``fields`` out of what's fetched from the
+        backend, until first accessed on a result. ``defer(None)`` clears any
+        deferred fields.
+        """
+        clone = self._clone()
+        
+        if fields == (None,):
+            clone.query.add_deferred_fields(None)
+        else:
+            clone.query.add_deferred_fields(fields)
+        
+        return clone
+    
     def load_all(self):
         """Efficiently populates the objects in the search results."""
         clone = self._clone()
         clone._load_all = True
         return clone
     
+    def load_per_query(self, initial=None, maximum=None, growth=None):
+        """
+        Controls how many results are fetched at a time when iterating.
+        
+        Pages start at ``initial`` results & grow by a factor of ``growth``
+        each time, up to ``maximum``. Anything not provided falls back to the
+        ``HAYSTACK_ITERATOR_*`` settings.
+        """
+        clone = self._clone()
+        
+        if initial is not None:
+            clone._load_per_query = initial
+        
+        if maximum is not None:
+            clone._max_load_per_query = maximum
+        
+        if growth is not None:
+            clone._load_growth = growth
+        
+        if clone._load_per_query <= 0 or clone._max_load_per_query <= 0:
+            raise ValueError("The number of results to load per query must be greater than zero.")
+        
+        if clone._load_growth < 1:
+            raise ValueError("The 'growth' must be at least 1.")
+        
+        return clone
+    
+    def read_ahead(self, depth=1):
+        """
+        Fetches upcoming pages in a background thread while iterating.
+        
+        While one page of results is being consumed, up to ``depth`` further
+        pages are fetched from the backend, hiding its latency. A ``depth``
+        of ``0`` turns this off.
+        """
+        if depth < 0:
+            raise ValueError("The 'depth' must not be negative.")
+        
+        clone = self._clone()
+        clone._read_ahead = depth
+        return clone
+    
+    def approximate(self, threshold=1000):
+        """
+        Lets the backend estimate the number of results past ``threshold``,
+        rather than counting every one of them.
+        
+        Counts up to the ``threshold`` stay exact. Use ``count_is_exact`` to
+        tell the two apart. ``None`` goes back to exact counts.
+        """
+        clone = self._clone()
+        clone.query.set_count_threshold(threshold)
+        return clone
+    
     def auto_query(self, query_string):
         """
         Performs a best guess constructing the search query.
@@ -458,6 +1138,177 @@ class SearchQuerySet(object):
         """Returns the total number of matching results."""
         return len(self)
     
+    def count_is_exact(self):
+        """
+        Indicates if ``count`` is the exact number of results, rather than an
+        estimate from ``approximate``.
+        """
+        len(self)
+        return self._count_is_exact
+    
+    def compact(self, start=None, end=None):
+        """
+        Returns a copy that pickles compactly, for keeping in a cache or the
+        session.
+        
+        Only the query gets pickled, not the results, so it runs again once
+        the copy is unpickled & used. If ``start`` and/or ``end`` are given,
+        that slice of the results (fetched now, if needed) & the total count
+        are kept as well, without any objects loaded for them.
+        """
+        clone = self._clone()
+        clone._compact = True
+        
+        if start is not None or end is not None:
+            start = start or 0
+            results = self[start:end]
+            clone._result_count = self._result_count
+            clone._count_is_exact = self._count_is_exact
+            clone._ignored_result_count = self._ignored_result_count
+            clone._result_cache.size = self._result_cache.size
+            clone._result_cache.fill(start, results)
+            clone._compact_range = (start, start + len(results))
+        
+        return clone
+    
+    def iterator(self, chunk_size=None):
+        """
+        Iterates over the results a page at a time, without caching them.
+        
+        Only a single page is held in memory at once (plus any pages being
+        read ahead), which makes this suitable for walking very large result
+        sets. Pages are ``chunk_size`` results each if provided, otherwise
+        they grow as they would when iterating (see ``load_per_query``). Note
+        that the results are fetched from the backend every time this is
+        called.
+        """
+        if chunk_size is not None:
+            if chunk_size <= 0:
+                raise ValueError("The 'chunk_size' must be greater than zero.")
+            
+            page_sizes = itertools.repeat(chunk_size)
+        else:
+            page_sizes = self._page_sizes()
+        
+        pages = self._fetch_pages(self.query._clone(), page_sizes)
+        
+        if self._read_ahead:
+            pages = threaded_read_ahead(pages, self._read_ahead)
+        
+        seen = 0
+        round_trips = 0
+        
+        for start, end, results, hits in pages:
+            round_trips += 1
+            
+            for result in self.post_process_results(results):
+                seen += 1
+                yield result
+        
+        self._log_iteration(seen, round_trips)
+    
+    def aiterator(self, chunk_size=None):
+        """
+        Iterates over the results like ``iterator``, but fetches each page on
+        the shared async thread pool, while the previous page is being
+        consumed.
+        """
+        if chunk_size is not None:
+            if chunk_size <= 0:
+                raise ValueError("The 'chunk_size' must be greater than zero.")
+            
+            page_sizes = itertools.repeat(chunk_size)
+        else:
+            page_sizes = self._page_sizes()
+        
+        pages = self._fetch_pages(self.query._clone(), page_sizes)
+        seen = 0
+        round_trips = 0
+        
+        for start, end, results, hits in pooled_read_ahead(pages, get_async_pool()):
+            round_trips += 1
+            
+            for result in self.post_process_results(results):
+                seen += 1
+                yield result
+        
+        self._log_iteration(seen, round_trips)
+    
+    def acount(self, callback=None):
+        """
+        Counts the results on the shared async thread pool. Returns an
+        ``AsyncResult``, whose ``get`` returns the count.
+        """
+        return self._run_async(self.count, callback)
+    
+    def aget(self, k, callback=None):
+        """
+        Fetches an item or slice of the results on the shared async thread
+        pool. Returns an ``AsyncResult``, whose ``get`` returns ``self[k]``.
+        """
+        # Fail early, rather than from the pool.
+        if not isinstance(k, (slice, int, long)):
+            raise TypeError
+        
+        return self._run_async(lambda: self[k], callback)
+    
+    def _run_async(self, func, callback=None):
+        def run():
+            try:
+                return func()
+            finally:
+                # ``load_all`` may have used the database from the pool's
+                # thread, which never sees ``request_finished``.
+                for db_connection in db_connections.all():
+                    db_connection.close()
+        
+        return get_async_pool().apply_async(run, callback=callback)
+    
+    @instrumentation.traced
+    def cursor_page(self, cursor=None, page_size=None):
+        """
+        Returns a ``CursorPage`` of up to ``page_size`` results, following on
+        from the page that handed out the ``cursor`` (or from the start).
+        
+        On backends that support cursors, each page costs the same to fetch
+        however deep it is, where slicing sends an ever larger offset. Other
+        backends fall back to offsets behind the same (opaque) tokens.
+        """
+        if page_size is None:
+            page_size = self._load_per_query
+        
+        if page_size <= 0:
+            raise ValueError("The 'page_size' must be greater than zero.")
+        
+        clone = self._clone()
+        supports_cursors = clone.query.backend.supports_cursors
+        value = supports_cursors and '*' or 0
+        
+        if cursor is not None:
+            kind, value = decode_cursor(cursor)
+            
+            if (kind == 'c') != supports_cursors:
+                raise ValueError("The cursor '%s' wasn't made by this backend." % cursor)
+        
+        if supports_cursors:
+            clone.query.set_cursor(value)
+            clone.query.set_limits(0, page_size)
+        else:
+            offset = int(value)
+            clone.query.set_limits(offset, offset + page_size)
+        
+        results = clone.query.get_results()
+        self.round_trips += 1
+        next_cursor = None
+        
+        if supports_cursors:
+            if clone.query.get_next_cursor() is not None:
+                next_cursor = encode_cursor('c', clone.query.get_next_cursor())
+        elif len(results) and offset + len(results) < clone.query.get_count():
+            next_cursor = encode_cursor('o', offset + len(results))
+        
+        return CursorPage(self.post_process_results(results), next_cursor)
+    
     def best_match(self):
         """Returns the best/top search result that matches the query."""
         return self[0]
@@ -469,6 +1320,148 @@ class SearchQuerySet(object):
         clone.query.add_order_by("-%s" % date_field)
         return clone.best_match()
     
+    def exists(self):
+        """
+        Indicates if anything matches the query.
+        
+        Only the number of hits is requested, unless it's already known, &
+        backends may stop counting at the first one.
+        """
+        if len(self._result_cache) > 0:
+            return True
+        
+        if self._result_count is not None:
+            return len(self) > 0
+        
+        clone = self._clone()
+        clone.query.set_count_threshold(1)
+        return clone.query.get_count() > 0
+    
+    def first(self):
+        """
+        Returns the first result, or ``None`` if there are no results.
+        
+        Just the one result is requested (without facets, highlighting or a
+        spelling suggestion) & it isn't cached.
+        """
+        result = self._cached_result(0)
+        
+        if result is not None:
+            return result
+        
+        return self._single_result(0)
+    
+    def last(self):
+        """
+        Returns the last result, or ``None`` if there are no results.
+        
+        When the results are ordered, the ordering is reversed & the first
+        result fetched. Otherwise, the number of hits is needed first.
+        """
+        if self.query.order_by:
+            clone = self._clone()
+            order_by = []
+            
+            for field in clone.query.order_by:
+                if field.startswith('-'):
+                    order_by.append(field[1:])
+                else:
+                    order_by.append('-%s' % field)
+            
+            clone.query.clear_order_by()
+            
+            for field in order_by:
+                clone.query.add_order_by(field)
+            
+            return clone.first()
+        
+        count = len(self) + self._ignored_result_count
+        
+        if count <= 0:
+            return None
+        
+        result = self._cached_result(count - 1)
+        
+        if result is not None:
+            return result
+        
+        return self._single_result(count - 1, last=True)
+    
+    def _cached_result(self, position):
+        """
+        Returns the already cached result at ``position``, or ``None`` if it
+        hasn't been fetched.
+        """
+        if self._result_cache.is_filled(position, position + 1):
+            return self._result_cache[position]
+        
+        return None
+    
+    @instrumentation.traced
+    def _single_result(self, offset, last=False):
+        """
+        Fetches the result at ``offset`` on its own, with as little work for
+        the backend as possible.
+        """
+        results, raw_results = self._fetch_bare_page(offset, offset + 1)
+        
+        if results:
+            return results[0]
+        
+        if not raw_results:
+            return None
+        
+        # The result was dropped (its object is gone, for instance), so fall
+        # back to finding the nearest one that wasn't, a page at a time
+        # (growing as when iterating) in the direction being looked in.
+        page_sizes = self._page_sizes()
+        
+        if last:
+            end = offset
+            
+            while end > 0:
+                start = max(end - page_sizes.next(), 0)
+                results, raw_results = self._fetch_bare_page(start, end)
+                
+                if results:
+                    return results[-1]
+                
+                end = start
+            
+            return None
+        
+        start = offset + 1
+        
+        while True:
+            end = start + page_sizes.next()
+            results, raw_results = self._fetch_bare_page(start, end)
+            
+            if results:
+                return results[0]
+            
+            if not raw_results:
+                return None
+            
+            start = end
+    
+    def _fetch_bare_page(self, start, end):
+        """
+        Fetches the results from ``start`` up to ``end`` without facets,
+        highlighting or a spelling suggestion & without caching them.
+        
+        Returns the post-processed results & the raw ones from the backend.
+        """
+        clone = self._clone()
+        query = clone.query
+        query.set_limits(start, end)
+        query.facets = set()
+        query.date_facets = {}
+        query.query_facets = []
+        query.highlight = False
+        query.include_spelling = False
+        raw_results = query.get_results()
+        return clone.post_process_results(raw_results), raw_results
+    
     def more_like_this(self, model_instance):
         """Finds similar results to the object passed in."""
         clone = self._clone()
@@ -482,9 +1475,19 @@ class SearchQuerySet(object):
         This will cause the query to execute and should generally be used when
         presenting the data.
         """
+        if self.query.has_run():
+            return self.query.get_facet_counts()
+        
         clone = self._clone()
         return clone.query.get_facet_counts()
     
+    def afacet_counts(self, callback=None):
+        """
+        Fetches the facet counts on the shared async thread pool. Returns an
+        ``AsyncResult``, whose ``get`` returns the facet counts.
+        """
+        return self._run_async(self.facet_counts, callback)
+    
     def spelling_suggestion(self, preferred_query=None):
         """
         Returns the spelling suggestion found by the query.
@@ -508,6 +1511,10 @@ class SearchQuerySet(object):
         query = self.query._clone()
         clone = klass(query=query)
         clone._load_all = self._load_all
+        clone._load_per_query = self._load_per_query
+        clone._max_load_per_query = self._max_load_per_query
+        clone._load_growth = self._load_growth
+        clone._read_ahead = self._read_ahead
         return clone
 
 
@@ -523,9 +1530,18 @@ class EmptySearchQuerySet(SearchQuerySet):
         # Pretend the cache is always full with no results.
         return True
     
+    def exists(self):
+        return False
+    
+    def first(self):
+        return None
+    
+    def last(self):
+        return None
+    
     def _clone(self, klass=None):
         clone = super(EmptySearchQuerySet, self)._clone(klass=klass)
-        clone._result_cache = []
+        clone._result_cache = ResultCache()
         return clone
     
     def _fill_cache(self, start, end):
@@ -533,6 +1549,13 @@ class EmptySearchQuerySet(SearchQuerySet):
 
     def facet_counts(self):
         return {}
+    
+    def values(self, *fields):
+        # There's nothing to project, so stay empty.
+        return self._clone()
+    
+    def values_list(self, *fields, **kwargs):
+        return self._clone()
 
 
 class RelatedSearchQuerySet(SearchQuerySet):
@@ -546,16 +1569,43 @@ class RelatedSearchQuerySet(SearchQuerySet):
     _load_all_querysets = {}
     _result_cache = []
     
+    def __init__(self, using=None, query=None):
+        super(RelatedSearchQuerySet, self).__init__(using=using, query=query)
+        # Results are appended in the order they're loaded, so a plain list
+        # is all that's needed here.
+        self._result_cache = []
+    
     def _cache_is_full(self):
         return len(self._result_cache) >= len(self)
     
+    def _cached_result(self, position):
+        # The list only holds the results loaded so far, without offsets, so
+        # just the first result (or the last, once it's full) can be found.
+        if not self._result_cache:
+            return None
+        
+        if position == 0:
+            return self._result_cache[0]
+        
+        if self._cache_is_full() and position == len(self) + self._ignored_result_count - 1:
+            return self._result_cache[-1]
+        
+        return None
+    
     def _manual_iter(self):
         # If we're here, our cache isn't fully populated.
         # For efficiency, fill the cache as we go if we run out of results.
         # Also, this can't be part of the __iter__ method due to Python's rules
         # about generator functions.
+        if self._read_ahead:
+            for result in self._read_ahead_iter():
+                yield result
+            
+            raise StopIteration
+        
         current_position = 0
         current_cache_max = 0
+        page_sizes = self._page_sizes()
         
         while True:
             current_cache_max = len(self._result_cache)
@@ -571,13 +1621,36 @@ class RelatedSearchQuerySet(SearchQuerySet):
             # Fill more of the cache.
             start = current_position + self._ignored_result_count
             
-            if not self._fill_cache(start, start + ITERATOR_LOAD_PER_QUERY):
+            if not self._fill_cache(start, start + page_sizes.next()):
                 raise StopIteration
     
-    def _fill_cache(self, start, end):
-        # Tell the query where to start from and how many we'd like.
-        self.query._reset()
-        self.query.set_limits(start, end)
+    def _read_ahead_iter(self):
+        current_position = len(self._result_cache)
+        
+        for result in self._result_cache[:current_position]:
+            yield result
+        
+        # Anything cached means the count is already known.
+        if current_position and self._cache_is_full():
+            raise StopIteration
+        
+        start = current_position + self._ignored_result_count
+        pages = self._fetch_pages(self.query._clone(), self._page_sizes(), start=start)
+        
+        for start, end, results, hits in threaded_read_ahead(pages, self._read_ahead):
+            self.round_trips += 1
+            
+            if not results:
+                break
+            
+            if self._result_count is None:
+                self._result_count = hits
+            
+            for result in self._cache_page(start, end, results):
+                yield result
+    
+    @instrumentation.traced
+    def _cache_query_results(self, start, end):
         results = self.query.get_results()
         
         if len(results) == 0:
@@ -589,6 +1662,17 @@ class RelatedSearchQuerySet(SearchQuerySet):
         if end is None:
             end = self.query.get_count()
         
+        self._cache_page(start, end, results)
+        return True
+    
+    def _cache_page(self, start, end, results):
+        """
+        Loads the objects for a page of ``results`` (fetched for ``start`` up
+        to ``end``) if needed & appends them to the cache. Returns the results
+        that were kept.
+        """
+        cached = []
+        
         # Check if we wish to load all objects.
         if self._load_all:
             original_results = []
@@ -600,25 +1684,29 @@ class RelatedSearchQuerySet(SearchQuerySet):
                 original_results.append(result)
                 models_pks.setdefault(result.model, []).append(result.pk)
             
-            # Load the objects for each model in turn.
+            querysets = {}
+            
             for model in models_pks:
                 if model in self._load_all_querysets:
                     # Use the overriding queryset.
-                    loaded_objects[model] = self._load_all_querysets[model].in_bulk(models_pks[model])
+                    querysets[model] = self._load_all_querysets[model]
                 else:
                     # Check the SearchIndex for the model for an override.
                     try:
                         index = connections[self.query._using].get_unified_index().get_index(model)
-                        qs = index.load_all_queryset()
-                        loaded_objects[model] = qs.in_bulk(models_pks[model])
+                        querysets[model] = index.load_all_queryset()
                     except NotHandled:
                         # The model returned doesn't seem to be handled by the
                         # routers. We should silently fail and populate
                         # nothing for those objects.
                         loaded_objects[model] = []
+            
+            loaded_objects.update(self._load_objects(querysets, models_pks))
         
-        if len(results) + len(self._result_cache) < len(self) and len(results) < ITERATOR_LOAD_PER_QUERY:
-            self._ignored_result_count += ITERATOR_LOAD_PER_QUERY - len(results)
+        # Anything the backend didn't return for the page (unhandled models,
+        # say) won't show up, unless this was the last of the results.
+        if len(results) + len(self._result_cache) < len(self) and len(results) < end - start:
+            self._ignored_result_count += end - start - len(results)
         
         for result in results:
             if self._load_all:
@@ -637,8 +1725,9 @@ class RelatedSearchQuerySet(SearchQuerySet):
                     continue
             
             self._result_cache.append(result)
+            cached.append(result)
         
-        return True
+        return cached
     
     def __getitem__(self, k):
         """
@@ -668,10 +1757,12 @@ class RelatedSearchQuerySet(SearchQuerySet):
         
         # We need check to see if we need to populate more of the cache.
         if len(self._result_cache) <= 0 or not self._cache_is_full():
+            page_sizes = self._page_sizes()
+            
             try:
                 while len(self._result_cache) < bound and not self._cache_is_full():
                     current_max = len(self._result_cache) + self._ignored_result_count
-                    self._fill_cache(current_max, current_max + ITERATOR_LOAD_PER_QUERY)
+                    self._fill_cache(current_max, current_max + page_sizes.next())
             except StopIteration:
                 # There's nothing left, even though the bound is higher.
                 pass
@@ -695,11 +1786,126 @@ class RelatedSearchQuerySet(SearchQuerySet):
         return clone
     
     def _clone(self, klass=None):
-        if klass is None:
-            klass = self.__class__
-        
-        query = self.query._clone()
-        clone = klass(query=query)
-        clone._load_all = self._load_all
+        clone = super(RelatedSearchQuerySet, self)._clone(klass=klass)
         clone._load_all_querysets = self._load_all_querysets
         return clone
+
+
+
+class ValuesSearchQuerySet(SearchQuerySet):
+    """
+    A ``SearchQuerySet`` that gives a dictionary of the requested fields for
+    each result, rather than a ``SearchResult``.
+    
+    Created by ``SearchQuerySet.values``. Only those fields are fetched from
+    the backend & ``load_all`` has no effect.
+    """
+    _fields = ()
+    
+    @instrumentation.traced
+    @instrumentation.timed('hydrate')
+    def post_process_results(self, results):
+        to_cache = []
+        
+        for result in results:
+            if not isinstance(result, dict):
+                # The backend doesn't handle ``values`` itself.
+                result = dict([(field, getattr(result, field, None)) for field in self._fields])
+            
+            to_cache.append(self._build_row(result))
+        
+        return to_cache
+    
+    def _build_row(self, result):
+        return result
+    
+    def _clone(self, klass=None):
+        clone = super(ValuesSearchQuerySet, self)._clone(klass=klass)
+        clone._fields = self._fields
+        return clone
+
+
+class ValuesListSearchQuerySet(ValuesSearchQuerySet):
+    """
+    A ``SearchQuerySet`` that gives a tuple of the requested fields (or, when
+    ``flat``, the one field's value) for each result.
+    
+    Created by ``SearchQuerySet.values_list``.
+    """
+    _flat = False
+    
+    def _build_row(self, result):
+        if self._flat:
+            return result.get(self._fields[0])
+        
+        return tuple([result.get(field) for field in self._fields])
+    
+    def _clone(self, klass=None):
+        clone = super(ValuesListSearchQuerySet, self)._clone(klass=klass)
+        clone._flat = self._flat
+        return clone
+
+
+def multi_search(querysets):
+    """
+    Fetches the first page of results for several ``SearchQuerySet``s at once.
+    
+    The searches for each connection are handed to its backend's
+    ``multi_search`` together, which lets the backend run them concurrently
+    or share resources between them. Each ``SearchQuerySet``'s cache gets
+    filled (as does the query's, so ``facet_counts`` comes along for free)
+    & the ``SearchQuerySet``s are returned, in order.
+    """
+    querysets = list(querysets)
+    batches = {}
+    
+    for sqs in querysets:
+        if isinstance(sqs, EmptySearchQuerySet):
+            continue
+        
+        query = sqs.query
+        query._reset()
+        query.set_limits(0, sqs._load_per_query)
+        sqs.round_trips += 1
+        
+        if query._more_like_this or query._raw_query or query.matches_nothing():
+            # These have their own ways of running. Leave them to it.
+            sqs._cache_query_results(0, sqs._load_per_query)
+            continue
+        
+        batches.setdefault(query._using, []).append(sqs)
+    
+    for using, batch in batches.items():
+        query_cache = connections[using].get_query_cache()
+        searches = []
+        cache_keys = []
+        
+        for sqs in batch:
+            query_string, kwargs = sqs.query.build_search()
+            
+            if query_cache is not None:
+                key = query_cache.make_key('search', query_string, kwargs, sqs.query.get_cache_models())
+                results = query_cache.get(key)
+                
+                if results is not None:
+                    sqs.query.set_search_results(results)
+                    continue
+                
+                cache_keys.append(key)
+            
+            searches.append((sqs, query_string, kwargs))
+        
+        if searches:
+            backend = searches[0][0].query.backend
+            all_results = backend.multi_search([(query_string, kwargs) for sqs, query_string, kwargs in searches])
+            
+            for position, results in enumerate(all_results):
+                searches[position][0].query.set_search_results(results)
+                
+                if query_cache is not None:
+                    query_cache.set(cache_keys[position], results)
+        
+        for sqs in batch:
+            sqs._cache_query_results(0, sqs._load_per_query)
+    
+    return querysets
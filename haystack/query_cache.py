@@ -0,0 +1,159 @@
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+from time import time
+from haystack.utils import get_model_ct
+
+
+# Thirty days, the longest relative timeout memcached supports.
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+class BaseQueryCache(object):
+    """
+    Base class for caching what a backend returns for a query.
+    
+    Entries are keyed on the query string, all the arguments it was run with
+    and a generation counter for each model the query can return. Updating or
+    removing an object through its ``SearchIndex`` bumps the counter for that
+    model, which makes any cached entries for it unreachable.
+    
+    Subclasses need to provide ``get``, ``set``, ``get_generations`` &
+    ``invalidate``.
+    """
+    def __init__(self, connection_alias, timeout=300, **kwargs):
+        self.connection_alias = connection_alias
+        self.timeout = timeout
+    
+    def get(self, key):
+        """Returns the cached value for ``key`` or ``None`` if it's missing."""
+        raise NotImplementedError
+    
+    def set(self, key, value):
+        """Stores ``value`` under ``key`` for ``timeout`` seconds."""
+        raise NotImplementedError
+    
+    def get_generations(self, models):
+        """Returns the current generation for each of the ``models``."""
+        raise NotImplementedError
+    
+    def invalidate(self, model):
+        """Makes every cached entry that could contain ``model`` stale."""
+        raise NotImplementedError
+    
+    def generation_key(self, model):
+        return 'haystack:%s:generation:%s' % (self.connection_alias, get_model_ct(model))
+    
+    def make_key(self, action, query_string, kwargs, models):
+        """
+        Builds the key for running ``action`` (``search``, ``count``, etc.)
+        with the ``query_string`` & ``kwargs``, given the ``models`` that can
+        show up in the results.
+        """
+        models = sorted(models, key=get_model_ct)
+        generations = zip([get_model_ct(model) for model in models], self.get_generations(models))
+        bits = (action, query_string, normalize(kwargs), generations)
+        return 'haystack:%s:query:%s' % (self.connection_alias, md5(repr(bits)).hexdigest())
+    
+    def fetch(self, action, query_string, kwargs, models, default):
+        """
+        Returns the cached value for the query, falling back to calling
+        ``default`` (& caching what it returns) on a miss.
+        """
+        key = self.make_key(action, query_string, kwargs, models)
+        value = self.get(key)
+        
+        if value is None:
+            value = default()
+            self.set(key, value)
+        
+        return value
+
+
+class DjangoQueryCache(BaseQueryCache):
+    """
+    Caches results using Django's cache framework.
+    """
+    def __init__(self, connection_alias, timeout=300, cache=None, **kwargs):
+        super(DjangoQueryCache, self).__init__(connection_alias, timeout=timeout, **kwargs)
+        
+        if cache is None:
+            from django.core.cache import cache
+        
+        self.cache = cache
+    
+    def get(self, key):
+        return self.cache.get(key)
+    
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+    
+    def get_generations(self, models):
+        keys = [self.generation_key(model) for model in models]
+        found = self.cache.get_many(keys)
+        
+        for key in keys:
+            if found.get(key) is None:
+                found[key] = self.start_generation(key)
+        
+        return [found[key] for key in keys]
+    
+    def invalidate(self, model):
+        key = self.generation_key(model)
+        
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # Nothing's been cached for this model yet (or the counter was
+            # evicted).
+            self.start_generation(key)
+    
+    def start_generation(self, key):
+        # Start from the current time, so that a counter that was evicted
+        # can't come back to a value some stale entries were stored under.
+        generation = int(time() * 1000000)
+        
+        # Kept for as long as the cache allows, since entries are only as
+        # good as the counter they were stored under.
+        if not self.cache.add(key, generation, GENERATION_TIMEOUT):
+            generation = self.cache.get(key, generation)
+        
+        return generation
+
+
+def invalidate_query_caches(models):
+    """
+    Makes every cached entry that could contain any of the ``models`` stale,
+    on each connection that caches results.
+    """
+    from haystack import connections
+    
+    # Reads may be routed to a different connection than writes, so every
+    # connection caching results needs to know.
+    for alias in connections.connections_info:
+        query_cache = connections[alias].get_query_cache()
+        
+        if query_cache is not None:
+            for model in models:
+                query_cache.invalidate(model)
+
+
+def normalize(value):
+    """
+    Converts ``value`` into something with a stable ``repr``, for use in a
+    cache key.
+    """
+    if isinstance(value, dict):
+        return sorted([(key, normalize(item)) for key, item in value.items()])
+    
+    if isinstance(value, (set, frozenset)):
+        return sorted([normalize(item) for item in value])
+    
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    
+    if isinstance(value, type):
+        return '%s.%s' % (value.__module__, value.__name__)
+    
+    return value
@@ -1,10 +1,14 @@
 import re
+import threading
 from haystack.constants import ID, DJANGO_CT, DJANGO_ID
 from haystack.utils.highlighting import Highlighter
 
 
 IDENTIFIER_REGEX = re.compile('^[\w\d_]+\.[\w\d_]+\.\d+$')
 
+# The positions within the links of an ``LRUCache``.
+LRU_PREVIOUS, LRU_NEXT, LRU_KEY, LRU_VALUE = 0, 1, 2, 3
+
 
 def get_model_ct(model):
     return "%s.%s" % (model._meta.app_label, model._meta.module_name)
@@ -31,3 +35,91 @@ def get_facet_field_name(fieldname):
         return fieldname
     
     return "%s_exact" % fieldname
+
+
+class LRUCache(object):
+    """
+    A small, thread-safe, in-memory cache that holds onto at most ``size``
+    entries, dropping the least recently used one to make room.
+    
+    Recency is tracked with a circular doubly linked list of
+    ``[previous, next, key, value]`` links (oldest first after the root), so
+    lookups, updates & evictions all take constant time.
+    
+    A ``size`` of zero (or less) disables it.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._reset()
+    
+    def __len__(self):
+        return len(self._links)
+    
+    def _reset(self):
+        self._links = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+    
+    def _unlink(self, link):
+        link[LRU_PREVIOUS][LRU_NEXT] = link[LRU_NEXT]
+        link[LRU_NEXT][LRU_PREVIOUS] = link[LRU_PREVIOUS]
+    
+    def _append(self, link):
+        # The newest links go just before the root.
+        last = self._root[LRU_PREVIOUS]
+        link[LRU_PREVIOUS] = last
+        link[LRU_NEXT] = self._root
+        last[LRU_NEXT] = link
+        self._root[LRU_PREVIOUS] = link
+    
+    def get(self, key):
+        """Returns the cached value for ``key`` or ``None`` if it's missing."""
+        self._lock.acquire()
+        
+        try:
+            link = self._links.get(key)
+            
+            if link is None:
+                return None
+            
+            if link[LRU_NEXT] is not self._root:
+                self._unlink(link)
+                self._append(link)
+            
+            return link[LRU_VALUE]
+        finally:
+            self._lock.release()
+    
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        
+        self._lock.acquire()
+        
+        try:
+            link = self._links.get(key)
+            
+            if link is not None:
+                self._unlink(link)
+                link[LRU_VALUE] = value
+            else:
+                link = [None, None, key, value]
+                self._links[key] = link
+            
+            self._append(link)
+            
+            while len(self._links) > self.size:
+                oldest = self._root[LRU_NEXT]
+                self._unlink(oldest)
+                del(self._links[oldest[LRU_KEY]])
+        finally:
+            self._lock.release()
+    
+    def clear(self):
+        self._lock.acquire()
+        
+        try:
+            self._reset()
+        finally:
+            self._lock.release()
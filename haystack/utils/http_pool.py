@@ -0,0 +1,227 @@
+import httplib
+import os
+import socket
+import threading
+from time import time
+
+
+# The pools, by connection alias & host, shared by every backend for the
+# connection.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class HTTPConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive HTTP connections to one host.
+    
+    Up to ``size`` idle connections are kept for reuse. More connections than
+    that get opened when every idle one is in use, but they're closed once
+    they're done rather than kept. Connections left idle for more than
+    ``idle_timeout`` seconds are closed instead of reused, since the server
+    has likely dropped them. ``timeout`` is the socket timeout for each
+    request.
+    """
+    def __init__(self, host, port=None, scheme='http', size=10, timeout=10, idle_timeout=30):
+        self.host = host
+        self.port = port
+        self.scheme = scheme
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stats = {
+            'requests': 0,
+            'created': 0,
+            'reused': 0,
+            'retried': 0,
+            'discarded': 0,
+        }
+    
+    def __repr__(self):
+        return "<HTTPConnectionPool: %s://%s:%s>" % (self.scheme, self.host, self.port)
+    
+    def _count(self, stat):
+        self._lock.acquire()
+        
+        try:
+            self._stats[stat] += 1
+        finally:
+            self._lock.release()
+    
+    def new_connection(self):
+        if self.scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        
+        self._count('created')
+        return connection_class(self.host, self.port, timeout=self.timeout)
+    
+    def acquire(self):
+        """
+        Returns an idle connection (& ``True``) if there's one to reuse, or a
+        new connection (& ``False``).
+        """
+        stale = []
+        connection = None
+        self._lock.acquire()
+        
+        try:
+            if self._pid != os.getpid():
+                # Forked. The sockets belong to the parent.
+                self._idle = []
+                self._pid = os.getpid()
+            
+            while self._idle:
+                idle_connection, last_used = self._idle.pop()
+                
+                if time() - last_used > self.idle_timeout:
+                    stale.append(idle_connection)
+                    continue
+                
+                connection = idle_connection
+                self._stats['reused'] += 1
+                break
+        finally:
+            self._lock.release()
+        
+        for stale_connection in stale:
+            self.discard(stale_connection)
+        
+        if connection is not None:
+            return connection, True
+        
+        return self.new_connection(), False
+    
+    def release(self, connection):
+        """
+        Hands a connection that's done with a request back for reuse.
+        """
+        self._lock.acquire()
+        
+        try:
+            if len(self._idle) < self.size and self._pid == os.getpid():
+                self._idle.append((connection, time()))
+                return
+        finally:
+            self._lock.release()
+        
+        self.discard(connection)
+    
+    def discard(self, connection):
+        self._count('discarded')
+        connection.close()
+    
+    def request(self, method, path, body=None, headers=None):
+        """
+        Sends a request over a pooled connection. Returns the status, the
+        headers (as a dictionary, with lowercase names) & the body of the
+        response.
+        
+        If a reused connection turns out to have been closed by the server,
+        the request is sent once more on a new connection. Network errors
+        are raised as they are (``socket.error`` is an ``IOError``).
+        """
+        self._count('requests')
+        connection, reused = self.acquire()
+        
+        try:
+            response = self._send(connection, method, path, body, headers)
+        except (httplib.HTTPException, socket.error), e:
+            self.discard(connection)
+            
+            # A timeout would only happen again.
+            if not reused or isinstance(e, socket.timeout):
+                raise
+            
+            self._count('retried')
+            connection = self.new_connection()
+            
+            try:
+                response = self._send(connection, method, path, body, headers)
+            except (httplib.HTTPException, socket.error):
+                self.discard(connection)
+                raise
+        
+        status, response_headers, content, will_close = response
+        
+        if will_close:
+            self.discard(connection)
+        else:
+            self.release(connection)
+        
+        return status, response_headers, content
+    
+    def _send(self, connection, method, path, body, headers):
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        # The whole body needs reading before the connection can be reused.
+        content = response.read()
+        return response.status, dict(response.getheaders()), content, response.will_close
+    
+    def stats(self):
+        """
+        Returns how many requests were sent, how many connections were
+        created, reused (from the idle ones), retried (after a reused one
+        failed) & discarded, plus how many are idle.
+        """
+        self._lock.acquire()
+        
+        try:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        finally:
+            self._lock.release()
+        
+        return stats
+    
+    def clear(self):
+        """
+        Closes every idle connection.
+        """
+        self._lock.acquire()
+        
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        
+        for connection, last_used in idle:
+            self.discard(connection)
+
+
+def get_connection_pool(connection_alias, scheme, host, port=None, **kwargs):
+    """
+    Returns the ``HTTPConnectionPool`` for a connection alias & host, creating
+    it (with ``kwargs``) the first time.
+    """
+    key = (connection_alias, scheme, host, port)
+    _pools_lock.acquire()
+    
+    try:
+        if key not in _pools:
+            _pools[key] = HTTPConnectionPool(host, port=port, scheme=scheme, **kwargs)
+        
+        return _pools[key]
+    finally:
+        _pools_lock.release()
+
+
+def get_connection_pools():
+    """
+    Returns every pool that's been created, by connection alias.
+    """
+    _pools_lock.acquire()
+    
+    try:
+        pools = {}
+        
+        for (connection_alias, scheme, host, port), pool in _pools.items():
+            pools.setdefault(connection_alias, []).append(pool)
+        
+        return pools
+    finally:
+        _pools_lock.release()
@@ -137,6 +137,11 @@ class UnifiedIndex(object):
         self.document_field = getattr(settings, 'HAYSTACK_DOCUMENT_FIELD', 'text')
         self._fieldnames = {}
         self._facet_fieldnames = {}
+        self._models_list = None
+        # Backends keep what they derive from the indexed models here (such
+        # as a prebuilt filter for them), so it's only worked out once per
+        # build.
+        self.models_filter_cache = {}
     
     def collect_indexes(self):
         indexes = []
@@ -165,6 +170,12 @@ class UnifiedIndex(object):
         self._built = False
         self._fieldnames = {}
         self._facet_fieldnames = {}
+        self._models_list = None
+        self.models_filter_cache = {}
+        
+        # Compiled queries may use field names that are about to change.
+        from haystack.backends import QUERY_STRING_CACHE
+        QUERY_STRING_CACHE.clear()
     
     def build(self, indexes=None):
         self.reset()
@@ -261,6 +272,16 @@ class UnifiedIndex(object):
         
         return self.indexes.keys()
     
+    def get_models_list(self):
+        """
+        Returns the ``app_label.module_name`` of each indexed model, sorted so
+        that the filters built from them are always the same.
+        """
+        if self._models_list is None:
+            self._models_list = sorted([u"%s.%s" % (model._meta.app_label, model._meta.module_name) for model in self.get_indexed_models()])
+        
+        return self._models_list
+    
     def get_index_fieldname(self, field):
         if not self._built:
             self.build()
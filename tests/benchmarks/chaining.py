@@ -0,0 +1,69 @@
+"""
+Times building a ``SearchQuerySet`` through chains of increasing length.
+
+Every chained call clones the ``SearchQuerySet`` & its query, so this
+measures how much each clone costs. No search is ever run. The time per call
+should stay roughly flat as the chains get longer. Run it from within the
+``tests`` directory::
+
+    cd django-haystack/tests
+    export PYTHONPATH=`pwd`
+    python benchmarks/chaining.py
+"""
+import datetime
+import os
+import sys
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+from haystack.query import SearchQuerySet, SQ
+
+
+LENGTHS = [5, 10, 20, 40]
+REPEAT = 500
+
+
+def build(length):
+    """Builds a query through ``length`` chained calls, like a busy view."""
+    sqs = SearchQuerySet()
+    
+    for i in xrange(length):
+        step = i % 5
+        
+        if step == 0:
+            sqs = sqs.filter(content='hello %d' % i)
+        elif step == 1:
+            sqs = sqs.filter(SQ(author='daniel%d' % i) | SQ(pub_date__lte=datetime.date(2011, 1, i % 28 + 1)))
+        elif step == 2:
+            sqs = sqs.exclude(title__startswith='draft')
+        elif step == 3:
+            sqs = sqs.order_by('-pub_date')
+        else:
+            sqs = sqs.narrow('site:%d' % i)
+    
+    return sqs
+
+
+def time_chaining(length, repeat):
+    start = time.time()
+    
+    for i in xrange(repeat):
+        build(length)
+    
+    return time.time() - start
+
+
+def main(lengths, repeat=REPEAT):
+    print "%10s %12s %16s" % ('calls', 'seconds', 'usec/call')
+    
+    for length in lengths:
+        elapsed = time_chaining(length, repeat)
+        print "%10d %12.3f %16.2f" % (length, elapsed, elapsed / (length * repeat) * 1000000)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main([int(length) for length in sys.argv[1:]])
+    else:
+        main(LENGTHS)
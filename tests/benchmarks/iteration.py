@@ -0,0 +1,68 @@
+"""
+Times a full iteration over a ``SearchQuerySet`` of increasing sizes.
+
+The results come from a synthetic backend, so this measures only Haystack's
+own overhead (caching & bookkeeping), which should grow linearly with the
+number of results. Run it from within the ``tests`` directory::
+
+    cd django-haystack/tests
+    export PYTHONPATH=`pwd`
+    python benchmarks/iteration.py
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+from haystack.backends import BaseSearchBackend
+from haystack.models import SearchResult
+from haystack.query import SearchQuerySet
+
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+
+class SyntheticSearchBackend(BaseSearchBackend):
+    """Hands back ``hits`` results, without ever looking at the query."""
+    def __init__(self, connection_alias, hits, **connection_options):
+        super(SyntheticSearchBackend, self).__init__(connection_alias, **connection_options)
+        self.hits = hits
+    
+    def search(self, query_string, start_offset=0, end_offset=None, result_class=None, **kwargs):
+        if end_offset is None or end_offset > self.hits:
+            end_offset = self.hits
+        
+        return {
+            'results': [SearchResult('core', 'mockmodel', pk, 1.0) for pk in xrange(start_offset, end_offset)],
+            'hits': self.hits,
+        }
+
+
+def time_iteration(hits):
+    sqs = SearchQuerySet()
+    sqs.query.backend = SyntheticSearchBackend('default', hits)
+    start = time.time()
+    seen = 0
+    
+    for result in sqs:
+        seen += 1
+    
+    elapsed = time.time() - start
+    assert seen == hits, "Saw %d of %d results." % (seen, hits)
+    return elapsed
+
+
+def main(sizes):
+    print "%10s %12s %16s" % ('results', 'seconds', 'usec/result')
+    
+    for size in sizes:
+        elapsed = time_iteration(size)
+        print "%10d %12.3f %16.2f" % (size, elapsed, elapsed / size * 1000000)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main([int(size) for size in sys.argv[1:]])
+    else:
+        main(SIZES)
@@ -6,10 +6,14 @@ from django.conf import settings
 from core.tests.backends import *
 from core.tests.fields import *
 from core.tests.forms import *
+from core.tests.http_pool import *
 from core.tests.indexes import *
+from core.tests.instrumentation import *
 from core.tests.loading import *
+from core.tests.metrics import *
 from core.tests.models import *
 from core.tests.query import *
+from core.tests.query_cache import *
 from core.tests.templatetags import *
 from core.tests.views import *
 from core.tests.utils import *
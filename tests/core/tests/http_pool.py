@@ -0,0 +1,213 @@
+import BaseHTTPServer
+import SocketServer
+import threading
+from django.test import TestCase
+from haystack.utils import http_pool
+from haystack.utils.http_pool import HTTPConnectionPool, get_connection_pool, get_connection_pools
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path, self.client_address[1]))
+        status, body = self.server.responses.get(self.path.split('?')[0], (200, '{}'))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        
+        if self.server.truncate_responses:
+            # Promise more than gets sent, then hang up.
+            self.send_header('Content-Length', str(len(body) + 100))
+            self.close_connection = 1
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        
+        if self.server.close_connections:
+            self.send_header('Connection', 'close')
+        
+        self.end_headers()
+        self.wfile.write(body)
+        
+        if self.server.close_connections or self.server.drop_connections:
+            self.close_connection = 1
+    
+    def do_POST(self):
+        self.server.bodies.append(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        self.do_GET()
+    
+    def log_message(self, *args):
+        pass
+
+
+class StubHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A local HTTP server (answering on threads of its own) to send requests
+    to. Every request is recorded with the port it came from, so reused
+    connections can be spotted.
+    """
+    daemon_threads = True
+    
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.host, self.port = self.server_address
+        self.requests = []
+        self.bodies = []
+        self.responses = {}
+        # Say so when closing connections after responding.
+        self.close_connections = False
+        # Close connections after responding, without saying so.
+        self.drop_connections = False
+        # Close connections part way through the response body.
+        self.truncate_responses = False
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.setDaemon(True)
+        self.thread.start()
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+    
+    def client_ports(self):
+        return set([port for command, path, port in self.requests])
+
+
+class HTTPConnectionPoolTestCase(TestCase):
+    def setUp(self):
+        super(HTTPConnectionPoolTestCase, self).setUp()
+        self.server = StubHTTPServer()
+        self.pool = HTTPConnectionPool(self.server.host, self.server.port, size=2, timeout=5)
+    
+    def tearDown(self):
+        self.pool.clear()
+        self.server.stop()
+        super(HTTPConnectionPoolTestCase, self).tearDown()
+    
+    def test_request(self):
+        self.server.responses['/missing'] = (404, 'Not here.')
+        status, headers, content = self.pool.request('GET', '/select?q=*:*')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/json')
+        self.assertEqual(content, '{}')
+        self.assertEqual(self.server.requests[0][:2], ('GET', '/select?q=*:*'))
+        self.assertEqual(self.pool.request('POST', '/update', body='<commit/>', headers={'Content-type': 'text/xml'})[0], 200)
+        self.assertEqual(self.server.bodies, ['<commit/>'])
+        status, headers, content = self.pool.request('GET', '/missing')
+        self.assertEqual(status, 404)
+        self.assertEqual(content, 'Not here.')
+    
+    def test_reuse(self):
+        for i in xrange(3):
+            self.assertEqual(self.pool.request('GET', '/')[0], 200)
+        
+        self.assertEqual(len(self.server.client_ports()), 1)
+        self.assertEqual(self.pool.stats(), {
+            'requests': 3,
+            'created': 1,
+            'reused': 2,
+            'retried': 0,
+            'discarded': 0,
+            'idle': 1,
+        })
+    
+    def test_size(self):
+        connections = [self.pool.acquire()[0] for i in xrange(3)]
+        
+        for connection in connections:
+            self.pool.release(connection)
+        
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 3)
+        self.assertEqual(stats['idle'], 2)
+        self.assertEqual(stats['discarded'], 1)
+    
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = -1
+        
+        for i in xrange(2):
+            self.assertEqual(self.pool.request('GET', '/')[0], 200)
+        
+        self.assertEqual(len(self.server.client_ports()), 2)
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['reused'], 0)
+        self.assertEqual(stats['discarded'], 1)
+    
+    def test_connection_close(self):
+        self.server.close_connections = True
+        
+        for i in xrange(2):
+            self.assertEqual(self.pool.request('GET', '/')[0], 200)
+        
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['discarded'], 2)
+        self.assertEqual(stats['idle'], 0)
+    
+    def test_retry(self):
+        self.server.drop_connections = True
+        
+        for i in xrange(3):
+            self.assertEqual(self.pool.request('GET', '/')[0], 200)
+        
+        self.assertEqual(len(self.server.requests), 3)
+        stats = self.pool.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['created'], 3)
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['retried'], 2)
+    
+    def test_forked(self):
+        self.assertEqual(self.pool.request('GET', '/')[0], 200)
+        self.pool._pid = -1
+        self.assertEqual(self.pool.acquire()[1], False)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+    
+    def test_threads(self):
+        errors = []
+        
+        def search():
+            try:
+                for i in xrange(5):
+                    self.assertEqual(self.pool.request('GET', '/')[0], 200)
+            except Exception, e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=search) for i in xrange(8)]
+        
+        for thread in threads:
+            thread.start()
+        
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        stats = self.pool.stats()
+        self.assertEqual(stats['requests'], 40)
+        self.assertEqual(stats['created'] + stats['reused'], 40)
+        self.assertTrue(stats['reused'] > 0)
+        self.assertTrue(stats['idle'] <= 2)
+
+
+class GetConnectionPoolTestCase(TestCase):
+    def setUp(self):
+        super(GetConnectionPoolTestCase, self).setUp()
+        
+        # Stow.
+        self.old_pools = http_pool._pools
+        http_pool._pools = {}
+    
+    def tearDown(self):
+        # Restore.
+        http_pool._pools = self.old_pools
+        super(GetConnectionPoolTestCase, self).tearDown()
+    
+    def test_get_connection_pool(self):
+        pool = get_connection_pool('default', 'http', 'localhost', 8983, size=5)
+        self.assertEqual(pool.size, 5)
+        self.assertEqual(pool.port, 8983)
+        self.assertTrue(get_connection_pool('default', 'http', 'localhost', 8983) is pool)
+        
+        other = get_connection_pool('other', 'http', 'localhost', 8983)
+        self.assertFalse(other is pool)
+        self.assertEqual(other.size, 10)
+        self.assertEqual(get_connection_pools(), {'default': [pool], 'other': [other]})
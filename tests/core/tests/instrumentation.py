@@ -0,0 +1,383 @@
+import logging
+import os
+import shutil
+import tempfile
+from django.conf import settings
+from django.test import TestCase
+from django.utils import simplejson as json
+from haystack import connections, instrumentation, reset_search_queries
+from haystack.instrumentation import QueryRecord, BaseSink, MemorySink, LoggingSink, SlowQuerySink
+from haystack.query import SearchQuerySet
+from haystack.utils.loading import UnifiedIndex
+from core.models import MockModel
+from core.tests.views import BasicMockModelSearchIndex
+
+
+class BrokenSink(BaseSink):
+    def emit(self, record):
+        raise ValueError("Oops.")
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+    
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class Traced(object):
+    connection_alias = 'default'
+    
+    @instrumentation.traced
+    def outer(self, fail=False):
+        self.inner()
+        
+        if fail:
+            raise ValueError("Boom.")
+        
+        return 'done'
+    
+    @instrumentation.traced
+    @instrumentation.timed('backend')
+    def inner(self):
+        self.decode()
+    
+    @instrumentation.timed('decode')
+    def decode(self):
+        pass
+
+
+class QueryRecordTestCase(TestCase):
+    def test_phases(self):
+        record = QueryRecord('default', 'search')
+        record.enter_phase()
+        record.enter_phase()
+        record.exit_phase('decode', 0.25)
+        record.exit_phase('backend', 1.0)
+        self.assertEqual(record.phases, {'backend': 0.75, 'decode': 0.25})
+        
+        record.enter_phase()
+        record.exit_phase('backend', 0.5)
+        self.assertEqual(record.phases['backend'], 1.25)
+    
+    def test_backend_calls(self):
+        record = QueryRecord('default', 'run')
+        record.add_backend_call('other', 'search', u'foo', {'start_offset': 0})
+        record.add_backend_call('other', 'count', u'bar', {})
+        record.add_hits({'results': [], 'hits': 3})
+        record.add_hits(5)
+        self.assertEqual(record.connection_alias, 'other')
+        self.assertEqual(record.action, 'search')
+        self.assertEqual(record.query_string, u'foo')
+        self.assertEqual(record.kwargs, {'start_offset': 0})
+        self.assertEqual(record.backend_calls, 2)
+        self.assertEqual(record.hits, 3)
+        self.assertEqual(record.as_dict()['hits'], 3)
+
+
+class SinkTestCase(TestCase):
+    def test_memory_sink(self):
+        sink = MemorySink(size=2)
+        
+        for action in ('search', 'count', 'facet_counts'):
+            sink.emit(QueryRecord('default', action))
+        
+        self.assertEqual([record.action for record in sink.records], ['count', 'facet_counts'])
+        sink.clear()
+        self.assertEqual(sink.records, [])
+    
+    def test_logging_sink(self):
+        handler = RecordingHandler()
+        logger = logging.getLogger('haystack.instrumentation')
+        old_level = logger.level
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        
+        try:
+            record = QueryRecord('default', 'search')
+            record.query_string = u'foo'
+            record.phases = {'backend': 0.5, 'build': 0.25}
+            record.hits = 3
+            record.duration = 1.0
+            LoggingSink().emit(record)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(old_level)
+        
+        self.assertEqual(handler.messages, [u"search on 'default' took 1.000s (build=0.250s backend=0.500s), 3 hit(s): foo"])
+
+
+class InstrumentationTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+    
+    def setUp(self):
+        super(InstrumentationTestCase, self).setUp()
+        
+        # Stow.
+        self.old_unified_index = connections['default']._index
+        self.old_sinks = instrumentation._sinks
+        self.ui = UnifiedIndex()
+        self.bmmsi = BasicMockModelSearchIndex()
+        self.ui.build(indexes=[self.bmmsi])
+        connections['default']._index = self.ui
+        
+        backend = connections['default'].get_backend()
+        backend.clear()
+        backend.update(self.bmmsi, MockModel.objects.all())
+        
+        self.sink = MemorySink()
+        instrumentation._sinks = [self.sink]
+    
+    def tearDown(self):
+        # Restore.
+        connections['default']._index = self.old_unified_index
+        instrumentation._sinks = self.old_sinks
+        super(InstrumentationTestCase, self).tearDown()
+    
+    def test_disabled(self):
+        instrumentation._sinks = []
+        self.assertEqual(instrumentation.start('default', 'search'), None)
+        self.assertEqual(len(SearchQuerySet()[:5]), 5)
+        self.assertEqual(instrumentation.current(), None)
+        self.assertEqual(self.sink.records, [])
+    
+    def test_get_sinks(self):
+        old_setting = getattr(settings, 'HAYSTACK_INSTRUMENTATION_SINKS', None)
+        settings.HAYSTACK_INSTRUMENTATION_SINKS = ['haystack.instrumentation.MemorySink']
+        instrumentation._sinks = None
+        
+        try:
+            sinks = instrumentation.get_sinks()
+            self.assertEqual(len(sinks), 1)
+            self.assertTrue(isinstance(sinks[0], MemorySink))
+            self.assertTrue(instrumentation.get_sinks() is sinks)
+        finally:
+            if old_setting is None:
+                del settings.HAYSTACK_INSTRUMENTATION_SINKS
+            else:
+                settings.HAYSTACK_INSTRUMENTATION_SINKS = old_setting
+        
+        other = MemorySink()
+        instrumentation.add_sink(other)
+        self.assertEqual(instrumentation.get_sinks(), [sinks[0], other])
+        instrumentation.remove_sink(sinks[0])
+        self.assertEqual(instrumentation.get_sinks(), [other])
+    
+    def test_search(self):
+        results = SearchQuerySet().load_all()[:5]
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(self.sink.records), 1)
+        
+        record = self.sink.records[0]
+        self.assertEqual(record.connection_alias, 'default')
+        self.assertEqual(record.action, 'search')
+        self.assertEqual(record.kwargs['start_offset'], 0)
+        self.assertEqual(record.kwargs['end_offset'], 5)
+        self.assertEqual(record.hits, 23)
+        self.assertEqual(record.backend_calls, 1)
+        self.assertEqual(record.error, None)
+        self.assertEqual(sorted(record.phases.keys()), ['backend', 'build', 'hydrate', 'load_all'])
+        self.assertTrue(record.duration >= sum(record.phases.values()))
+        self.assertEqual(instrumentation.current(), None)
+    
+    def test_count(self):
+        self.assertEqual(SearchQuerySet().count(), 23)
+        self.assertEqual(len(self.sink.records), 1)
+        self.assertEqual(self.sink.records[0].hits, 23)
+        self.assertTrue('backend' in self.sink.records[0].phases)
+    
+    def test_nothing_to_run(self):
+        self.assertEqual(SearchQuerySet().filter(foo__in=[]).count(), 0)
+        self.assertEqual(len(self.sink.records), 1)
+        self.assertEqual(self.sink.records[0].action, 'run_count')
+        self.assertEqual(self.sink.records[0].backend_calls, 0)
+    
+    def test_traced(self):
+        traced = Traced()
+        self.assertEqual(traced.outer(), 'done')
+        self.assertEqual(len(self.sink.records), 1)
+        
+        record = self.sink.records[0]
+        self.assertEqual(record.connection_alias, 'default')
+        self.assertEqual(record.action, 'outer')
+        self.assertEqual(sorted(record.phases.keys()), ['backend', 'decode'])
+        
+        self.assertRaises(ValueError, traced.outer, fail=True)
+        self.assertEqual(len(self.sink.records), 2)
+        self.assertTrue(isinstance(self.sink.records[1].error, ValueError))
+        self.assertEqual(instrumentation.current(), None)
+    
+    def test_broken_sink(self):
+        handler = RecordingHandler()
+        logger = logging.getLogger('haystack')
+        old_handlers = logger.handlers
+        logger.handlers = [handler]
+        instrumentation.add_sink(BrokenSink())
+        
+        try:
+            self.assertEqual(SearchQuerySet().count(), 23)
+        finally:
+            logger.handlers = old_handlers
+        
+        self.assertEqual(len(self.sink.records), 1)
+        self.assertEqual(len(handler.messages), 1)
+        self.assertTrue(handler.messages[0].startswith('Instrumentation sink'))
+
+
+class SlowQuerySinkTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+    
+    def setUp(self):
+        super(SlowQuerySinkTestCase, self).setUp()
+        
+        # Stow.
+        self.old_unified_index = connections['default']._index
+        self.old_sinks = instrumentation._sinks
+        self.ui = UnifiedIndex()
+        self.bmmsi = BasicMockModelSearchIndex()
+        self.ui.build(indexes=[self.bmmsi])
+        connections['default']._index = self.ui
+        
+        backend = connections['default'].get_backend()
+        backend.clear()
+        backend.update(self.bmmsi, MockModel.objects.all())
+        
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('haystack.slow_queries')
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+        
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'slow.log')
+        self.sink = SlowQuerySink('default', 0, path=self.path)
+        instrumentation._sinks = [self.sink]
+    
+    def tearDown(self):
+        # Restore.
+        connections['default']._index = self.old_unified_index
+        instrumentation._sinks = self.old_sinks
+        self.logger.removeHandler(self.handler)
+        self.logger.propagate = True
+        shutil.rmtree(self.temp_dir)
+        super(SlowQuerySinkTestCase, self).tearDown()
+    
+    def read_log(self, path=None):
+        return [json.loads(line) for line in open(path or self.path)]
+    
+    def test_search(self):
+        sqs = SearchQuerySet().narrow('name:daniel1').order_by('-pub_date').facet('name')
+        self.assertEqual(len(sqs[2:5]), 3)
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertTrue(self.handler.messages[0].startswith("Slow search on 'default' took "))
+        
+        entries = self.read_log()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['connection_alias'], 'default')
+        self.assertEqual(entries[0]['action'], 'search')
+        self.assertEqual(entries[0]['query_string'], sqs.query.build_query())
+        self.assertEqual(entries[0]['narrow_queries'], ['name:daniel1'])
+        self.assertEqual(entries[0]['sort_by'], ['-pub_date'])
+        self.assertEqual(entries[0]['start_offset'], 2)
+        self.assertEqual(entries[0]['end_offset'], 5)
+        self.assertEqual(entries[0]['facets'], ['name'])
+        self.assertEqual(entries[0]['hits'], 23)
+        self.assertEqual(entries[0]['error'], None)
+        self.assertTrue('backend' in entries[0]['phases'])
+        self.assertTrue('hydrate' in entries[0]['phases'])
+    
+    def test_more_like_this(self):
+        self.assertEqual(len(SearchQuerySet().more_like_this(MockModel.objects.get(pk=1))[:5]), 5)
+        
+        entries = self.read_log()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['action'], 'more_like_this')
+        self.assertEqual(entries[0]['model_instance'], 'core.mockmodel.1')
+    
+    def test_not_logged(self):
+        # Under the threshold.
+        self.sink.threshold = 60
+        self.assertEqual(len(SearchQuerySet()[:5]), 5)
+        
+        # Not a search.
+        self.sink.threshold = 0
+        record = QueryRecord('default', 'facet_counts')
+        record.duration = 1.0
+        self.sink.emit(record)
+        
+        # Another connection.
+        self.sink.connection_alias = 'other'
+        self.assertEqual(len(SearchQuerySet()[:5]), 5)
+        
+        self.assertEqual(self.handler.messages, [])
+        self.assertFalse(os.path.exists(self.path))
+    
+    def test_sampled(self):
+        self.sink.sample_rate = 0
+        self.assertEqual(len(SearchQuerySet()[:5]), 5)
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertFalse(os.path.exists(self.path))
+    
+    def test_bounded(self):
+        for i in xrange(3):
+            self.assertEqual(len(SearchQuerySet()[:5]), 5)
+        
+        self.sink.max_bytes = os.path.getsize(self.path) + 10
+        
+        for i in xrange(2):
+            self.assertEqual(len(SearchQuerySet()[:5]), 5)
+        
+        self.assertEqual(len(self.read_log('%s.1' % self.path)), 3)
+        self.assertEqual(len(self.read_log()), 2)
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['slow.log', 'slow.log.1'])
+    
+    def test_get_slow_query_sinks(self):
+        old_connections = settings.HAYSTACK_CONNECTIONS
+        settings.HAYSTACK_CONNECTIONS = {
+            'default': {
+                'ENGINE': 'core.tests.mocks.MockEngine',
+                'SLOW_QUERY_THRESHOLD': 0.5,
+                'SLOW_QUERY_LOG': self.path,
+                'SLOW_QUERY_SAMPLE_RATE': 0.1,
+            },
+            'other': {
+                'ENGINE': 'core.tests.mocks.MockEngine',
+            },
+        }
+        
+        try:
+            sinks = instrumentation.get_slow_query_sinks()
+        finally:
+            settings.HAYSTACK_CONNECTIONS = old_connections
+        
+        self.assertEqual(len(sinks), 1)
+        self.assertEqual(sinks[0].connection_alias, 'default')
+        self.assertEqual(sinks[0].threshold, 0.5)
+        self.assertEqual(sinks[0].path, self.path)
+        self.assertEqual(sinks[0].max_bytes, 10 * 1024 * 1024)
+        self.assertEqual(sinks[0].sample_rate, 0.1)
+
+
+class QueryLogTestCase(TestCase):
+    def setUp(self):
+        super(QueryLogTestCase, self).setUp()
+        
+        # Stow.
+        self.old_debug = settings.DEBUG
+        settings.DEBUG = True
+        reset_search_queries()
+    
+    def tearDown(self):
+        # Restore.
+        settings.DEBUG = self.old_debug
+        reset_search_queries()
+        super(QueryLogTestCase, self).tearDown()
+    
+    def test_bounded(self):
+        queries = connections['default'].queries
+        
+        for i in xrange(queries.maxlen + 5):
+            connections['default'].get_backend().search(u'*')
+        
+        self.assertEqual(len(queries), queries.maxlen)
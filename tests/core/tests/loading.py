@@ -213,6 +213,19 @@ class UnifiedIndexTestCase(TestCase):
         self.assertEqual(len(indexed_models), 1)
         self.assertTrue(MockModel in indexed_models)
     
+    def test_get_models_list(self):
+        self.assertEqual(self.ui.get_models_list(), [])
+        
+        self.ui.build(indexes=[BasicMockModelSearchIndex(), AlternateValidSearchIndex()])
+        models_list = self.ui.get_models_list()
+        self.assertEqual(models_list, [u'core.anothermockmodel', u'core.mockmodel'])
+        self.assertTrue(self.ui.get_models_list() is models_list)
+        
+        self.ui.models_filter_cache['solr'] = u'django_ct:(core.anothermockmodel OR core.mockmodel)'
+        self.ui.build(indexes=[BasicMockModelSearchIndex()])
+        self.assertEqual(self.ui.get_models_list(), [u'core.mockmodel'])
+        self.assertEqual(self.ui.models_filter_cache, {})
+    
     def test_all_searchfields(self):
         self.ui.build(indexes=[BasicMockModelSearchIndex()])
         fields = self.ui.all_searchfields()
@@ -0,0 +1,241 @@
+import logging
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from haystack import connections, metrics
+from haystack.metrics import Histogram, MetricsRegistry, add_payload_bytes
+from haystack.utils import http_pool
+from haystack.utils.loading import UnifiedIndex
+from core.models import MockModel
+from core.tests.mocks import MockSearchBackend
+from core.tests.views import BasicMockModelSearchIndex
+
+
+class SuperMockSearchBackend(MockSearchBackend):
+    def search(self, query_string, **kwargs):
+        add_payload_bytes(10)
+        return super(SuperMockSearchBackend, self).search(query_string, **kwargs)
+
+
+class BrokenMockSearchBackend(MockSearchBackend):
+    def clear(self, models=[], commit=True):
+        raise IOError("The index is gone.")
+    
+    def count(self, query_string, **kwargs):
+        raise IOError("The index is gone.")
+
+
+class HistogramTestCase(TestCase):
+    def test_observe(self):
+        histogram = Histogram(bounds=(1, 2, 4))
+        
+        for value in (0.5, 1, 1.5, 3, 3, 10):
+            histogram.observe(value)
+        
+        self.assertEqual(histogram.counts, [2, 1, 2, 1])
+        self.assertEqual(histogram.count, 6)
+        self.assertEqual(histogram.sum, 19.0)
+        self.assertEqual(histogram.cumulative_counts(), [(1, 2), (2, 3), (4, 5), (None, 6)])
+    
+    def test_quantile(self):
+        histogram = Histogram(bounds=(1, 2, 4))
+        self.assertEqual(histogram.quantile(0.5), None)
+        
+        for value in (0.5, 0.5, 1.5, 3):
+            histogram.observe(value)
+        
+        self.assertEqual(histogram.quantile(0.5), 1.0)
+        self.assertEqual(histogram.quantile(0.75), 2.0)
+        self.assertEqual(histogram.quantile(1), 4.0)
+        
+        histogram.observe(100)
+        self.assertEqual(histogram.quantile(1), 4)
+
+
+class MetricsRegistryTestCase(TestCase):
+    def setUp(self):
+        super(MetricsRegistryTestCase, self).setUp()
+        self.registry = MetricsRegistry()
+        self.temp_dir = tempfile.mkdtemp()
+        
+        # Stow.
+        self.old_pools = http_pool._pools
+        http_pool._pools = {}
+    
+    def tearDown(self):
+        # Restore.
+        http_pool._pools = self.old_pools
+        shutil.rmtree(self.temp_dir)
+        super(MetricsRegistryTestCase, self).tearDown()
+    
+    def test_observe(self):
+        self.registry.observe('default', 'search', 0.02, documents=10, payload_bytes=512)
+        self.registry.observe('default', 'search', 0.2, documents=5, error=True)
+        self.registry.observe('other', 'update', 1.5, documents=100)
+        
+        summary = self.registry.summary()
+        self.assertEqual(sorted(summary.keys()), ['default', 'other'])
+        self.assertEqual(summary['default']['search']['count'], 2)
+        self.assertEqual(summary['default']['search']['errors'], 1)
+        self.assertEqual(summary['default']['search']['documents'], 15)
+        self.assertEqual(summary['default']['search']['payload_bytes'], 512)
+        self.assertEqual(summary['other']['update']['documents'], 100)
+        self.assertTrue(0.01 < summary['default']['search']['p50'] <= 0.025)
+        self.assertTrue(0.1 < summary['default']['search']['p99'] <= 0.25)
+        
+        self.assertEqual(self.registry.quantile('default', 'search', 0.5), summary['default']['search']['p50'])
+        self.assertEqual(self.registry.quantile('default', 'clear', 0.5), None)
+        
+        self.registry.reset()
+        self.assertEqual(self.registry.summary(), {})
+    
+    def test_to_prometheus(self):
+        self.assertEqual(self.registry.to_prometheus().count('# TYPE'), 4)
+        
+        self.registry.observe('default', 'search', 0.02, documents=10, payload_bytes=512)
+        self.registry.observe('we"ird', 'search', 20)
+        lines = self.registry.to_prometheus().splitlines()
+        
+        self.assertTrue('# TYPE haystack_backend_duration_seconds histogram' in lines)
+        self.assertTrue('haystack_backend_duration_seconds_bucket{connection="default",action="search",le="0.01"} 0' in lines)
+        self.assertTrue('haystack_backend_duration_seconds_bucket{connection="default",action="search",le="0.025"} 1' in lines)
+        self.assertTrue('haystack_backend_duration_seconds_bucket{connection="default",action="search",le="+Inf"} 1' in lines)
+        self.assertTrue('haystack_backend_duration_seconds_sum{connection="default",action="search"} 0.02' in lines)
+        self.assertTrue('haystack_backend_duration_seconds_count{connection="default",action="search"} 1' in lines)
+        self.assertTrue('haystack_backend_duration_seconds_bucket{connection="we\\"ird",action="search",le="10.0"} 0' in lines)
+        self.assertTrue('# TYPE haystack_backend_errors_total counter' in lines)
+        self.assertTrue('haystack_backend_errors_total{connection="default",action="search"} 0' in lines)
+        self.assertTrue('haystack_backend_documents_total{connection="default",action="search"} 10' in lines)
+        self.assertTrue('haystack_backend_payload_bytes_total{connection="default",action="search"} 512' in lines)
+    
+    def test_http_pools(self):
+        pool = http_pool.get_connection_pool('default', 'http', 'localhost', 8983)
+        pool._stats['requests'] = 3
+        pool._stats['created'] = 1
+        pool._stats['reused'] = 2
+        lines = self.registry.to_prometheus().splitlines()
+        
+        self.assertTrue('# TYPE haystack_http_pool_reused_total counter' in lines)
+        self.assertTrue('haystack_http_pool_requests_total{connection="default",host="localhost:8983"} 3' in lines)
+        self.assertTrue('haystack_http_pool_created_total{connection="default",host="localhost:8983"} 1' in lines)
+        self.assertTrue('haystack_http_pool_reused_total{connection="default",host="localhost:8983"} 2' in lines)
+        self.assertTrue('haystack_http_pool_idle_connections{connection="default",host="localhost:8983"} 0' in lines)
+    
+    def test_write_prometheus(self):
+        path = os.path.join(self.temp_dir, 'haystack.prom')
+        self.registry.observe('default', 'search', 0.02)
+        self.registry.write_prometheus(path)
+        self.assertEqual(open(path).read(), self.registry.to_prometheus())
+        self.assertEqual(os.listdir(self.temp_dir), ['haystack.prom'])
+    
+    def test_export_path(self):
+        path = os.path.join(self.temp_dir, 'haystack.prom')
+        registry = MetricsRegistry(export_path=path, export_interval=60)
+        registry.observe('default', 'search', 0.02)
+        self.assertTrue('haystack_backend_duration_seconds_count{connection="default",action="search"} 1' in open(path).read())
+        
+        # Not again until the interval's up.
+        registry.observe('default', 'search', 0.02)
+        self.assertTrue('haystack_backend_duration_seconds_count{connection="default",action="search"} 1' in open(path).read())
+        
+        # A file that can't be written doesn't stop anything.
+        logger = logging.getLogger('haystack')
+        old_handlers = logger.handlers
+        logger.handlers = [logging.StreamHandler(open(os.devnull, 'w'))]
+        
+        try:
+            registry = MetricsRegistry(export_path=os.path.join(self.temp_dir, 'missing', 'haystack.prom'))
+            registry.observe('default', 'search', 0.02)
+        finally:
+            logger.handlers = old_handlers
+        
+        self.assertEqual(registry.summary()['default']['search']['count'], 1)
+
+
+class MeteredBackendTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+    
+    def setUp(self):
+        super(MeteredBackendTestCase, self).setUp()
+        
+        # Stow.
+        self.old_unified_index = connections['default']._index
+        self.old_registry = metrics.registry
+        self.ui = UnifiedIndex()
+        self.bmmsi = BasicMockModelSearchIndex()
+        self.ui.build(indexes=[self.bmmsi])
+        connections['default']._index = self.ui
+        
+        metrics.registry = MetricsRegistry()
+        self.backend = connections['default'].get_backend()
+    
+    def tearDown(self):
+        # Restore.
+        connections['default']._index = self.old_unified_index
+        metrics.registry = self.old_registry
+        super(MeteredBackendTestCase, self).tearDown()
+    
+    def test_operations(self):
+        self.backend.clear()
+        self.backend.update(self.bmmsi, MockModel.objects.all())
+        self.backend.update(self.bmmsi, (obj for obj in MockModel.objects.all()[:3]))
+        self.backend.remove(MockModel.objects.get(pk=1))
+        self.assertEqual(len(self.backend.search(u'*', end_offset=5)['results']), 5)
+        
+        summary = metrics.registry.summary()['default']
+        self.assertEqual(sorted(summary.keys()), ['clear', 'remove', 'search', 'update'])
+        self.assertEqual(summary['clear']['count'], 1)
+        self.assertEqual(summary['update']['count'], 2)
+        self.assertEqual(summary['update']['documents'], 26)
+        self.assertEqual(summary['remove']['documents'], 1)
+        self.assertEqual(summary['search']['count'], 1)
+        self.assertEqual(summary['search']['documents'], 5)
+        self.assertEqual(summary['search']['errors'], 0)
+        self.assertTrue(summary['search']['p99'] is not None)
+    
+    def test_super_calls_count_once(self):
+        backend = SuperMockSearchBackend('default')
+        backend.search(u'*')
+        
+        summary = metrics.registry.summary()['default']
+        self.assertEqual(summary['search']['count'], 1)
+        self.assertEqual(summary['search']['payload_bytes'], 10)
+        
+        # Outside of an operation, there's nothing to add to.
+        add_payload_bytes(10)
+        self.assertEqual(metrics.registry.summary()['default']['search']['payload_bytes'], 10)
+    
+    def test_counts_and_facets(self):
+        self.backend.count(u'*')
+        self.backend.estimate_count(u'*', 10)
+        self.backend.facet_counts(u'*')
+        
+        # The searches they run on their own backend are part of them.
+        summary = metrics.registry.summary()['default']
+        self.assertEqual(sorted(summary.keys()), ['count', 'estimate_count', 'facet_counts'])
+        self.assertEqual(summary['count']['count'], 1)
+        self.assertEqual(summary['estimate_count']['count'], 1)
+        self.assertEqual(summary['facet_counts']['count'], 1)
+    
+    def test_errors(self):
+        backend = BrokenMockSearchBackend('default')
+        self.assertRaises(IOError, backend.clear)
+        self.assertEqual(metrics.registry.summary()['default']['clear']['errors'], 1)
+        
+        self.assertRaises(IOError, backend.count, u'*')
+        self.assertEqual(metrics.registry.summary()['default']['count']['errors'], 1)
+        
+        # Errors that are only logged count too.
+        class LoggingMockSearchBackend(MockSearchBackend):
+            def count(self, query_string, **kwargs):
+                metrics.mark_error()
+                return 0
+        
+        LoggingMockSearchBackend('default').count(u'*')
+        self.assertEqual(metrics.registry.summary()['default']['count']['errors'], 2)
+    
+    def test_disabled(self):
+        metrics.registry.enabled = False
+        self.backend.search(u'*')
+        self.assertEqual(metrics.registry.summary(), {})
@@ -1,6 +1,6 @@
 from django.db.models.loading import get_model
 from django.utils.encoding import force_unicode
-from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query, log_more_like_this
 from haystack.models import SearchResult
 from haystack.routers import BaseRouter
 from haystack.utils import get_identifier
@@ -92,6 +92,7 @@ class MockSearchBackend(BaseSearchBackend):
             'hits': hits,
         }
     
+    @log_more_like_this
     def more_like_this(self, model_instance, additional_query_string=None, result_class=None):
         return self.search(query_string='*')
 
@@ -130,6 +131,16 @@ class MixedMockSearchBackend(MockSearchBackend):
         return result_info
 
 
+class EstimatingMockSearchBackend(MockSearchBackend):
+    @log_query
+    def estimate_count(self, query_string, threshold, **kwargs):
+        # Pretends to stop counting at the threshold.
+        return {
+            'hits': threshold * 10,
+            'exact': False,
+        }
+
+
 class MockSearchQuery(BaseSearchQuery):
     def build_query(self):
         return ''
@@ -5,7 +5,7 @@ from haystack import connections
 from haystack.models import SearchResult
 from haystack.utils.loading import UnifiedIndex
 from core.models import MockModel, AFifthMockModel
-from core.tests.mocks import MockSearchResult
+from core.tests.mocks import MockSearchResult, MockSearchBackend
 from core.tests.indexes import ReadQuerySetTestSearchIndex
 
 class CaptureHandler(logging.Handler):
@@ -109,6 +109,54 @@ class SearchResultTestCase(TestCase):
         # Restore.
         connections['default']._index = old_unified_index
     
+    def test_stored_fields_deferred(self):
+        from haystack import indexes
+        
+        class TestSearchIndex(indexes.SearchIndex):
+            text = indexes.CharField(document=True)
+            author = indexes.CharField(model_attr='author')
+            pub_date = indexes.DateTimeField(model_attr='pub_date')
+            
+            def get_model(self):
+                return MockModel
+        
+        fetched = []
+        
+        class FetchingMockSearchBackend(MockSearchBackend):
+            def fetch_fields(self, identifier, index, fields):
+                fetched.append((identifier, sorted(fields)))
+                return {'text': u'Indexed!', 'pub_date': None}
+        
+        # Stow.
+        old_unified_index = connections['default']._index
+        old_backend = connections['default'].backend
+        ui = UnifiedIndex()
+        ui.build(indexes=[TestSearchIndex()])
+        connections['default']._index = ui
+        connections['default'].backend = FetchingMockSearchBackend
+        
+        result = SearchResult('core', 'mockmodel', '1', 2, author=u'daniel1')
+        result.defer_fields(['author'], 'default')
+        self.assertEqual(result.author, u'daniel1')
+        self.assertEqual(result.missing, None)
+        self.assertEqual(fetched, [])
+        
+        # The first deferred field fetches all of them.
+        self.assertEqual(result.text, u'Indexed!')
+        self.assertEqual(result.pub_date, None)
+        self.assertEqual(fetched, [(u'core.mockmodel.1', ['pub_date', 'text'])])
+        self.assertEqual(sorted(result.get_additional_fields().keys()), ['author', 'pub_date', 'text'])
+        
+        # Backends that can't fetch them leave them empty.
+        connections['default'].backend = MockSearchBackend
+        result = SearchResult('core', 'mockmodel', '1', 2, author=u'daniel1')
+        result.defer_fields(['author'], 'default')
+        self.assertEqual(result.text, None)
+        
+        # Restore.
+        connections['default']._index = old_unified_index
+        connections['default'].backend = old_backend
+    
     def test_missing_object(self):
         awol1 = SearchResult('core', 'mockmodel', '1000000', 2)
         self.assertEqual(awol1.app_label, 'core')
@@ -1,17 +1,20 @@
 # -*- coding: utf-8 -*-
 import datetime
+import itertools
+import threading
 from django.conf import settings
+from django.db import connections as db_connections
 from django.test import TestCase
 from haystack import connections, connection_router, reset_search_queries
 from haystack.backends import SQ, BaseSearchQuery
 from haystack.exceptions import FacetingError
 from haystack import indexes
 from haystack.models import SearchResult
-from haystack.query import SearchQuerySet, EmptySearchQuerySet
+from haystack.query import SearchQuerySet, RelatedSearchQuerySet, EmptySearchQuerySet, ValuesSearchQuerySet, ValuesListSearchQuerySet, ResultCache, CursorPage, threaded_read_ahead, pooled_read_ahead, get_async_pool, encode_cursor, decode_cursor, multi_search
 from haystack.utils.loading import UnifiedIndex
 from core.models import MockModel, AnotherMockModel, CharPKMockModel, AFifthMockModel
 from core.tests.indexes import ReadQuerySetTestSearchIndex, GhettoAFifthMockModelSearchIndex, TextReadQuerySetTestSearchIndex
-from core.tests.mocks import MockSearchQuery, MockSearchBackend, CharPKMockSearchBackend, MixedMockSearchBackend, ReadQuerySetMockSearchBackend, MOCK_SEARCH_RESULTS
+from core.tests.mocks import MockSearchQuery, MockSearchBackend, CharPKMockSearchBackend, MixedMockSearchBackend, EstimatingMockSearchBackend, ReadQuerySetMockSearchBackend, MOCK_SEARCH_RESULTS
 from core.tests.views import BasicMockModelSearchIndex, BasicAnotherMockModelSearchIndex
 
 test_pickling = True
@@ -58,6 +61,41 @@ class SQTestCase(TestCase):
         
         mega_sq = SQ(bigger_sq & SQ(another_bigger_sq | ~one_more_bigger_sq))
         self.assertEqual(repr(mega_sq), '<SQ: AND ((foo__exact=bar AND foo__exact=bar) AND ((foo__exact=bar OR foo__exact=bar) OR NOT ((foo__exact=bar AND NOT (foo__exact=bar)))))>')
+        
+        # All of which boils down to...
+        self.assertEqual(repr(mega_sq.normalize()), '<SQ: AND foo__exact=bar>')
+        self.assertEqual(repr(mega_sq), '<SQ: AND ((foo__exact=bar AND foo__exact=bar) AND ((foo__exact=bar OR foo__exact=bar) OR NOT ((foo__exact=bar AND NOT (foo__exact=bar)))))>')
+    
+    def test_normalize(self):
+        self.assertEqual(repr(SQ(foo='bar').normalize()), '<SQ: AND foo__exact=bar>')
+        self.assertEqual(repr(SQ().normalize()), '<SQ: AND >')
+        
+        # Groups get flattened & duplicates dropped.
+        sq = SQ(SQ(foo='bar') & SQ(SQ(baz=1) & SQ(foo='bar')))
+        self.assertEqual(repr(sq.normalize()), '<SQ: AND (baz__exact=1 AND foo__exact=bar)>')
+        sq = SQ(SQ(foo='bar') | SQ(SQ(baz=1) | SQ(foo='bar')))
+        self.assertEqual(repr(sq.normalize()), '<SQ: OR (baz__exact=1 OR foo__exact=bar)>')
+        
+        # Field lookups get sorted, after any plain search terms (which keep
+        # their order).
+        sq = SQ(zed__gt=1) & SQ(content='why') & ~SQ(moof='claris') & SQ(content='hello') & SQ(bar='baz')
+        self.assertEqual(repr(sq.normalize()), '<SQ: AND (content__exact=why AND content__exact=hello AND bar__exact=baz AND zed__gt=1 AND NOT (moof__exact=claris))>')
+        self.assertEqual(repr((SQ(bar='baz') & SQ(zed__gt=1)).normalize()), repr((SQ(zed__gt=1) & SQ(bar='baz')).normalize()))
+        
+        # Values of different types are different.
+        self.assertEqual(repr((SQ(foo=1) & SQ(foo=True)).normalize()), '<SQ: AND (foo__exact=True AND foo__exact=1)>')
+        
+        # Double negatives cancel out.
+        self.assertEqual(repr((~~SQ(foo='bar')).normalize()), '<SQ: AND foo__exact=bar>')
+        
+        # Contradictions can't match anything.
+        self.assertEqual((SQ(foo='bar') & ~SQ(foo='bar')).normalize(), None)
+        self.assertEqual((SQ(foo='bar') & SQ(baz__in=[])).normalize(), None)
+        self.assertEqual(repr((SQ(foo='bar') | SQ(baz__in=[])).normalize()), '<SQ: AND foo__exact=bar>')
+        
+        # While tautologies match everything.
+        self.assertEqual(repr((SQ(foo='bar') | ~SQ(foo='bar')).normalize()), '<SQ: AND >')
+        self.assertEqual(repr((SQ(foo='bar') & ~SQ(baz__in=[])).normalize()), '<SQ: AND foo__exact=bar>')
 
 
 class BaseSearchQueryTestCase(TestCase):
@@ -160,6 +198,41 @@ class BaseSearchQueryTestCase(TestCase):
         self.assertEqual(msq.get_count(), 23)
         self.assertEqual(int(msq.get_results()[0].pk), MOCK_SEARCH_RESULTS[0].pk)
     
+    def test_run_count(self):
+        msq = MockSearchQuery()
+        msq.backend = MockSearchBackend('default')
+        ui = connections['default'].get_unified_index()
+        bmmsi = BasicMockModelSearchIndex()
+        ui.build(indexes=[bmmsi])
+        bmmsi.update()
+        
+        self.assertEqual(msq.get_count(), 23)
+        
+        # Only the count was fetched.
+        self.assertEqual(msq.has_run(), False)
+        self.assertEqual(msq._results, None)
+        self.assertEqual(msq.end_offset, None)
+    
+    def test_run_facets(self):
+        msq = MockSearchQuery()
+        msq.backend = MockSearchBackend('default')
+        ui = connections['default'].get_unified_index()
+        bmmsi = BasicMockModelSearchIndex()
+        ui.build(indexes=[bmmsi])
+        bmmsi.update()
+        
+        # Without any facets, there's nothing to ask the backend for.
+        self.assertEqual(msq.get_facet_counts(), {})
+        self.assertEqual(msq._hit_count, None)
+        
+        msq = msq._clone()
+        msq.add_field_facet('name')
+        self.assertEqual(msq.get_facet_counts(), {})
+        
+        # Only the facets (& count) were fetched.
+        self.assertEqual(msq._hit_count, 23)
+        self.assertEqual(msq._results, None)
+    
     def test_add_field_facet(self):
         self.bsq.add_field_facet('foo')
         self.assertEqual(self.bsq.facets, set(['foo']))
@@ -256,6 +329,60 @@ class BaseSearchQueryTestCase(TestCase):
         self.assertEqual(clone.end_offset, self.bsq.end_offset)
         self.assertEqual(clone.backend.__class__, self.bsq.backend.__class__)
     
+    def test_matches_nothing(self):
+        msq = MockSearchQuery()
+        msq.backend = MockSearchBackend('default')
+        msq.add_filter(SQ(foo='bar'))
+        self.assertEqual(msq.matches_nothing(), False)
+        
+        msq.add_filter(~SQ(foo='bar'))
+        self.assertEqual(msq.matches_nothing(), True)
+        
+        # The backend never gets asked.
+        msq.backend = None
+        self.assertEqual(msq.get_count(), 0)
+        self.assertEqual(msq.get_results(), [])
+        self.assertEqual(msq.get_facet_counts(), {})
+        
+        msq = msq._clone()
+        msq.add_field_facet('foo')
+        self.assertEqual(msq.get_facet_counts(), {})
+    
+    def test_clone_copy_on_write(self):
+        self.bsq.add_filter(SQ(foo='bar'))
+        self.bsq.add_order_by('foo')
+        self.bsq.add_narrow_query('foo:bar')
+        
+        # Nothing gets copied until it's changed.
+        clone = self.bsq._clone()
+        self.assertTrue(clone.query_filter is self.bsq.query_filter)
+        self.assertTrue(clone.order_by is self.bsq.order_by)
+        self.assertTrue(clone.narrow_queries is self.bsq.narrow_queries)
+        
+        clone.add_filter(SQ(baz='qux'))
+        clone.add_filter(SQ(moof='claris'), use_or=True)
+        clone.add_order_by('bar')
+        clone.add_narrow_query('bar:baz')
+        clone.add_model(MockModel)
+        self.assertFalse(clone.query_filter is self.bsq.query_filter)
+        self.assertEqual(repr(self.bsq.query_filter), '<SQ: AND foo__exact=bar>')
+        self.assertEqual(repr(clone.query_filter), '<SQ: OR ((foo__exact=bar AND baz__exact=qux) OR moof__exact=claris)>')
+        self.assertEqual(self.bsq.order_by, ['foo'])
+        self.assertEqual(clone.order_by, ['foo', 'bar'])
+        self.assertEqual(self.bsq.narrow_queries, set(['foo:bar']))
+        self.assertEqual(self.bsq.models, set())
+        
+        # Nor does the original change a clone.
+        clone = self.bsq._clone()
+        self.bsq.add_filter(~SQ(baz='qux'))
+        self.bsq.clear_order_by()
+        self.assertEqual(repr(clone.query_filter), '<SQ: AND foo__exact=bar>')
+        self.assertEqual(clone.order_by, ['foo'])
+        
+        # Backends can't change them behind the query's back either.
+        self.bsq.build_params()['narrow_queries'].add('baz:qux')
+        self.assertEqual(self.bsq.narrow_queries, set(['foo:bar']))
+    
     def test_log_query(self):
         reset_search_queries()
         self.assertEqual(len(connections['default'].queries), 0)
@@ -297,6 +424,87 @@ class BaseSearchQueryTestCase(TestCase):
         settings.DEBUG = old_debug
 
 
+class ResultCacheTestCase(TestCase):
+    def setUp(self):
+        super(ResultCacheTestCase, self).setUp()
+        self.cache = ResultCache()
+        self.cache.size = 10000
+    
+    def test_empty(self):
+        cache = ResultCache()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(list(cache), [])
+        self.assertEqual(cache[:10], [])
+        self.assertEqual(cache.first_unfilled(), 0)
+        self.assertEqual(cache.is_filled(0, 10), False)
+        self.assertEqual(cache.is_full(), False)
+        self.assertRaises(IndexError, lambda: cache[0])
+    
+    def test_sparse_fill(self):
+        # Touching a deep page only allocates the chunk it falls in.
+        self.cache.fill(5000, range(5000, 5020))
+        self.assertEqual(len(self.cache._chunks), 1)
+        self.assertEqual(len(self.cache), 20)
+        self.assertEqual(self.cache[5000], 5000)
+        self.assertEqual(self.cache[5019], 5019)
+        self.assertEqual(self.cache[5010:5015], [5010, 5011, 5012, 5013, 5014])
+        self.assertEqual(self.cache.first_unfilled(), 0)
+        self.assertEqual(self.cache.is_filled(5000, 5020), True)
+        self.assertEqual(self.cache.is_filled(4990, 5020), False)
+        
+        # Unfilled offsets within the hits are holes, the rest don't exist.
+        self.assertEqual(self.cache[10], None)
+        self.assertRaises(IndexError, lambda: self.cache[10000])
+        
+        # Spanning chunks.
+        self.cache.fill(95, range(95, 110))
+        self.assertEqual(len(self.cache._chunks), 3)
+        self.assertEqual(self.cache[95:110], range(95, 110))
+        self.assertEqual(list(self.cache), range(95, 110) + range(5000, 5020))
+    
+    def test_ranges(self):
+        self.cache.fill(0, range(0, 10))
+        self.cache.fill(20, range(20, 30))
+        self.assertEqual(zip(self.cache._starts, self.cache._ends), [(0, 10), (20, 30)])
+        self.assertEqual(self.cache.first_unfilled(), 10)
+        self.assertEqual(self.cache.is_filled(0, 20), False)
+        
+        self.cache.fill(10, range(10, 20))
+        self.assertEqual(zip(self.cache._starts, self.cache._ends), [(0, 30)])
+        self.assertEqual(self.cache.first_unfilled(), 30)
+        self.assertEqual(self.cache.is_filled(0, 20), True)
+        self.assertEqual(self.cache.is_filled(5, 25), True)
+        
+        # Refilling doesn't double count.
+        self.cache.fill(5, range(5, 15))
+        self.assertEqual(len(self.cache), 30)
+        self.assertEqual(list(self.cache), range(0, 30))
+        
+        # Filling across several ranges merges them all.
+        self.cache.fill(50, range(50, 60))
+        self.cache.fill(70, range(70, 80))
+        self.cache.fill(40, range(40, 45))
+        self.assertEqual(zip(self.cache._starts, self.cache._ends), [(0, 30), (40, 45), (50, 60), (70, 80)])
+        self.assertEqual(len(self.cache), 55)
+        self.cache.fill(42, range(42, 72))
+        self.assertEqual(zip(self.cache._starts, self.cache._ends), [(0, 30), (40, 80)])
+        self.assertEqual(len(self.cache), 70)
+        self.assertEqual(self.cache[25:45], range(25, 30) + range(40, 45))
+        self.assertEqual(self.cache[79], 79)
+        self.assertEqual(self.cache[35], None)
+    
+    def test_is_full(self):
+        cache = ResultCache()
+        cache.size = 25
+        cache.fill(0, range(0, 20))
+        self.assertEqual(cache.is_full(), False)
+        self.assertEqual(cache.is_filled(10, None), False)
+        cache.fill(20, range(20, 25))
+        self.assertEqual(cache.is_full(), True)
+        self.assertEqual(cache.is_filled(10, None), True)
+        self.assertEqual(cache.is_filled(20, 100), True)
+
+
 class CharPKMockModelSearchIndex(indexes.SearchIndex):
     text = indexes.CharField(document=True, model_attr='key')
     
@@ -352,7 +560,9 @@ class SearchQuerySetTestCase(TestCase):
         msqs = self.msqs.all()
         results = [int(res.pk) for res in msqs]
         self.assertEqual(results, [res.pk for res in MOCK_SEARCH_RESULTS[:23]])
-        self.assertEqual(len(connections['default'].queries), 3)
+        # Pages of 10, then 20.
+        self.assertEqual(len(connections['default'].queries), 2)
+        self.assertEqual(msqs.round_trips, 2)
     
     def test_slice(self):
         reset_search_queries()
@@ -376,7 +586,7 @@ class SearchQuerySetTestCase(TestCase):
         check = [result.pk for result in results._manual_iter()]
         self.assertEqual(check, [u'1', u'2', u'3', u'4', u'5', u'6', u'7', u'8', u'9', u'10', u'11', u'12', u'13', u'14', u'15', u'16', u'17', u'18', u'19', u'20', u'21', u'22', u'23'])
         
-        self.assertEqual(len(connections['default'].queries), 3)
+        self.assertEqual(len(connections['default'].queries), 2)
         
         reset_search_queries()
         self.assertEqual(len(connections['default'].queries), 0)
@@ -396,6 +606,183 @@ class SearchQuerySetTestCase(TestCase):
         
         connections['default']._index = old_ui
     
+    def test_iterator(self):
+        results = self.msqs.all()
+        
+        reset_search_queries()
+        self.assertEqual(len(connections['default'].queries), 0)
+        
+        check = [int(result.pk) for result in results.iterator()]
+        self.assertEqual(check, [res.pk for res in MOCK_SEARCH_RESULTS[:23]])
+        self.assertEqual(len(connections['default'].queries), 2)
+        
+        # Nothing should have been kept around.
+        self.assertEqual(len(results._result_cache), 0)
+        self.assertEqual(results.query.has_run(), False)
+        
+        reset_search_queries()
+        self.assertEqual(len(connections['default'].queries), 0)
+        
+        check = [int(result.pk) for result in results.iterator(chunk_size=5)]
+        self.assertEqual(check, [res.pk for res in MOCK_SEARCH_RESULTS[:23]])
+        self.assertEqual(len(connections['default'].queries), 5)
+        self.assertEqual(len(results._result_cache), 0)
+        
+        self.assertRaises(ValueError, lambda: list(results.iterator(chunk_size=0)))
+    
+    def test_load_per_query(self):
+        self.assertEqual(list(itertools.islice(self.msqs._page_sizes(), 9)), [10, 20, 40, 80, 160, 320, 640, 1000, 1000])
+        
+        sqs = self.msqs.load_per_query(initial=1, maximum=5)
+        self.assertTrue(isinstance(sqs, SearchQuerySet))
+        self.assertEqual(list(itertools.islice(sqs._page_sizes(), 5)), [1, 2, 4, 5, 5])
+        
+        # Survives cloning.
+        sqs = sqs.load_per_query(growth=3).all()
+        self.assertEqual(list(itertools.islice(sqs._page_sizes(), 4)), [1, 3, 5, 5])
+        
+        # Fractional growth still grows, by at least one result per page.
+        sqs = self.msqs.load_per_query(initial=10, growth=1.05)
+        self.assertEqual(list(itertools.islice(sqs._page_sizes(), 5)), [10, 11, 12, 13, 14])
+        sqs = self.msqs.load_per_query(initial=1, maximum=6, growth=1.5)
+        self.assertEqual(list(itertools.islice(sqs._page_sizes(), 6)), [1, 2, 3, 5, 6, 6])
+        
+        # A growth of 1 gives fixed-size pages.
+        sqs = self.msqs.load_per_query(initial=5, growth=1)
+        self.assertEqual(list(itertools.islice(sqs._page_sizes(), 3)), [5, 5, 5])
+        
+        # The maximum never shrinks the initial size.
+        sqs = self.msqs.load_per_query(initial=50, maximum=20)
+        self.assertEqual(list(itertools.islice(sqs._page_sizes(), 3)), [50, 50, 50])
+        
+        self.assertRaises(ValueError, self.msqs.load_per_query, initial=0)
+        self.assertRaises(ValueError, self.msqs.load_per_query, growth=0.5)
+        
+        reset_search_queries()
+        self.assertEqual(len(connections['default'].queries), 0)
+        
+        sqs = self.msqs.load_per_query(initial=2, maximum=8)
+        results = [int(res.pk) for res in sqs]
+        self.assertEqual(results, [res.pk for res in MOCK_SEARCH_RESULTS[:23]])
+        # Pages of 2, 4, 8, 8 & 8.
+        self.assertEqual(sqs.round_trips, 5)
+        self.assertEqual(len(connections['default'].queries), 5)
+        
+        # Iterating a full cache doesn't go back to the backend.
+        results = [int(res.pk) for res in sqs]
+        self.assertEqual(sqs.round_trips, 5)
+    
+    def test_read_ahead(self):
+        sqs = self.msqs.read_ahead()
+        self.assertTrue(isinstance(sqs, SearchQuerySet))
+        self.assertEqual(sqs._read_ahead, 1)
+        self.assertEqual(sqs.all()._read_ahead, 1)
+        self.assertEqual(sqs.read_ahead(0)._read_ahead, 0)
+        self.assertRaises(ValueError, self.msqs.read_ahead, -1)
+        
+        reset_search_queries()
+        self.assertEqual(len(connections['default'].queries), 0)
+        
+        sqs = self.msqs.read_ahead(2)
+        results = [int(res.pk) for res in sqs]
+        self.assertEqual(results, [res.pk for res in MOCK_SEARCH_RESULTS[:23]])
+        self.assertEqual(sqs.round_trips, 2)
+        self.assertEqual(len(connections['default'].queries), 2)
+        self.assertEqual(len(sqs), 23)
+        self.assertEqual(len(sqs._result_cache), 23)
+        
+        # Everything's cached now, so there's no more fetching to do.
+        results = [int(res.pk) for res in sqs]
+        self.assertEqual(results, [res.pk for res in MOCK_SEARCH_RESULTS[:23]])
+        self.assertEqual(len(connections['default'].queries), 2)
+        
+        reset_search_queries()
+        
+        # Also works without caching.
+        sqs = self.msqs.read_ahead()
+        results = [int(res.pk) for res in sqs.iterator(chunk_size=5)]
+        self.assertEqual(results, [res.pk for res in MOCK_SEARCH_RESULTS[:23]])
+        self.assertEqual(len(connections['default'].queries), 5)
+        self.assertEqual(len(sqs._result_cache), 0)
+    
+    def test_threaded_read_ahead(self):
+        self.assertEqual(list(threaded_read_ahead(iter(range(10)), 3)), range(10))
+        
+        # Errors make it back to the consumer.
+        def broken():
+            yield 1
+            raise IOError("Backend went away.")
+        
+        pages = threaded_read_ahead(broken())
+        self.assertEqual(pages.next(), 1)
+        self.assertRaises(IOError, pages.next)
+        
+        # Stopping early lets the background thread finish.
+        fetched = []
+        
+        def counting():
+            for i in range(1000):
+                fetched.append(i)
+                yield i
+        
+        pages = threaded_read_ahead(counting(), 2)
+        self.assertEqual(pages.next(), 0)
+        pages.close()
+        
+        for thread in threading.enumerate():
+            if thread.getName() == 'haystack-read-ahead':
+                thread.join(5)
+                self.assertFalse(thread.isAlive())
+        
+        self.assertTrue(len(fetched) < 10)
+    
+    def test_pooled_read_ahead(self):
+        self.assertEqual(list(pooled_read_ahead(iter(range(10)), get_async_pool())), range(10))
+        self.assertEqual(list(pooled_read_ahead([], get_async_pool())), [])
+        
+        # Errors make it back to the consumer.
+        def broken():
+            yield 1
+            raise IOError("Backend went away.")
+        
+        pages = pooled_read_ahead(broken(), get_async_pool())
+        self.assertEqual(pages.next(), 1)
+        self.assertRaises(IOError, pages.next)
+    
+    def test_aiterator(self):
+        self.assertEqual([int(result.pk) for result in self.msqs.aiterator()], range(1, 24))
+        self.assertEqual([int(result.pk) for result in self.msqs.aiterator(chunk_size=5)], range(1, 24))
+        self.assertEqual(len(connections['default'].queries), 7)
+        self.assertRaises(ValueError, self.msqs.aiterator(chunk_size=0).next)
+    
+    def test_acount(self):
+        sqs = self.msqs.all()
+        self.assertEqual(sqs.acount().get(5), 23)
+        self.assertEqual(sqs.count(), 23)
+        self.assertEqual(len(connections['default'].queries), 1)
+        
+        counts = []
+        self.msqs.all().acount(callback=counts.append).wait(5)
+        self.assertEqual(counts, [23])
+    
+    def test_aget(self):
+        sqs = self.msqs.all()
+        self.assertEqual(int(sqs.aget(0).get(5).pk), 1)
+        self.assertEqual([int(result.pk) for result in sqs.aget(slice(5, 8)).get(5)], [6, 7, 8])
+        self.assertRaises(TypeError, sqs.aget, 'foo')
+        
+        # Errors are raised from ``get``.
+        self.assertRaises(IndexError, self.msqs.all().aget(30).get, 5)
+        
+        # The pool's database connections are closed afterwards.
+        closed = self.track_db_closes()
+        self.assertEqual(int(self.msqs.all().aget(0).get(5).pk), 1)
+        self.assertTrue(len(closed) > 0)
+        self.assertFalse(threading.currentThread().getName() in closed)
+    
+    def test_afacet_counts(self):
+        self.assertEqual(self.msqs.afacet_counts().get(5), {})
+    
     def test_fill_cache(self):
         reset_search_queries()
         self.assertEqual(len(connections['default'].queries), 0)
@@ -440,7 +827,7 @@ class SearchQuerySetTestCase(TestCase):
         results = self.msqs.all()
         fire_the_iterator_and_fill_cache = [result for result in results]
         self.assertEqual(results._cache_is_full(), True)
-        self.assertEqual(len(connections['default'].queries), 3)
+        self.assertEqual(len(connections['default'].queries), 2)
     
     def test_all(self):
         sqs = self.msqs.all()
@@ -549,6 +936,85 @@ class SearchQuerySetTestCase(TestCase):
         
         # For full tests, see the solr_backend.
     
+    def test_load_objects(self):
+        sqs = self.msqs.load_all()
+        self.assertEqual(sqs.load_timings, {})
+        
+        querysets = {
+            MockModel: MockModel.objects.all(),
+            AnotherMockModel: AnotherMockModel.objects.all(),
+        }
+        models_pks = {
+            MockModel: [1, 2, 3],
+            AnotherMockModel: [1, 2],
+        }
+        # SQLite can't be shared between threads.
+        self.assertEqual(sqs._can_load_in_parallel(querysets), False)
+        
+        loaded = sqs._load_objects(querysets, models_pks)
+        self.assertEqual(sorted(loaded[MockModel].keys()), [1, 2, 3])
+        self.assertEqual(sorted(loaded[AnotherMockModel].keys()), [1, 2])
+        self.assertEqual(sorted(sqs.load_timings.keys()), sorted([MockModel, AnotherMockModel]))
+        
+        # Timings add up across pages.
+        first_timing = sqs.load_timings[MockModel]
+        sqs._load_objects({MockModel: MockModel.objects.all()}, {MockModel: [4]})
+        self.assertTrue(sqs.load_timings[MockModel] >= first_timing)
+        
+        # Results are loaded in the pool when the databases allow it.
+        class FakeQuerySet(object):
+            db = 'default'
+            
+            def __init__(self):
+                self.thread_name = None
+            
+            def in_bulk(self, pks):
+                self.thread_name = threading.currentThread().getName()
+                return dict([(pk, pk) for pk in pks])
+        
+        class ParallelSearchQuerySet(SearchQuerySet):
+            def _can_load_in_parallel(self, querysets):
+                return True
+        
+        querysets = {
+            MockModel: FakeQuerySet(),
+            AnotherMockModel: FakeQuerySet(),
+        }
+        loaded = ParallelSearchQuerySet()._load_objects(querysets, models_pks)
+        self.assertEqual(loaded, {MockModel: {1: 1, 2: 2, 3: 3}, AnotherMockModel: {1: 1, 2: 2}})
+        self.assertNotEqual(querysets[MockModel].thread_name, threading.currentThread().getName())
+        self.assertNotEqual(querysets[AnotherMockModel].thread_name, threading.currentThread().getName())
+        
+        # The pool's connections get closed, but not this thread's.
+        closed = self.track_db_closes()
+        querysets = {
+            MockModel: FakeQuerySet(),
+            AnotherMockModel: FakeQuerySet(),
+        }
+        ParallelSearchQuerySet()._load_objects(querysets, models_pks)
+        self.assertEqual(sorted(closed), sorted([querysets[MockModel].thread_name, querysets[AnotherMockModel].thread_name]))
+        
+        del closed[:]
+        sqs._load_objects({MockModel: MockModel.objects.all()}, {MockModel: [4]})
+        self.assertEqual(closed, [])
+    
+    def track_db_closes(self):
+        """
+        Records the name of the thread each time a database connection gets
+        closed, until the end of the test.
+        """
+        wrapper_class = db_connections['default'].__class__
+        old_close = wrapper_class.close
+        closed = []
+        
+        def close(connection):
+            closed.append(threading.currentThread().getName())
+            old_close(connection)
+        
+        wrapper_class.close = close
+        self.addCleanup(setattr, wrapper_class, 'close', old_close)
+        return closed
+    
     def test_load_all_read_queryset(self):
         # Stow.
         old_ui = connections['default']._index
@@ -610,10 +1076,108 @@ class SearchQuerySetTestCase(TestCase):
     
     def test_count(self):
         self.assertEqual(self.msqs.count(), 23)
+        
+        sqs = self.msqs.all()
+        self.assertEqual(sqs.count(), 23)
+        self.assertEqual(sqs.query._results, None)
+        self.assertEqual(len(sqs._result_cache), 0)
     
     def test_facet_counts(self):
         self.assertEqual(self.msqs.facet_counts(), {})
     
+    def test_only_defer(self):
+        sqs = self.msqs.only('name', 'text')
+        self.assertEqual(sqs.query.get_loaded_fields(), ['name', 'text'])
+        self.assertEqual(self.msqs.query.get_loaded_fields(), None)
+        self.assertEqual(sqs.defer('text').query.get_loaded_fields(), ['name'])
+        self.assertEqual(sqs.only('pub_date').query.get_loaded_fields(), ['pub_date'])
+        
+        # Deferring picks from the stored fields.
+        self.assertEqual(self.msqs.defer('text').query.get_loaded_fields(), [])
+        self.assertEqual(self.msqs.defer('text').defer(None).query.get_loaded_fields(), None)
+        
+        result = sqs[0]
+        self.assertEqual(result._loaded_fields, ['name', 'text'])
+        self.assertEqual(result._using, 'default')
+        self.assertEqual(self.msqs[0]._loaded_fields, None)
+    
+    def test_values(self):
+        sqs = self.msqs.values('pk', 'model_name')
+        self.assertTrue(isinstance(sqs, ValuesSearchQuerySet))
+        self.assertEqual(sqs.query.values, ['pk', 'model_name'])
+        self.assertEqual(sqs[0], {'pk': u'1', 'model_name': u'mockmodel'})
+        self.assertEqual(len(sqs), 23)
+        
+        # Chaining keeps the projection.
+        sqs = sqs.order_by('-pub_date')
+        self.assertTrue(isinstance(sqs, ValuesSearchQuerySet))
+        self.assertEqual([row['pk'] for row in sqs[:3]], [u'1', u'2', u'3'])
+        
+        self.assertRaises(TypeError, self.msqs.values)
+        self.assertEqual(len(EmptySearchQuerySet().values('pk')), 0)
+    
+    def test_values_list(self):
+        sqs = self.msqs.values_list('pk', 'model_name')
+        self.assertTrue(isinstance(sqs, ValuesListSearchQuerySet))
+        self.assertEqual(sqs[0], (u'1', u'mockmodel'))
+        self.assertEqual(list(self.msqs.values_list('pk', flat=True))[:3], [u'1', u'2', u'3'])
+        self.assertEqual(list(self.msqs.values_list('pk', flat=True).values_list('pk', 'model_name'))[0], (u'1', u'mockmodel'))
+        
+        self.assertRaises(TypeError, self.msqs.values_list)
+        self.assertRaises(TypeError, self.msqs.values_list, 'pk', 'model_name', flat=True)
+        self.assertRaises(TypeError, self.msqs.values_list, 'pk', flatten=True)
+    
+    def test_multi_search(self):
+        first = self.msqs.all()
+        second = self.msqs.order_by('-pub_date').load_per_query(5)
+        empty = EmptySearchQuerySet()
+        self.assertEqual(multi_search([first, second, empty]), [first, second, empty])
+        self.assertEqual(len(connections['default'].queries), 2)
+        self.assertEqual(first.round_trips, 1)
+        self.assertEqual(second.round_trips, 1)
+        self.assertEqual(connections['default'].queries[1]['additional_kwargs']['end_offset'], 5)
+        
+        # The first page of each is cached, along with the count & facets.
+        self.assertEqual([int(result.pk) for result in first[:10]], range(1, 11))
+        self.assertEqual(len(second[:5]), 5)
+        self.assertEqual(len(first), 23)
+        self.assertEqual(first.facet_counts(), {})
+        self.assertEqual(len(connections['default'].queries), 2)
+        
+        # Anything further along gets fetched as usual.
+        self.assertEqual(int(first[10].pk), 11)
+        self.assertEqual(len(connections['default'].queries), 3)
+        
+        self.assertEqual(multi_search([]), [])
+    
+    def test_cursor_page(self):
+        page = self.msqs.cursor_page(page_size=10)
+        self.assertTrue(isinstance(page, CursorPage))
+        self.assertEqual([int(result.pk) for result in page], range(1, 11))
+        self.assertEqual(page.has_next(), True)
+        self.assertEqual(int(page[0].pk), 1)
+        
+        # Tokens are opaque but stable.
+        self.assertEqual(decode_cursor(page.next_cursor), ('o', '10'))
+        self.assertEqual(self.msqs.cursor_page(page_size=10).next_cursor, page.next_cursor)
+        
+        results = list(page)
+        cursor = page.next_cursor
+        
+        while cursor is not None:
+            page = self.msqs.cursor_page(cursor, page_size=10)
+            results.extend(page)
+            cursor = page.next_cursor
+        
+        self.assertEqual([int(result.pk) for result in results], range(1, 24))
+        self.assertEqual(len(page), 3)
+        self.assertEqual(page.has_next(), False)
+        
+        self.assertRaises(ValueError, self.msqs.cursor_page, page_size=0)
+        self.assertRaises(ValueError, self.msqs.cursor_page, 'not-a-cursor')
+        # Backend cursors don't work with backends that use offsets.
+        self.assertRaises(ValueError, self.msqs.cursor_page, encode_cursor('c', '*'))
+    
     def test_best_match(self):
         self.assertTrue(isinstance(self.msqs.best_match(), SearchResult))
     
@@ -669,13 +1233,229 @@ class SearchQuerySetTestCase(TestCase):
         self.assertTrue(isinstance(sqs, SearchQuerySet))
         self.assertEqual(len(sqs.query.narrow_queries), 1)
     
+    def test_exists(self):
+        self.assertEqual(self.msqs.exists(), True)
+        self.assertEqual(len(connections['default'].queries), 1)
+        self.assertEqual(connections['default'].queries[0]['additional_kwargs'].get('end_offset'), 1)
+        self.assertEqual(self.msqs._result_count, None)
+        
+        self.assertEqual(self.msqs.filter(foo__in=[]).exists(), False)
+        self.assertEqual(EmptySearchQuerySet().exists(), False)
+        self.assertEqual(len(connections['default'].queries), 1)
+        
+        # Anything already known gets used.
+        sqs = self.msqs.all()
+        sqs[0]
+        self.assertEqual(sqs.exists(), True)
+        self.assertEqual(len(connections['default'].queries), 2)
+    
+    def test_first(self):
+        sqs = self.msqs.all().facet('foo').highlight()
+        self.assertEqual(sqs.first().pk, u'1')
+        self.assertEqual(len(connections['default'].queries), 1)
+        
+        kwargs = connections['default'].queries[0]['additional_kwargs']
+        self.assertEqual(kwargs['start_offset'], 0)
+        self.assertEqual(kwargs['end_offset'], 1)
+        self.assertEqual(kwargs['include_spelling'], False)
+        self.assertFalse('facets' in kwargs)
+        self.assertFalse('highlight' in kwargs)
+        
+        # Nothing gets cached.
+        self.assertEqual(len(sqs._result_cache), 0)
+        self.assertEqual(sqs.query.has_run(), False)
+        
+        # Unless it already was.
+        sqs[0:5]
+        self.assertEqual(sqs.first().pk, u'1')
+        self.assertEqual(len(connections['default'].queries), 2)
+        
+        self.assertEqual(self.msqs.filter(foo__in=[]).first(), None)
+        self.assertEqual(EmptySearchQuerySet().first(), None)
+        self.assertEqual(len(connections['default'].queries), 2)
+    
+    def test_last(self):
+        self.assertEqual(self.msqs.last().pk, u'23')
+        self.assertEqual(len(connections['default'].queries), 2)
+        self.assertEqual(connections['default'].queries[1]['additional_kwargs']['start_offset'], 22)
+        self.assertEqual(connections['default'].queries[1]['additional_kwargs']['end_offset'], 23)
+        
+        # With an ordering, it gets reversed instead.
+        reset_search_queries()
+        self.assertEqual(self.msqs.order_by('foo', '-bar').last().pk, u'1')
+        self.assertEqual(len(connections['default'].queries), 1)
+        self.assertEqual(connections['default'].queries[0]['additional_kwargs']['sort_by'], ['-foo', 'bar'])
+        self.assertEqual(connections['default'].queries[0]['additional_kwargs']['end_offset'], 1)
+        
+        self.assertEqual(self.msqs.filter(foo__in=[]).last(), None)
+        self.assertEqual(EmptySearchQuerySet().last(), None)
+        self.assertEqual(len(connections['default'].queries), 1)
+    
+    def test_first_last_dropped(self):
+        class DroppingSearchQuerySet(SearchQuerySet):
+            # Pretends the objects for these results are gone.
+            dropped = set([u'1', u'2', u'3', u'20', u'21', u'22', u'23'])
+            
+            def post_process_results(self, results):
+                results = super(DroppingSearchQuerySet, self).post_process_results(results)
+                return [result for result in results if result.pk not in self.dropped]
+        
+        # Only the nearby pages get fetched, not everything.
+        sqs = DroppingSearchQuerySet().load_per_query(initial=2)
+        self.assertEqual(sqs.first().pk, u'4')
+        self.assertEqual([(query['additional_kwargs']['start_offset'], query['additional_kwargs']['end_offset']) for query in connections['default'].queries], [(0, 1), (1, 3), (3, 7)])
+        
+        reset_search_queries()
+        self.assertEqual(sqs.last().pk, u'19')
+        self.assertEqual([(query['additional_kwargs'].get('start_offset'), query['additional_kwargs'].get('end_offset')) for query in list(connections['default'].queries)[1:]], [(22, 23), (20, 22), (16, 20)])
+        
+        # Nothing left.
+        DroppingSearchQuerySet.dropped = set([unicode(pk) for pk in xrange(1, 24)])
+        self.assertEqual(DroppingSearchQuerySet().first(), None)
+        self.assertEqual(DroppingSearchQuerySet().last(), None)
+    
+    def test_related_first(self):
+        rsqs = RelatedSearchQuerySet()
+        self.assertEqual(rsqs.first().pk, u'1')
+        self.assertEqual(len(connections['default'].queries), 1)
+        self.assertEqual(connections['default'].queries[0]['additional_kwargs']['end_offset'], 1)
+        
+        # Already cached results get used.
+        rsqs = RelatedSearchQuerySet()
+        rsqs[0:5]
+        queries = len(connections['default'].queries)
+        self.assertEqual(rsqs.first().pk, u'1')
+        self.assertEqual(len(connections['default'].queries), queries)
+        
+        self.assertEqual(RelatedSearchQuerySet().filter(foo__in=[]).first(), None)
+    
+    def test_related_last(self):
+        rsqs = RelatedSearchQuerySet()
+        self.assertEqual(rsqs.last().pk, u'23')
+        self.assertEqual(len(connections['default'].queries), 2)
+        self.assertEqual(connections['default'].queries[1]['additional_kwargs']['start_offset'], 22)
+        
+        reset_search_queries()
+        self.assertEqual(RelatedSearchQuerySet().order_by('foo').last().pk, u'1')
+        self.assertEqual(len(connections['default'].queries), 1)
+        
+        # A partially filled cache falls back to the backend, a full one doesn't.
+        reset_search_queries()
+        rsqs = RelatedSearchQuerySet()
+        rsqs[0:5]
+        queries = len(connections['default'].queries)
+        self.assertEqual(rsqs.last().pk, u'23')
+        self.assertEqual(len(connections['default'].queries), queries + 1)
+        
+        reset_search_queries()
+        rsqs = RelatedSearchQuerySet()
+        list(rsqs)
+        queries = len(connections['default'].queries)
+        self.assertEqual(rsqs.last().pk, u'23')
+        self.assertEqual(len(connections['default'].queries), queries)
+        
+        self.assertEqual(RelatedSearchQuerySet().filter(foo__in=[]).last(), None)
+    
+    def test_related_load_per_query(self):
+        rsqs = RelatedSearchQuerySet().load_per_query(initial=2, maximum=8).all()
+        self.assertEqual((rsqs._load_per_query, rsqs._max_load_per_query), (2, 8))
+        self.assertEqual(rsqs.load_all_queryset(MockModel, MockModel.objects.all())._load_per_query, 2)
+        
+        results = [int(res.pk) for res in rsqs]
+        self.assertEqual(results, [res.pk for res in MOCK_SEARCH_RESULTS[:23]])
+        # A count, then pages of 2, 4, 8, 8 & 8.
+        self.assertEqual(rsqs.round_trips, 5)
+        self.assertEqual(len(connections['default'].queries), 6)
+        self.assertEqual([query['additional_kwargs']['end_offset'] - query['additional_kwargs']['start_offset'] for query in list(connections['default'].queries)[1:]], [2, 4, 8, 8, 8])
+        
+        reset_search_queries()
+        rsqs = RelatedSearchQuerySet().load_per_query(initial=2, maximum=8)
+        self.assertEqual([int(res.pk) for res in rsqs[0:7]], range(1, 8))
+        # Pages of 2, 4 & 8.
+        self.assertEqual(rsqs.round_trips, 3)
+        self.assertEqual(len(rsqs._result_cache), 14)
+    
+    def test_related_read_ahead(self):
+        rsqs = RelatedSearchQuerySet().read_ahead(2)
+        self.assertEqual(rsqs.all()._read_ahead, 2)
+        self.assertEqual(rsqs.load_all_queryset(MockModel, MockModel.objects.all())._read_ahead, 2)
+        
+        main_thread = threading.currentThread().getName()
+        thread_names = []
+        
+        old_search = MockSearchBackend.search
+        
+        def search(backend, query_string, **kwargs):
+            thread_names.append(threading.currentThread().getName())
+            return old_search(backend, query_string, **kwargs)
+        
+        MockSearchBackend.search = search
+        self.addCleanup(setattr, MockSearchBackend, 'search', old_search)
+        results = [int(res.pk) for res in rsqs]
+        self.assertEqual(results, [res.pk for res in MOCK_SEARCH_RESULTS[:23]])
+        self.assertEqual(rsqs.round_trips, 2)
+        self.assertEqual(len(rsqs), 23)
+        self.assertEqual(len(rsqs._result_cache), 23)
+        # Only the count runs up front, the pages are fetched in the background.
+        self.assertEqual(len(thread_names), 3)
+        self.assertEqual(thread_names.count(main_thread), 1)
+        
+        # Everything's cached now, so there's no more fetching to do.
+        self.assertEqual([int(res.pk) for res in rsqs], results)
+        self.assertEqual(rsqs.round_trips, 2)
+        
+        # Picks up after whatever's cached already.
+        rsqs = RelatedSearchQuerySet().read_ahead()
+        rsqs[0:5]
+        self.assertEqual([int(res.pk) for res in rsqs], results)
+        self.assertEqual(len(rsqs._result_cache), 23)
+    
+    def test_approximate(self):
+        sqs = self.msqs.approximate(10)
+        self.assertTrue(isinstance(sqs, SearchQuerySet))
+        self.assertEqual(sqs.query.count_threshold, 10)
+        self.assertEqual(self.msqs.query.count_threshold, None)
+        self.assertEqual(sqs.approximate(None).query.count_threshold, None)
+        self.assertRaises(ValueError, self.msqs.approximate, 0)
+        
+        # Backends that can't estimate count exactly.
+        self.assertEqual(sqs.count(), 23)
+        self.assertEqual(sqs.count_is_exact(), True)
+        
+        sqs = self.msqs.approximate(10)
+        sqs.query.backend = EstimatingMockSearchBackend('default')
+        self.assertEqual(sqs.count(), 100)
+        self.assertEqual(sqs.count_is_exact(), False)
+        self.assertEqual(connections['default'].queries[-1]['additional_kwargs']['threshold'], 10)
+        
+        # Fetching results replaces the estimate with the real count.
+        self.assertEqual(sqs[0].pk, u'1')
+        self.assertEqual(sqs.count(), 23)
+        self.assertEqual(sqs.count_is_exact(), True)
+        
+        self.assertEqual(self.msqs.count_is_exact(), True)
+        self.assertEqual(EmptySearchQuerySet().approximate().count_is_exact(), True)
+    
+    def test_contradiction(self):
+        sqs = self.msqs.filter(foo='bar').exclude(foo='bar')
+        self.assertEqual(sqs.count(), 0)
+        self.assertEqual(list(sqs), [])
+        self.assertEqual(len(connections['default'].queries), 0)
+        
+        sqs = self.msqs.filter(foo__in=[])
+        self.assertEqual(len(sqs), 0)
+        self.assertEqual(len(connections['default'].queries), 0)
+        
+        self.assertEqual(len(self.msqs.filter(foo__in=[]) | self.msqs.filter(foo='bar')), 23)
+        self.assertEqual(len(connections['default'].queries), 1)
+    
     def test_clone(self):
         results = self.msqs.filter(foo='bar', foo__lt='10')
         
         clone = results._clone()
         self.assertTrue(isinstance(clone, SearchQuerySet))
         self.assertEqual(str(clone.query), str(results.query))
-        self.assertEqual(clone._result_cache, [])
+        self.assertEqual(len(clone._result_cache), 0)
         self.assertEqual(clone._result_count, None)
         self.assertEqual(clone._cache_full, False)
         self.assertEqual(clone._using, results._using)
@@ -753,6 +1533,8 @@ class EmptySearchQuerySetTestCase(TestCase):
 
 if test_pickling:
     class PickleSearchQuerySetTestCase(TestCase):
+        fixtures = ['bulk_data.json']
+        
         def setUp(self):
             super(PickleSearchQuerySetTestCase, self).setUp()
             # Stow.
@@ -793,3 +1575,51 @@ if test_pickling:
             like_a_cuke = pickle.loads(in_a_pickle)
             self.assertEqual(len(like_a_cuke), len(results))
             self.assertEqual(like_a_cuke[0].id, results[0].id)
+        
+        def test_pickling_is_lazy(self):
+            sqs = self.msqs.all()
+            like_a_cuke = pickle.loads(pickle.dumps(sqs))
+            self.assertEqual(len(connections['default'].queries), 0)
+            
+            self.assertEqual(len(like_a_cuke), 23)
+            self.assertEqual(len(connections['default'].queries), 1)
+            
+            # What's been fetched comes along.
+            like_a_cuke = pickle.loads(pickle.dumps(like_a_cuke))
+            self.assertEqual(len(like_a_cuke), 23)
+            self.assertEqual(len(connections['default'].queries), 1)
+        
+        def test_compact(self):
+            results = self.msqs.all()
+            [result for result in results]
+            reset_search_queries()
+            
+            # Just the query.
+            compact = results.compact()
+            in_a_pickle = pickle.dumps(compact)
+            self.assertTrue(len(in_a_pickle) < len(pickle.dumps(results)) / 2)
+            like_a_cuke = pickle.loads(in_a_pickle)
+            self.assertEqual(str(like_a_cuke.query), str(results.query))
+            self.assertEqual(len(connections['default'].queries), 0)
+            self.assertEqual(like_a_cuke[0].pk, results[0].pk)
+            self.assertEqual(len(like_a_cuke), 23)
+            self.assertEqual(len(connections['default'].queries), 1)
+            
+            # A page of results (without their objects) & the count.
+            results[5]._object = MockModel(pk=6)
+            like_a_cuke = pickle.loads(pickle.dumps(results.compact(5, 10)))
+            self.assertEqual(len(like_a_cuke), 23)
+            self.assertEqual([result.pk for result in like_a_cuke[5:10]], [result.pk for result in results[5:10]])
+            self.assertEqual(like_a_cuke[5]._object, None)
+            self.assertEqual(results[5]._object.pk, 6)
+            self.assertEqual(len(connections['default'].queries), 1)
+            
+            # Anything else still needs fetching.
+            self.assertEqual(like_a_cuke[0].pk, results[0].pk)
+            self.assertEqual(len(connections['default'].queries), 2)
+            
+            # Pages that haven't been fetched yet are.
+            like_a_cuke = pickle.loads(pickle.dumps(self.msqs.compact(0, 5)))
+            self.assertEqual(len(connections['default'].queries), 3)
+            self.assertEqual(len(like_a_cuke[:5]), 5)
+            self.assertEqual(len(connections['default'].queries), 3)
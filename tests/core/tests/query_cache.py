@@ -0,0 +1,175 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from haystack import connections, reset_search_queries
+from haystack.query import SearchQuerySet
+from haystack.query_cache import BaseQueryCache, DjangoQueryCache
+from haystack.utils.loading import UnifiedIndex
+from core.models import MockModel, AnotherMockModel
+from core.tests.views import BasicMockModelSearchIndex
+
+
+class BaseQueryCacheTestCase(TestCase):
+    def test_not_implemented(self):
+        query_cache = BaseQueryCache('default')
+        self.assertEqual(query_cache.timeout, 300)
+        self.assertRaises(NotImplementedError, query_cache.get, 'foo')
+        self.assertRaises(NotImplementedError, query_cache.set, 'foo', 'bar')
+        self.assertRaises(NotImplementedError, query_cache.get_generations, [MockModel])
+        self.assertRaises(NotImplementedError, query_cache.invalidate, MockModel)
+    
+    def test_generation_key(self):
+        query_cache = BaseQueryCache('default')
+        self.assertEqual(query_cache.generation_key(MockModel), 'haystack:default:generation:core.mockmodel')
+
+
+class DjangoQueryCacheTestCase(TestCase):
+    def setUp(self):
+        super(DjangoQueryCacheTestCase, self).setUp()
+        cache.clear()
+        self.query_cache = DjangoQueryCache('default', timeout=60)
+    
+    def test_make_key(self):
+        key = self.query_cache.make_key('search', u'foo', {'narrow_queries': set(['a:1', 'b:2']), 'start_offset': 0}, [MockModel])
+        self.assertTrue(key.startswith('haystack:default:query:'))
+        
+        # Argument & model order don't matter.
+        self.assertEqual(self.query_cache.make_key('search', u'foo', {'start_offset': 0, 'narrow_queries': set(['b:2', 'a:1'])}, [MockModel]), key)
+        self.assertEqual(self.query_cache.make_key('search', u'foo', {}, [MockModel, AnotherMockModel]), self.query_cache.make_key('search', u'foo', {}, [AnotherMockModel, MockModel]))
+        
+        # Anything else does.
+        self.assertNotEqual(self.query_cache.make_key('count', u'foo', {'narrow_queries': set(['a:1', 'b:2']), 'start_offset': 0}, [MockModel]), key)
+        self.assertNotEqual(self.query_cache.make_key('search', u'bar', {'narrow_queries': set(['a:1', 'b:2']), 'start_offset': 0}, [MockModel]), key)
+        self.assertNotEqual(self.query_cache.make_key('search', u'foo', {'narrow_queries': set(['a:1']), 'start_offset': 0}, [MockModel]), key)
+        self.assertNotEqual(self.query_cache.make_key('search', u'foo', {'narrow_queries': set(['a:1', 'b:2']), 'start_offset': 10}, [MockModel]), key)
+        self.assertNotEqual(self.query_cache.make_key('search', u'foo', {'narrow_queries': set(['a:1', 'b:2']), 'start_offset': 0}, [AnotherMockModel]), key)
+        
+        # As do other connections.
+        self.assertNotEqual(DjangoQueryCache('other').make_key('search', u'foo', {'narrow_queries': set(['a:1', 'b:2']), 'start_offset': 0}, [MockModel]), key)
+    
+    def test_invalidate(self):
+        key = self.query_cache.make_key('search', u'foo', {}, [MockModel, AnotherMockModel])
+        other_key = self.query_cache.make_key('search', u'foo', {}, [AnotherMockModel])
+        self.assertEqual(self.query_cache.make_key('search', u'foo', {}, [MockModel, AnotherMockModel]), key)
+        
+        self.query_cache.invalidate(MockModel)
+        self.assertNotEqual(self.query_cache.make_key('search', u'foo', {}, [MockModel, AnotherMockModel]), key)
+        self.assertEqual(self.query_cache.make_key('search', u'foo', {}, [AnotherMockModel]), other_key)
+        
+        # Invalidating before anything was cached works too.
+        cache.clear()
+        self.query_cache.invalidate(MockModel)
+        self.assertEqual(len(self.query_cache.get_generations([MockModel])), 1)
+    
+    def test_fetch(self):
+        calls = []
+        
+        def search():
+            calls.append(1)
+            return {'results': [], 'hits': 0}
+        
+        self.assertEqual(self.query_cache.fetch('search', u'foo', {}, [MockModel], search), {'results': [], 'hits': 0})
+        self.assertEqual(self.query_cache.fetch('search', u'foo', {}, [MockModel], search), {'results': [], 'hits': 0})
+        self.assertEqual(len(calls), 1)
+        
+        self.query_cache.fetch('search', u'bar', {}, [MockModel], search)
+        self.assertEqual(len(calls), 2)
+        
+        self.query_cache.invalidate(MockModel)
+        self.query_cache.fetch('search', u'foo', {}, [MockModel], search)
+        self.assertEqual(len(calls), 3)
+
+
+class QueryCacheSearchQuerySetTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+    
+    def setUp(self):
+        super(QueryCacheSearchQuerySetTestCase, self).setUp()
+        cache.clear()
+        
+        # Stow.
+        self.old_unified_index = connections['default']._index
+        self.old_options = connections['default'].options
+        self.old_debug = settings.DEBUG
+        settings.DEBUG = True
+        
+        self.ui = UnifiedIndex()
+        self.bmmsi = BasicMockModelSearchIndex()
+        self.ui.build(indexes=[self.bmmsi])
+        connections['default']._index = self.ui
+        connections['default'].options = dict(self.old_options, QUERY_CACHE='haystack.query_cache.DjangoQueryCache', QUERY_CACHE_TIMEOUT=60)
+        connections['default']._query_cache = None
+        
+        backend = connections['default'].get_backend()
+        backend.clear()
+        backend.update(self.bmmsi, MockModel.objects.all())
+        
+        reset_search_queries()
+    
+    def tearDown(self):
+        # Restore.
+        connections['default']._index = self.old_unified_index
+        connections['default'].options = self.old_options
+        connections['default']._query_cache = None
+        settings.DEBUG = self.old_debug
+        super(QueryCacheSearchQuerySetTestCase, self).tearDown()
+    
+    def test_get_query_cache(self):
+        query_cache = connections['default'].get_query_cache()
+        self.assertTrue(isinstance(query_cache, DjangoQueryCache))
+        self.assertEqual(query_cache.timeout, 60)
+        self.assertTrue(connections['default'].get_query_cache() is query_cache)
+        
+        connections['default'].options = self.old_options
+        connections['default']._query_cache = None
+        self.assertEqual(connections['default'].get_query_cache(), None)
+    
+    def test_cached_search(self):
+        results = [result.pk for result in SearchQuerySet()[:5]]
+        self.assertEqual(len(connections['default'].queries), 1)
+        
+        self.assertEqual([result.pk for result in SearchQuerySet()[:5]], results)
+        self.assertEqual(len(connections['default'].queries), 1)
+        
+        # Different slices are different searches.
+        self.assertEqual(len(SearchQuerySet()[5:10]), 5)
+        self.assertEqual(len(connections['default'].queries), 2)
+    
+    def test_cached_count(self):
+        self.assertEqual(SearchQuerySet().count(), 23)
+        self.assertEqual(len(connections['default'].queries), 1)
+        
+        self.assertEqual(SearchQuerySet().count(), 23)
+        self.assertEqual(len(connections['default'].queries), 1)
+    
+    def test_invalidation(self):
+        self.assertEqual(SearchQuerySet().count(), 23)
+        self.assertEqual(len(connections['default'].queries), 1)
+        
+        mock = MockModel.objects.get(pk=1)
+        self.bmmsi.remove_object(mock)
+        self.assertEqual(SearchQuerySet().count(), 22)
+        self.assertEqual(len(connections['default'].queries), 2)
+        
+        self.bmmsi.update_object(mock)
+        self.assertEqual(SearchQuerySet().count(), 23)
+        self.assertEqual(len(connections['default'].queries), 3)
+        
+        self.assertEqual(SearchQuerySet().count(), 23)
+        self.assertEqual(len(connections['default'].queries), 3)
+    
+    def test_management_commands(self):
+        self.assertEqual(SearchQuerySet().count(), 23)
+        self.assertEqual(len(connections['default'].queries), 1)
+        
+        call_command('clear_index', interactive=False, verbosity=0)
+        self.assertEqual(SearchQuerySet().count(), 0)
+        self.assertEqual(len(connections['default'].queries), 2)
+        
+        call_command('update_index', verbosity=0)
+        self.assertEqual(SearchQuerySet().count(), 23)
+        self.assertEqual(len(connections['default'].queries), 3)
+        
+        self.assertEqual(SearchQuerySet().count(), 23)
+        self.assertEqual(len(connections['default'].queries), 3)
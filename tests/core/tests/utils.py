@@ -1,5 +1,5 @@
 from django.test import TestCase
-from haystack.utils import get_identifier, get_facet_field_name, Highlighter
+from haystack.utils import get_identifier, get_facet_field_name, Highlighter, LRUCache
 from core.models import MockModel
 
 
@@ -134,3 +134,52 @@ class HighlighterTestCase(TestCase):
         self.assertEqual(highlighter.highlight(self.document_1), u'...<span class="highlighted">detection</span>. This is only a test. Were this an actual emergency, your text would have exploded in mid-...')
         self.assertEqual(highlighter.highlight(self.document_2), u'...<span class="highlighted">content</span> of words in no particular order causes nothing to occur.')
         self.assertEqual(highlighter.highlight(self.document_3), u'This is a test of the highlightable words <span class="highlighted">detection</span>. This is only a test. Were this an actual emerge...')
+
+
+class LRUCacheTestCase(TestCase):
+    def test_get_set(self):
+        cache = LRUCache(2)
+        self.assertEqual(cache.get('foo'), None)
+        
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertEqual(cache.get('bar'), 2)
+        
+        # The least recently used entry makes way.
+        cache.get('foo')
+        cache.set('baz', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('bar'), None)
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertEqual(cache.get('baz'), 3)
+        
+        # Setting an existing key updates it & counts as a use.
+        cache.set('foo', 4)
+        cache.set('qux', 5)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('baz'), None)
+        self.assertEqual(cache.get('foo'), 4)
+        
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get('foo'), None)
+    
+    def test_eviction_order(self):
+        cache = LRUCache(100)
+        
+        for i in xrange(150):
+            cache.set(i, i)
+            
+            # Keep the first one in use.
+            cache.get(0)
+        
+        self.assertEqual(len(cache), 100)
+        self.assertEqual(cache.get(0), 0)
+        self.assertEqual([i for i in xrange(150) if cache.get(i) is not None], [0] + range(51, 150))
+    
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set('foo', 1)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get('foo'), None)
@@ -5,3 +5,4 @@ from solr_tests.tests.admin import *
 from solr_tests.tests.solr_query import *
 from solr_tests.tests.solr_backend import *
 from solr_tests.tests.templatetags import *
+from solr_tests.tests.pooled_solr import *
@@ -0,0 +1,148 @@
+import logging
+import os
+import threading
+from pysolr import SolrError
+from django.test import TestCase
+from haystack import metrics
+from haystack.backends.solr_backend import SolrSearchBackend, get_multi_search_pool
+from haystack.utils import http_pool
+from core.tests.http_pool import StubHTTPServer
+
+
+SELECT_RESPONSE = '{"responseHeader": {"status": 0, "QTime": 1}, "response": {"numFound": 0, "start": 0, "docs": []}}'
+
+
+class PooledSolrTestCase(TestCase):
+    def setUp(self):
+        super(PooledSolrTestCase, self).setUp()
+        
+        # Stow.
+        self.old_pools = http_pool._pools
+        http_pool._pools = {}
+        self.server = StubHTTPServer()
+        self.server.responses['/solr/select/'] = (200, SELECT_RESPONSE)
+        self.url = 'http://%s:%s/solr' % (self.server.host, self.server.port)
+    
+    def tearDown(self):
+        # Restore.
+        for pools in http_pool.get_connection_pools().values():
+            for pool in pools:
+                pool.clear()
+        
+        http_pool._pools = self.old_pools
+        self.server.stop()
+        super(PooledSolrTestCase, self).tearDown()
+    
+    def test_search(self):
+        sb = SolrSearchBackend('default', URL=self.url, POOL_SIZE=4, POOL_IDLE_TIMEOUT=60)
+        self.assertEqual(sb.conn.pool.size, 4)
+        self.assertEqual(sb.conn.pool.idle_timeout, 60)
+        self.assertEqual(sb.conn.pool.timeout, 10)
+        self.assertEqual(sb.search(u'*:*')['hits'], 0)
+        
+        # Another backend for the connection shares the pool.
+        other_sb = SolrSearchBackend('default', URL=self.url)
+        self.assertTrue(other_sb.conn.pool is sb.conn.pool)
+        self.assertEqual(other_sb.search(u'*:*')['hits'], 0)
+        
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(self.server.client_ports()), 1)
+        stats = sb.conn.pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], 1)
+    
+    def test_multi_search(self):
+        sb = SolrSearchBackend('default', URL=self.url)
+        searches = [(u'*:*', {}), (u'foo', {}), (u'bar', {})]
+        self.assertEqual([results['hits'] for results in sb.multi_search(searches)], [0, 0, 0])
+        self.assertEqual(len(self.server.requests), 3)
+        thread_count = threading.activeCount()
+        
+        # Later batches reuse the same threads.
+        pool = get_multi_search_pool()
+        self.assertEqual([results['hits'] for results in sb.multi_search(searches)], [0, 0, 0])
+        self.assertTrue(get_multi_search_pool() is pool)
+        self.assertEqual(threading.activeCount(), thread_count)
+        self.assertEqual(len(self.server.requests), 6)
+    
+    def test_errors(self):
+        sb = SolrSearchBackend('default', URL=self.url)
+        self.server.responses['/solr/select/'] = (500, '<html><head><title>Broken</title></head><body></body></html>')
+        logger = logging.getLogger('pysolr')
+        old_handlers = logger.handlers
+        logger.handlers = [logging.StreamHandler(open(os.devnull, 'w'))]
+        
+        try:
+            self.assertRaises(SolrError, sb.conn.search, u'*:*')
+        finally:
+            logger.handlers = old_handlers
+        
+        # The connection's still fine for the next request.
+        self.server.responses['/solr/select/'] = (200, SELECT_RESPONSE)
+        self.assertEqual(sb.conn.search(u'*:*').hits, 0)
+        self.assertEqual(sb.conn.pool.stats()['reused'], 1)
+    
+    def test_error_metrics(self):
+        sb = SolrSearchBackend('default', URL=self.url)
+        self.server.responses['/solr/select/'] = (500, '<html><head><title>Broken</title></head><body></body></html>')
+        self.server.responses['/solr/update/'] = (500, '<html><head><title>Broken</title></head><body></body></html>')
+        old_metrics = metrics.registry._metrics
+        metrics.registry.reset()
+        loggers = [logging.getLogger('pysolr'), logging.getLogger('haystack')]
+        old_handlers = [logger.handlers for logger in loggers]
+        
+        for logger in loggers:
+            logger.handlers = [logging.StreamHandler(open(os.devnull, 'w'))]
+        
+        try:
+            # The failures are only logged, but still count as errors.
+            self.assertEqual(sb.search(u'*:*')['hits'], 0)
+            self.assertEqual(sb.count(u'*:*'), 0)
+            sb.remove('core.mockmodel.1')
+            sb.clear()
+            
+            self.server.responses['/solr/select/'] = (200, SELECT_RESPONSE)
+            self.assertEqual(sb.search(u'*:*')['hits'], 0)
+            summary = metrics.registry.summary()['default']
+        finally:
+            metrics.registry._metrics = old_metrics
+            
+            for logger, handlers in zip(loggers, old_handlers):
+                logger.handlers = handlers
+        
+        self.assertEqual(summary['search']['count'], 2)
+        self.assertEqual(summary['search']['errors'], 1)
+        self.assertEqual(summary['count']['count'], 1)
+        self.assertEqual(summary['count']['errors'], 1)
+        self.assertEqual(summary['remove']['errors'], 1)
+        self.assertEqual(summary['clear']['errors'], 1)
+    
+    def test_broken_responses(self):
+        sb = SolrSearchBackend('default', URL=self.url)
+        self.server.truncate_responses = True
+        logged = []
+        
+        class ListHandler(logging.Handler):
+            def emit(self, record):
+                logged.append(record.getMessage())
+        
+        loggers = [logging.getLogger('pysolr'), logging.getLogger('haystack')]
+        old_handlers = [logger.handlers for logger in loggers]
+        
+        for logger in loggers:
+            logger.handlers = [ListHandler()]
+        
+        try:
+            # Reported as a failed search, rather than raised.
+            self.assertEqual(sb.search(u'*:*')['hits'], 0)
+            self.assertRaises(SolrError, sb.conn.search, u'*:*')
+        finally:
+            for logger, handlers in zip(loggers, old_handlers):
+                logger.handlers = handlers
+        
+        self.assertTrue([message for message in logged if message.startswith("Failed to query Solr using '*:*'") and 'IncompleteRead' in message])
+    
+    def test_no_pool(self):
+        sb = SolrSearchBackend('default', URL=self.url, POOL_SIZE=None)
+        self.assertEqual(sb.conn.pool, None)
+        self.assertEqual(http_pool.get_connection_pools(), {})
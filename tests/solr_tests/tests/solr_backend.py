@@ -7,7 +7,7 @@ from django.test import TestCase
 from haystack import connections, connection_router, reset_search_queries
 from haystack import indexes
 from haystack.models import SearchResult
-from haystack.query import SearchQuerySet, RelatedSearchQuerySet, SQ
+from haystack.query import SearchQuerySet, RelatedSearchQuerySet, SQ, multi_search
 from haystack.utils.loading import UnifiedIndex
 from core.models import MockModel, AnotherMockModel, AFourthMockModel
 from core.tests.mocks import MockSearchResult
@@ -310,6 +310,63 @@ class SolrSearchBackendTestCase(TestCase):
         # Restore.
         settings.HAYSTACK_LIMIT_TO_REGISTERED_MODELS = old_limit_to_registered_models
     
+    def test_count(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        self.assertEqual(self.raw_solr.search('*:*').hits, 3)
+        
+        self.assertEqual(self.sb.count(''), 0)
+        self.assertEqual(self.sb.count('*:*'), 3)
+        self.assertEqual(self.sb.count('Index'), 3)
+        self.assertEqual(self.sb.count('Indx'), 0)
+        self.assertEqual(self.sb.count('*:*', narrow_queries=set(['name:daniel1'])), 1)
+    
+    def test_search_values(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        results = self.sb.search('Index', values=['name', 'missing'], sort_by='name asc')
+        self.assertEqual(results['hits'], 3)
+        self.assertEqual(results['results'], [
+            {'name': u'daniel1', 'missing': None},
+            {'name': u'daniel2', 'missing': None},
+            {'name': u'daniel3', 'missing': None},
+        ])
+        self.assertEqual(self.sb.search('Index', values=['score'])['results'][0].keys(), ['score'])
+    
+    def test_search_fields(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        result = self.sb.search('Index', fields=['name'])['results'][0]
+        self.assertEqual(result.name, u'daniel1')
+        self.assertFalse('text' in result.__dict__)
+        
+        self.assertEqual(self.sb.fetch_fields('core.mockmodel.1', self.smmi, ['name', 'text']), {'name': u'daniel1', 'text': u'Indexed!\n1'})
+        self.assertEqual(self.sb.fetch_fields('core.mockmodel.100', self.smmi, ['name']), None)
+    
+    def test_facet_counts(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        self.assertEqual(self.sb.facet_counts('', facets=['name']), {'hits': 0, 'facets': {}})
+        results = self.sb.facet_counts('Index', facets=['name'], query_facets=[('name', '[* TO e]')])
+        self.assertEqual(results['hits'], 3)
+        self.assertEqual(results['facets']['fields']['name'], [('daniel1', 1), ('daniel2', 1), ('daniel3', 1)])
+        self.assertEqual(results['facets']['queries'], {'name:[* TO e]': 3})
+        self.assertEqual(results['facets'], self.sb.search('Index', facets=['name'], query_facets=[('name', '[* TO e]')])['facets'])
+        
+        results = self.sb.facet_counts('Index', facets=['name'], narrow_queries=set(['name:daniel1']))
+        self.assertEqual(results['hits'], 1)
+        self.assertEqual(results['facets']['fields']['name'], [('daniel1', 1)])
+    
+    def test_multi_search(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        results = self.sb.multi_search([
+            ('*:*', {}),
+            ('*:*', {'narrow_queries': set(['name:daniel1'])}),
+            ('Indx', {}),
+        ])
+        self.assertEqual([result['hits'] for result in results], [3, 1, 0])
+        self.assertEqual(self.sb.multi_search([]), [])
+    
     def test_more_like_this(self):
         self.sb.update(self.smmi, self.sample_objs)
         self.assertEqual(self.raw_solr.search('*:*').hits, 3)
@@ -319,6 +376,18 @@ class SolrSearchBackendTestCase(TestCase):
         self.assertEqual(self.sb.more_like_this(self.sample_objs[0])['hits'], 0)
         self.assertEqual([result.pk for result in self.sb.more_like_this(self.sample_objs[0])['results']], [])
     
+    def test_build_models_filter(self):
+        self.assertEqual(self.sb.build_models_filter(), u'django_ct:(core.mockmodel)')
+        self.assertEqual(self.ui.models_filter_cache['solr'], u'django_ct:(core.mockmodel)')
+        
+        self.ui.build(indexes=[self.smmi, SolrAnotherMockModelSearchIndex()])
+        self.assertEqual(self.sb.build_models_filter(), u'django_ct:(core.anothermockmodel OR core.mockmodel)')
+        
+        self.ui.build(indexes=[])
+        self.assertEqual(self.sb.build_models_filter(), None)
+        
+        self.ui.build(indexes=[self.smmi])
+    
     def test_build_schema(self):
         old_ui = connections['default'].get_unified_index()
         
@@ -658,7 +727,7 @@ class LiveSolrSearchQuerySetTestCase(TestCase):
         sqs = self.sqs.all()
         results = [int(result.pk) for result in sqs]
         self.assertEqual(results, range(1, 24))
-        self.assertEqual(len(connections['default'].queries), 3)
+        self.assertEqual(len(connections['default'].queries), 2)
     
     def test_slice(self):
         reset_search_queries()
@@ -684,6 +753,33 @@ class LiveSolrSearchQuerySetTestCase(TestCase):
         # Should only execute one query to count the length of the result set.
         self.assertEqual(len(connections['default'].queries), 1)
     
+    def test_multi_search(self):
+        reset_search_queries()
+        everything, latest = multi_search([self.sqs.all(), self.sqs.order_by('-pub_date').load_per_query(5)])
+        self.assertEqual(len(connections['default'].queries), 2)
+        self.assertEqual(len(everything), 23)
+        self.assertEqual(int(everything[0].pk), 1)
+        self.assertEqual(len(latest[:5]), 5)
+        self.assertEqual(len(connections['default'].queries), 2)
+    
+    def test_cursor_page(self):
+        reset_search_queries()
+        page = self.sqs.order_by('pub_date').cursor_page(page_size=10)
+        self.assertEqual(len(page), 10)
+        self.assertEqual(page.has_next(), True)
+        self.assertEqual(len(connections['default'].queries), 1)
+        self.assertEqual(connections['default'].queries[0]['additional_kwargs']['cursor'], '*')
+        
+        results = list(page)
+        
+        while page.has_next():
+            page = self.sqs.order_by('pub_date').cursor_page(page.next_cursor, page_size=10)
+            results.extend(page)
+        
+        self.assertEqual(len(page), 3)
+        self.assertEqual(sorted([int(result.pk) for result in results]), range(1, 24))
+        self.assertEqual(len(connections['default'].queries), 3)
+    
     def test_manual_iter(self):
         results = self.sqs.all()
         
@@ -691,7 +787,7 @@ class LiveSolrSearchQuerySetTestCase(TestCase):
         self.assertEqual(len(connections['default'].queries), 0)
         results = [int(result.pk) for result in results._manual_iter()]
         self.assertEqual(results, range(1, 24))
-        self.assertEqual(len(connections['default'].queries), 3)
+        self.assertEqual(len(connections['default'].queries), 2)
     
     def test_fill_cache(self):
         reset_search_queries()
@@ -713,7 +809,7 @@ class LiveSolrSearchQuerySetTestCase(TestCase):
         results = self.sqs.all()
         fire_the_iterator_and_fill_cache = [result for result in results]
         self.assertEqual(results._cache_is_full(), True)
-        self.assertEqual(len(connections['default'].queries), 3)
+        self.assertEqual(len(connections['default'].queries), 2)
     
     def test___and__(self):
         sqs1 = self.sqs.filter(content='foo')
@@ -731,7 +827,7 @@ class LiveSolrSearchQuerySetTestCase(TestCase):
         
         self.assertTrue(isinstance(sqs, SearchQuerySet))
         self.assertEqual(len(sqs.query.query_filter), 3)
-        self.assertEqual(sqs.query.build_query(), u'(NOT (title:moof) AND (foo OR baz) AND bar)')
+        self.assertEqual(sqs.query.build_query(), u'(bar AND NOT (title:moof) AND (foo OR baz))')
     
     def test___or__(self):
         sqs1 = self.sqs.filter(content='foo')
@@ -749,7 +845,7 @@ class LiveSolrSearchQuerySetTestCase(TestCase):
         
         self.assertTrue(isinstance(sqs, SearchQuerySet))
         self.assertEqual(len(sqs.query.query_filter), 2)
-        self.assertEqual(sqs.query.build_query(), u'((NOT (title:moof) AND (foo OR baz)) OR bar)')
+        self.assertEqual(sqs.query.build_query(), u'(bar OR (NOT (title:moof) AND (foo OR baz)))')
     
     def test_auto_query(self):
         # Ensure bits in exact matches get escaped properly as well.
@@ -38,14 +38,14 @@ class SolrSearchQueryTestCase(TestCase):
     
     def test_build_query_multiple_words_or(self):
         self.sq.add_filter(~SQ(content='hello'))
-        self.sq.add_filter(SQ(content='hello'), use_or=True)
-        self.assertEqual(self.sq.build_query(), '(NOT (hello) OR hello)')
+        self.sq.add_filter(SQ(content='world'), use_or=True)
+        self.assertEqual(self.sq.build_query(), '(world OR NOT (hello))')
     
     def test_build_query_multiple_words_mixed(self):
         self.sq.add_filter(SQ(content='why'))
         self.sq.add_filter(SQ(content='hello'), use_or=True)
         self.sq.add_filter(~SQ(content='world'))
-        self.assertEqual(self.sq.build_query(), u'((why OR hello) AND NOT (world))')
+        self.assertEqual(self.sq.build_query(), u'(NOT (world) AND (why OR hello))')
     
     def test_build_query_phrase(self):
         self.sq.add_filter(SQ(content='hello world'))
@@ -64,7 +64,7 @@ class SolrSearchQueryTestCase(TestCase):
         self.sq.add_filter(SQ(title__gte='B'))
         self.sq.add_filter(SQ(id__in=[1, 2, 3]))
         self.sq.add_filter(SQ(rating__range=[3, 5]))
-        self.assertEqual(self.sq.build_query(), u'(why AND pub_date:[* TO "2009-02-10 01:59:00"] AND author:{daniel TO *} AND created:{* TO "2009-02-12 12:13:00"} AND title:[B TO *] AND (id:"1" OR id:"2" OR id:"3") AND rating:[3 TO 5])')
+        self.assertEqual(self.sq.build_query(), u'(why AND author:{daniel TO *} AND created:{* TO "2009-02-12 12:13:00"} AND (id:"1" OR id:"2" OR id:"3") AND pub_date:[* TO "2009-02-10 01:59:00"] AND rating:[3 TO 5] AND title:[B TO *])')
     
     def test_build_query_in_filter_multiple_words(self):
         self.sq.add_filter(SQ(content='why'))
@@ -7,9 +7,11 @@ from django.conf import settings
 from django.utils.datetime_safe import datetime, date
 from django.test import TestCase
 from haystack import connections, connection_router, reset_search_queries
-from haystack import indexes
+from haystack import indexes, instrumentation
+from haystack.exceptions import SearchBackendError
+from haystack.instrumentation import MemorySink
 from haystack.models import SearchResult
-from haystack.query import SearchQuerySet, SQ
+from haystack.query import SearchQuerySet, SQ, multi_search
 from haystack.utils.loading import UnifiedIndex
 from core.models import MockModel, AnotherMockModel, AFourthMockModel
 from core.tests.mocks import MockSearchResult
@@ -187,6 +189,8 @@ class WhooshSearchBackendTestCase(TestCase):
         
         self.assertEqual(self.sb.search(u'Indx')['hits'], 0)
         self.assertEqual(self.sb.search(u'Indx')['spelling_suggestion'], u'index')
+        self.assertEqual(self.sb.search(u'Indx', include_spelling=False)['spelling_suggestion'], None)
+        self.assertEqual(self.sb.search(u'Index', include_spelling=False)['spelling_suggestion'], None)
         
         self.assertEqual(self.sb.search(u'', facets=['name']), {'hits': 0, 'results': []})
         results = self.sb.search(u'Index*', facets=['name'])
@@ -229,6 +233,97 @@ class WhooshSearchBackendTestCase(TestCase):
         # Restore.
         settings.HAYSTACK_LIMIT_TO_REGISTERED_MODELS = old_limit_to_registered_models
     
+    def test_count(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        self.assertEqual(self.sb.count(u''), 0)
+        self.assertEqual(self.sb.count(u'a'), 0)
+        self.assertEqual(self.sb.count(u'*'), 23)
+        self.assertEqual(self.sb.count(u'index*'), 23)
+        self.assertEqual(self.sb.count(u'Indx'), 0)
+        self.assertEqual(self.sb.count(u'*'), self.sb.search(u'*')['hits'])
+        self.assertEqual(self.sb.count(u'*', narrow_queries=set(['name:daniel1'])), 7)
+        self.assertEqual(self.sb.count(u'*', narrow_queries=set(['name:daniel1'])), self.sb.search(u'*', narrow_queries=set(['name:daniel1']))['hits'])
+        
+        self.sb.remove(self.sample_objs[0])
+        self.assertEqual(self.sb.count(u'*'), 22)
+    
+    def test_estimate_count(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        self.assertEqual(self.sb.estimate_count(u'', 5), {'hits': 0, 'exact': True})
+        self.assertEqual(self.sb.estimate_count(u'Indx', 5), {'hits': 0, 'exact': True})
+        self.assertEqual(self.sb.estimate_count(u'*', 100), {'hits': 23, 'exact': True})
+        self.assertEqual(self.sb.estimate_count(u'*', 23), {'hits': 23, 'exact': True})
+        self.assertEqual(self.sb.estimate_count(u'*', 7, narrow_queries=set(['name:daniel1'])), {'hits': 7, 'exact': True})
+        
+        # Past the threshold, the rest gets estimated.
+        self.assertEqual(self.sb.estimate_count(u'*', 5), {'hits': 23, 'exact': False})
+        estimate = self.sb.estimate_count(u'*', 2, narrow_queries=set(['name:daniel1']))
+        self.assertEqual(estimate['exact'], False)
+        self.assertTrue(3 <= estimate['hits'] <= 23)
+    
+    def test_search_values(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        results = self.sb.search(u'*', values=['name', 'pub_date', 'missing'], narrow_queries=set(['name:daniel1']))
+        self.assertEqual(results['hits'], 7)
+        full_result = self.sb.search(u'*', narrow_queries=set(['name:daniel1']))['results'][0]
+        self.assertEqual(results['results'][0], {'name': u'daniel1', 'pub_date': full_result.pub_date, 'missing': None})
+        self.assertTrue(isinstance(self.sb.search(u'*', values=['score'])['results'][0]['score'], float))
+    
+    def test_multi_search(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        results = self.sb.multi_search([
+            (u'*', {}),
+            (u'*', {'narrow_queries': set(['name:daniel1'])}),
+            (u'Indx', {}),
+        ])
+        self.assertEqual([result['hits'] for result in results], [23, 7, 0])
+        self.assertEqual([result.pk for result in results[1]['results']], [result.pk for result in self.sb.search(u'*', narrow_queries=set(['name:daniel1']))['results']])
+        
+        # The shared searcher is gone once the batch is done.
+        self.assertEqual(self.sb._multi_searcher, None)
+        self.assertEqual(self.sb.multi_search([]), [])
+    
+    def test_search_with_cursor(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        results = self.sb.search(u'*', end_offset=10, cursor='*')
+        self.assertEqual(results['hits'], 23)
+        self.assertEqual(len(results['results']), 10)
+        self.assertNotEqual(results['next_cursor'], None)
+        
+        seen = [result.pk for result in results['results']]
+        cursor = results['next_cursor']
+        
+        while cursor is not None:
+            results = self.sb.search(u'*', end_offset=10, cursor=cursor)
+            self.assertEqual(results['hits'], 23)
+            seen.extend([result.pk for result in results['results']])
+            cursor = results['next_cursor']
+        
+        self.assertEqual(len(results['results']), 3)
+        self.assertEqual(sorted([int(pk) for pk in seen]), range(1, 24))
+        
+        # Narrowed.
+        results = self.sb.search(u'*', end_offset=5, cursor='*', narrow_queries=set(['name:daniel1']))
+        self.assertEqual(results['hits'], 7)
+        self.assertEqual(len(results['results']), 5)
+        results = self.sb.search(u'*', end_offset=5, cursor=results['next_cursor'], narrow_queries=set(['name:daniel1']))
+        self.assertEqual(len(results['results']), 2)
+        self.assertEqual(results['next_cursor'], None)
+        
+        # Documents removed mid-way through don't throw the cursor off.
+        results = self.sb.search(u'*', end_offset=10, cursor='*')
+        self.sb.remove(self.sample_objs[0])
+        results = self.sb.search(u'*', end_offset=10, cursor=results['next_cursor'])
+        self.assertEqual(len(results['results']), 10)
+        
+        self.assertRaises(SearchBackendError, self.sb.search, u'*', end_offset=10, cursor='junk')
+        self.assertRaises(SearchBackendError, self.sb.search, u'*', end_offset=10, cursor='*', sort_by=['pub_date'])
+    
     def test_search_all_models(self):
         wamsi = WhooshAnotherMockSearchIndex()
         self.ui.build(indexes=[self.wmmi, wamsi])
@@ -240,6 +335,39 @@ class WhooshSearchBackendTestCase(TestCase):
         
         self.ui.build(indexes=[self.wmmi])
     
+    def test_models_filter_cache(self):
+        wamsi = WhooshAnotherMockSearchIndex()
+        self.sb.update(self.wmmi, self.sample_objs)
+        self.sb.update(wamsi, AnotherMockModel.objects.all())
+        self.assertEqual(len(self.whoosh_search(u'*')), 25)
+        
+        # Only the registered models, with the filter for them kept around.
+        self.assertEqual(self.sb.search(u'*')['hits'], 23)
+        self.assertEqual(self.sb.count(u'*'), 23)
+        models_docs = self.ui.models_filter_cache['whoosh_docs'][1]
+        self.assertEqual(len(models_docs), 23)
+        self.assertEqual(self.sb.search(u'*', end_offset=5)['hits'], 23)
+        self.assertTrue(self.ui.models_filter_cache['whoosh_docs'][1] is models_docs)
+        
+        # Changing the index means working it out again.
+        self.sb.remove(self.sample_objs[0])
+        self.sb.update(self.wmmi, [self.sample_objs[0]])
+        self.assertEqual(self.sb.search(u'*')['hits'], 23)
+        self.assertFalse(self.ui.models_filter_cache['whoosh_docs'][1] is models_docs)
+        
+        # As does changing the indexes.
+        self.ui.build(indexes=[self.wmmi, wamsi])
+        self.assertEqual(self.ui.models_filter_cache, {})
+        self.assertEqual(self.sb.search(u'*')['hits'], 25)
+        self.assertEqual(self.sb.count(u'*'), 25)
+        
+        # With no documents for the registered models, there's nothing.
+        self.ui.build(indexes=[WhooshBoostMockSearchIndex()])
+        self.assertEqual(self.sb.search(u'*')['hits'], 0)
+        self.assertEqual(self.sb.count(u'*'), 0)
+        
+        self.ui.build(indexes=[self.wmmi])
+    
     def test_more_like_this(self):
         self.sb.update(self.wmmi, self.sample_objs)
         self.assertEqual(len(self.whoosh_search(u'*')), 23)
@@ -593,7 +721,7 @@ class LiveWhooshSearchQuerySetTestCase(TestCase):
         self.assertEqual(len(sqs), 2)
         
         sqs = self.sqs.auto_query('Indexed!').filter(pub_date__lte=date(2009, 2, 25)).filter(django_id__in=[1, 2]).exclude(name='daniel1')
-        self.assertEqual(sqs.query.build_query(), u"('Indexed!' AND pub_date:[to 20090225000000] AND (django_id:\"1\" OR django_id:\"2\") AND NOT (name:daniel1))")
+        self.assertEqual(sqs.query.build_query(), u"('Indexed!' AND (django_id:\"1\" OR django_id:\"2\") AND pub_date:[to 20090225000000] AND NOT (name:daniel1))")
         self.assertEqual(len(sqs), 1)
         
         sqs = self.sqs.auto_query('re-inker')
@@ -612,6 +740,79 @@ class LiveWhooshSearchQuerySetTestCase(TestCase):
         self.assertEqual(sqs.query.build_query(), u'django_ct:core.mockmodel')
         self.assertEqual(len(sqs), 3)
     
+    def test_cursor_page(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        page = self.sqs.cursor_page(page_size=2)
+        self.assertEqual(len(page), 2)
+        self.assertEqual(page.has_next(), True)
+        
+        next_page = self.sqs.cursor_page(page.next_cursor, page_size=2)
+        self.assertEqual(len(next_page), 1)
+        self.assertEqual(next_page.has_next(), False)
+        self.assertEqual(sorted([result.pk for result in page] + [result.pk for result in next_page]), [u'1', u'2', u'3'])
+    
+    def test_multi_search(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        everything, named = multi_search([self.sqs.all(), self.sqs.filter(name='daniel3')])
+        self.assertEqual(len(everything._result_cache), 3)
+        self.assertEqual(len(everything), 3)
+        self.assertEqual([result.pk for result in named], [u'3'])
+        self.assertEqual(everything.round_trips, 1)
+        self.assertEqual(named.round_trips, 1)
+    
+    def test_values(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        self.assertEqual(sorted(self.sqs.values_list('name', flat=True)), [u'daniel1', u'daniel2', u'daniel3'])
+        self.assertEqual(self.sqs.filter(name='daniel3').values('name')[0], {'name': u'daniel3'})
+        self.assertEqual(self.sqs.filter(name='daniel3').values_list('name', 'text')[0], (u'daniel3', u'Indexed!\n3'))
+    
+    def test_exists_first_last(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        self.assertEqual(self.sqs.filter(name='daniel1').exists(), True)
+        self.assertEqual(self.sqs.filter(name='nobody').exists(), False)
+        
+        sqs = self.sqs.order_by('pub_date')
+        self.assertEqual(sqs.first().pk, u'3')
+        self.assertEqual(sqs.last().pk, u'1')
+        self.assertEqual(self.sqs.order_by('-pub_date').last().pk, u'3')
+        self.assertEqual(self.sqs.filter(name='nobody').first(), None)
+        self.assertEqual(self.sqs.filter(name='nobody').last(), None)
+        
+        # Without an ordering, the last result is fetched by its position.
+        results = [result.pk for result in self.sqs.all()]
+        self.assertEqual(self.sqs.all().last().pk, results[-1])
+        self.assertEqual(self.sqs.all().first().pk, results[0])
+    
+    def test_only_defer(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        # Whoosh reads every stored field anyway, so they're all kept & none
+        # need fetching later.
+        result = self.sqs.filter(name='daniel3').only('name')[0]
+        self.assertEqual(result.name, u'daniel3')
+        self.assertEqual(result.__dict__.get('text'), u'Indexed!\n3')
+        self.assertEqual(result.__dict__.get('_loaded_fields'), None)
+        
+        result = self.sqs.filter(name='daniel3').defer('text')[0]
+        self.assertEqual(result.__dict__.get('text'), u'Indexed!\n3')
+        self.assertTrue(isinstance(result.__dict__.get('pub_date'), datetime))
+        self.assertEqual(result.__dict__.get('_loaded_fields'), None)
+        self.assertEqual(self.sqs.defer('text').query.get_loaded_fields(), None)
+        
+        self.assertEqual(self.sb.fetch_fields(u'core.mockmodel.3', self.wmmi, ['name', 'text']), {'name': u'daniel3', 'text': u'Indexed!\n3'})
+        self.assertEqual(self.sb.fetch_fields(u'core.mockmodel.300', self.wmmi, ['name']), None)
+    
+    def test_async(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        
+        self.assertEqual(self.sqs.acount().get(5), 3)
+        self.assertEqual(self.sqs.filter(name='daniel3').aget(0).get(5).pk, u'3')
+        self.assertEqual(sorted([result.pk for result in self.sqs.aiterator(chunk_size=2)]), [u'1', u'2', u'3'])
+    
     def test_all_regression(self):
         sqs = SearchQuerySet()
         self.assertEqual([result.pk for result in sqs], [])
@@ -717,6 +918,47 @@ class LiveWhooshSearchQuerySetTestCase(TestCase):
         self.assertEqual(results._cache_is_full(), False)
         self.assertEqual(len(connections['default'].queries), 1)
     
+    def test_instrumentation(self):
+        self.sb.update(self.wmmi, self.sample_objs)
+        sink = MemorySink()
+        old_sinks = instrumentation._sinks
+        instrumentation._sinks = [sink]
+        
+        try:
+            self.assertEqual(len(self.sqs.filter(name='daniel1').load_all()[:1]), 1)
+        finally:
+            instrumentation._sinks = old_sinks
+        
+        self.assertEqual(len(sink.records), 1)
+        record = sink.records[0]
+        self.assertEqual(record.action, 'search')
+        self.assertEqual(record.query_string, u'name:daniel1')
+        self.assertEqual(record.hits, 1)
+        self.assertEqual(sorted(record.phases.keys()), ['backend', 'build', 'decode', 'hydrate', 'load_all'])
+    
+    def test_approximate(self):
+        more_samples = []
+        
+        for i in xrange(1, 50):
+            mock = MockModel()
+            mock.id = i
+            mock.author = 'daniel%s' % i
+            mock.pub_date = date(2009, 2, 25) - timedelta(days=i)
+            more_samples.append(mock)
+        
+        self.sb.update(self.wmmi, more_samples)
+        
+        results = self.sqs.all().approximate(10)
+        self.assertEqual(len(results), 49)
+        self.assertEqual(results.count_is_exact(), False)
+        
+        results = self.sqs.all().approximate(100)
+        self.assertEqual(len(results), 49)
+        self.assertEqual(results.count_is_exact(), True)
+        
+        self.assertEqual(self.sqs.all().approximate(1).exists(), True)
+        self.assertEqual(self.sqs.filter(name='nobody').approximate(1).count(), 0)
+    
     def test_result_class(self):
         self.sb.update(self.wmmi, self.sample_objs)
         
@@ -4,6 +4,7 @@ import shutil
 from django.conf import settings
 from django.test import TestCase
 from haystack import connections
+from haystack.backends import QUERY_STRING_CACHE
 from haystack.models import SearchResult
 from haystack.query import SQ
 from core.models import MockModel, AnotherMockModel
@@ -51,7 +52,7 @@ class WhooshSearchQueryTestCase(TestCase):
     def test_build_query_multiple_words_mixed(self):
         self.sq.add_filter(SQ(content='why') | SQ(content='hello'))
         self.sq.add_filter(~SQ(content='world'))
-        self.assertEqual(self.sq.build_query(), u'((why OR hello) AND NOT (world))')
+        self.assertEqual(self.sq.build_query(), u'(NOT (world) AND (why OR hello))')
     
     def test_build_query_phrase(self):
         self.sq.add_filter(SQ(content='hello world'))
@@ -70,7 +71,7 @@ class WhooshSearchQueryTestCase(TestCase):
         self.sq.add_filter(SQ(title__gte='B'))
         self.sq.add_filter(SQ(id__in=[1, 2, 3]))
         self.sq.add_filter(SQ(rating__range=[3, 5]))
-        self.assertEqual(self.sq.build_query(), u'(why AND pub_date:[to 20090210015900] AND author:{daniel to} AND created:{to 20090212121300} AND title:[B to] AND (id:"1" OR id:"2" OR id:"3") AND rating:[3 to 5])')
+        self.assertEqual(self.sq.build_query(), u'(why AND author:{daniel to} AND created:{to 20090212121300} AND (id:"1" OR id:"2" OR id:"3") AND pub_date:[to 20090210015900] AND rating:[3 to 5] AND title:[B to])')
     
     def test_build_query_in_filter_multiple_words(self):
         self.sq.add_filter(SQ(content='why'))
@@ -128,3 +129,68 @@ class WhooshSearchQueryTestCase(TestCase):
         self.sq.add_filter(SQ(content='why'))
         self.sq.add_filter(SQ(title__in=MockModel.objects.values_list('id', flat=True)))
         self.assertEqual(self.sq.build_query(), u'(why AND (title:"1" OR title:"2" OR title:"3"))')
+    
+    def test_compile_query_filter(self):
+        fragments = []
+        old_build_query_fragment = self.sq.build_query_fragment
+        
+        def build_query_fragment(field, filter_type, value):
+            fragments.append(value)
+            return old_build_query_fragment(field, filter_type, value)
+        
+        self.sq.build_query_fragment = build_query_fragment
+        self.sq.add_filter(SQ(content='hello'))
+        self.sq.add_filter(SQ(title='world'))
+        self.assertEqual(self.sq.build_query(), u'(hello AND title:world)')
+        self.assertEqual(self.sq.build_query(), u'(hello AND title:world)')
+        self.assertEqual(len(fragments), 2)
+        
+        # Clones have the same filters, so they don't need to rebuild them...
+        clone = self.sq._clone()
+        self.assertEqual(clone.build_query(), u'(hello AND title:world)')
+        self.assertEqual(len(fragments), 2)
+        
+        # ...until they change.
+        self.sq.add_filter(~SQ(content='moof'))
+        self.assertEqual(self.sq.build_query(), u'(hello AND title:world AND NOT (moof))')
+        self.assertEqual(len(fragments), 5)
+        self.assertEqual(clone.build_query(), u'(hello AND title:world)')
+        
+        # Models & boosts aren't part of the compiled filters.
+        self.sq.add_model(MockModel)
+        self.assertEqual(self.sq.build_query(), u'((hello AND title:world AND NOT (moof))) AND (django_ct:core.mockmodel)')
+        self.assertEqual(len(fragments), 5)
+    
+    def test_query_string_cache(self):
+        old_size = QUERY_STRING_CACHE.size
+        QUERY_STRING_CACHE.size = 10
+        QUERY_STRING_CACHE.clear()
+        
+        try:
+            self.sq.add_filter(SQ(content='hello'))
+            self.sq.add_filter(SQ(title__in=['foo', 1]))
+            self.assertEqual(self.sq.build_query(), u'(hello AND (title:"foo" OR title:"1"))')
+            self.assertEqual(len(QUERY_STRING_CACHE), 1)
+            
+            # The same filters on another query come straight from the cache.
+            sq = connections['default'].get_query()
+            sq.build_query_fragment = None
+            sq.add_filter(SQ(content='hello'))
+            sq.add_filter(SQ(title__in=['foo', 1]))
+            self.assertEqual(sq.build_query(), u'(hello AND (title:"foo" OR title:"1"))')
+            
+            # Values that only look the same don't.
+            sq = connections['default'].get_query()
+            sq.add_filter(SQ(content='hello'))
+            sq.add_filter(SQ(title__in=['foo', True]))
+            self.assertEqual(sq.build_query(), u'(hello AND (title:"foo" OR title:"true"))')
+            self.assertEqual(len(QUERY_STRING_CACHE), 2)
+            
+            # Nor do values that can't be compared safely.
+            sq = connections['default'].get_query()
+            sq.add_filter(SQ(title__in=MockModel.objects.values_list('pk', flat=True)))
+            sq.build_query()
+            self.assertEqual(len(QUERY_STRING_CACHE), 2)
+        finally:
+            QUERY_STRING_CACHE.size = old_size
+            QUERY_STRING_CACHE.clear()